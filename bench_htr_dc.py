@@ -0,0 +1,166 @@
+"""Benchmarks htr_dc_stats on synthetic heater telemetry (see synthetic.py)
+at several timeframe scales, checks the detected cycles against the
+generated ground truth (and, in minmax mode, against full resolution
+detection), and appends one JSON record per scale and mode to a
+results file.  With --baseline, each stage is compared to the most recent
+matching record of a previous results file and the run fails if any stage
+slowed down by more than --slowdown or any detection check failed.
+
+usage:  python bench_htr_dc.py [--scales 90d,1yr,mission] [--stream] [--minmax]
+                               [--out bench_results.jsonl]
+                               [--baseline bench_results.jsonl] [--slowdown 1.5]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+import htr_dc as htr_dc_module
+from synthetic import HeaterModel, SyntheticSource, match_cycles
+from coarse import compare_cycles
+
+# Fixed end of every benchmark timeframe, so runs are comparable
+T_STOP = '2025:001'
+
+# Timeframes benchmarked:  name, start
+SCALES = [('90d', DateTime(T_STOP).secs - 90 * 86400.),
+          ('1yr', DateTime(T_STOP).secs - 365 * 86400.),
+          ('mission', '2008:001')]
+
+# Detection settings for the default HeaterModel (set points 60 and 70 deg F)
+MSID = 'SYNTH1T'
+PARTNER = 'SYNTH2T'
+DETECT = {'on_range':[55, 64], 'off_range':[66, 75], 'dur_lim':4 * 3600.,
+          'dropout_pairs':[(MSID, PARTNER, 10)]}
+
+# Detected cycles must be within this of the true on/off times [sec]
+TOL = 600.
+
+# Minimum fraction of true cycles found (and of found cycles that are true)
+MIN_RECALL = 0.95
+MIN_PRECISION = 0.95
+
+def git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_scale(scale, t_start, mode='memory', seed=0, plots=False):
+    """This function runs htr_dc_stats on a synthetic heater over one
+    timeframe and returns the benchmark record.  mode is 'memory' (fetch the
+    whole timeframe at once), 'stream' (30-day chunks) or 'minmax' (5-minute
+    mins and maxes refined at full resolution; the record also reports how
+    the cycles differ from full resolution detection).
+    """
+    t0 = time.time()
+    source = SyntheticSource(t_start, T_STOP, seed=seed)
+    truth = source.add_heater(MSID, HeaterModel(), partner=PARTNER)
+    t_gen = time.time() - t0
+
+    chunk_days = 30 if mode == 'stream' else None
+    resolution = '5min' if mode == 'minmax' else None
+    result = htr_dc_module.htr_dc_stats(MSID, DateTime(t_start).date, T_STOP, name='Synthetic',
+                                        source=source, chunk_days=chunk_days, 
+                                        resolution=resolution, **DETECT)
+    stages = dict(result.timings)
+    if plots:
+        from htr_dc_plots import render
+        t0 = time.time()
+        render(result, force=True)
+        stages['plots'] = time.time() - t0
+    check = match_cycles(result.cycles['t_on'], result.cycles['t_off'], truth, TOL)
+    check['ok'] = bool(check['recall'] >= MIN_RECALL and check['precision'] >= MIN_PRECISION)
+    if mode == 'minmax':
+        full = htr_dc_module.htr_dc_stats(MSID, DateTime(t_start).date, T_STOP, source=source,
+                                          **DETECT)
+        check['vs_full'] = compare_cycles(full.cycles, result.cycles)
+        check['refinement'] = result.refinement
+    return {'date':DateTime().date, 'commit':git_commit(), 'host':platform.node(),
+            'python':platform.python_version(), 'numpy':np.__version__,
+            'scale':scale, 'mode':mode, 'seed':seed, 'n_samples':len(truth['times']),
+            'n_dropouts':len(truth['dropouts']), 'n_gaps':len(truth['gaps']),
+            'generate':t_gen, 'stages':stages, 'total':sum(stages.values()),
+            'spans':result.metrics, 'check':check}
+
+def read_results(filename):
+    f = open(filename)
+    out = [json.loads(line) for line in f if line.strip()]
+    f.close()
+    return out
+
+def regressions(record, baseline, slowdown):
+    """This function returns a list of messages for every stage of a record
+    that took more than slowdown times as long as in the latest baseline
+    record with the same scale and mode.  Stages shorter than 10 ms in the
+    baseline are ignored as noise.
+    """
+    base = [b for b in baseline if b['scale'] == record['scale'] and b['mode'] == record['mode']]
+    if len(base) == 0:
+        return []
+    base = base[-1]
+    out = []
+    for stage, secs in sorted(record['stages'].items()):
+        ref = base['stages'].get(stage)
+        if ref != None and ref > 0.01 and secs > slowdown * ref:
+            out.append('%s/%s %s: %.3f s vs %.3f s (%s)' % (record['scale'], record['mode'], stage,
+                                                           secs, ref, base.get('commit')))
+    return out
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark htr_dc on synthetic telemetry')
+    parser.add_argument('--scales', default=','.join(name for name, start in SCALES),
+                        help='Comma-separated timeframes to run')
+    parser.add_argument('--stream', action='store_true', help='Also run in 30-day chunks')
+    parser.add_argument('--minmax', action='store_true', 
+                        help='Also run from 5-minute mins and maxes')
+    parser.add_argument('--plots', action='store_true', help='Also time rendering the figures')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the telemetry')
+    parser.add_argument('--out', default='bench_results.jsonl', help='Results file to append to')
+    parser.add_argument('--baseline', default=None, help='Results file to compare against')
+    parser.add_argument('--slowdown', type=float, default=1.5,
+                        help='Slowdown factor reported as a regression')
+    opt = parser.parse_args(args)
+
+    baseline = read_results(opt.baseline) if opt.baseline != None else []
+    scales = opt.scales.split(',')
+    modes = ['memory'] + (['stream'] if opt.stream else []) + (['minmax'] if opt.minmax else [])
+    failed = []
+    for scale, t_start in SCALES:
+        if scale not in scales:
+            continue
+        for mode in modes:
+            record = run_scale(scale, t_start, mode, opt.seed, opt.plots)
+            f = open(opt.out, 'a')
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+            f.close()
+            print('%s/%s: %d samples, %.3f s total, recall %.3f, precision %.3f' % (
+                  scale, mode, record['n_samples'], record['total'],
+                  record['check']['recall'], record['check']['precision']))
+            for stage, secs in record['stages'].items():
+                print('   %.3f - %s' % (secs, stage))
+            if 'vs_full' in record['check']:
+                print('   vs full resolution:  %(n_missing)d missing, %(n_extra)d extra of '
+                      '%(n_ref)d, on/off within %(max_on_diff).0f/%(max_off_diff).0f s, '
+                      'on-time %(on_time_diff)+.0f s' % record['check']['vs_full'])
+                print('   full resolution fetched for %.1f%% of the timeframe' % (
+                      100 * record['check']['refinement']['fraction']))
+            if not record['check']['ok']:
+                failed.append('%s/%s: cycle check failed %s' % (scale, mode, record['check']))
+            failed.extend(regressions(record, baseline, opt.slowdown))
+
+    for message in failed:
+        print('REGRESSION ' + message)
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,101 @@
+import numpy as np
+
+def _sorted_buckets(idx, vals, n):
+    """Returns the values sorted by bucket along with the start of each
+    occupied bucket in the sorted array and the bucket number it belongs to.
+    """
+    ok = (idx >= 0) & (idx < n)
+    idx = idx[ok]
+    vals = vals[ok]
+    order = np.argsort(idx, kind='mergesort')
+    idx = idx[order]
+    vals = vals[order]
+    starts = np.nonzero(np.diff(idx))[0] + 1
+    starts = np.concatenate([[0], starts]) if len(idx) > 0 else starts
+    return vals, starts, idx[starts]
+
+def bucket_count(idx, n):
+    """Counts the number of entries that fall into each of n buckets."""
+    idx = np.asarray(idx)
+    idx = idx[(idx >= 0) & (idx < n)]
+    return np.bincount(idx, minlength=n)
+
+def bucket_sum(idx, vals, n):
+    """Sums the values that fall into each of n buckets.  Empty buckets
+    sum to zero.
+    """
+    idx = np.asarray(idx)
+    vals = np.asarray(vals, dtype=float)
+    ok = (idx >= 0) & (idx < n)
+    return np.bincount(idx[ok], weights=vals[ok], minlength=n)
+
+def bucket_mean(idx, vals, n):
+    """Averages the values that fall into each of n buckets.  Empty buckets
+    are NaN.
+    """
+    count = bucket_count(idx, n)
+    total = bucket_sum(idx, vals, n)
+    out = np.zeros(n) * np.nan
+    out[count > 0] = total[count > 0] / count[count > 0]
+    return out
+
+def bucket_std(idx, vals, n):
+    """Computes the (population) standard deviation of the values that fall
+    into each of n buckets.  Empty buckets are NaN.
+    """
+    idx = np.asarray(idx)
+    vals = np.asarray(vals, dtype=float)
+    mean = bucket_mean(idx, vals, n)
+    ok = (idx >= 0) & (idx < n)
+    resid = np.zeros(len(vals))
+    resid[ok] = vals[ok] - mean[idx[ok]]
+    count = bucket_count(idx, n)
+    sum_sq = bucket_sum(idx, resid**2, n)
+    out = np.zeros(n) * np.nan
+    out[count > 0] = np.sqrt(sum_sq[count > 0] / count[count > 0])
+    return out
+
+def bucket_min(idx, vals, n):
+    """Finds the minimum of the values that fall into each of n buckets.
+    Empty buckets are NaN.
+    """
+    vals, starts, buckets = _sorted_buckets(np.asarray(idx),
+                                            np.asarray(vals, dtype=float), n)
+    out = np.zeros(n) * np.nan
+    if len(starts) > 0:
+        out[buckets] = np.minimum.reduceat(vals, starts)
+    return out
+
+def bucket_max(idx, vals, n):
+    """Finds the maximum of the values that fall into each of n buckets.
+    Empty buckets are NaN.
+    """
+    vals, starts, buckets = _sorted_buckets(np.asarray(idx),
+                                            np.asarray(vals, dtype=float), n)
+    out = np.zeros(n) * np.nan
+    if len(starts) > 0:
+        out[buckets] = np.maximum.reduceat(vals, starts)
+    return out
+
+def bucket_stats(idx, vals, n, stats=('sum', 'count', 'mean', 'min', 'max', 'std')):
+    """Computes a set of statistics for the values that fall into each of
+    n buckets in a single call.  Returns a dictionary keyed by statistic.
+
+    Inputs:
+       idx     Bucket index for each value (e.g. time_bins.day_number(t) - 
+               day0, that // 7 for weeks, or time_bins.month_number(t) - 
+               month0); entries of -1 are ignored
+       vals    Values to aggregate
+       n       Number of buckets
+       stats   Statistics to compute ('sum', 'count', 'mean', 'min', 'max',
+               'std')
+
+    Empty buckets are zero for 'sum' and 'count' and NaN otherwise.
+    """
+    funcs = {'sum': lambda: bucket_sum(idx, vals, n),
+             'count': lambda: bucket_count(idx, n),
+             'mean': lambda: bucket_mean(idx, vals, n),
+             'min': lambda: bucket_min(idx, vals, n),
+             'max': lambda: bucket_max(idx, vals, n),
+             'std': lambda: bucket_std(idx, vals, n)}
+    return dict((stat, funcs[stat]()) for stat in stats)
@@ -0,0 +1,249 @@
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from tlm_cache import merge_ranges
+from cycles import CycleDetector, stream_cycles, concatenate_cycles
+
+# Engineering archive statistic used to find candidate heater transitions
+STAT = '5min'
+
+# Length of each STAT bin [sec]
+BIN = 328.
+
+# Full-resolution telemetry is fetched this far either side of the bins
+# around each candidate transition [sec]
+PAD = BIN
+
+# Refinement windows closer together than this are fetched as one [sec]
+JOIN = 600.
+
+# If the refinement windows cover more than this fraction of the timeframe,
+# or there are more than MAX_WINDOWS of them per day, the mode doesn't pay
+# off (each window is its own fetch) and the whole timeframe is fetched at
+# full resolution instead
+MAX_FRACTION = 0.1
+MAX_WINDOWS = 2.
+
+def coarse_series(times, mins, maxes):
+    """This function interleaves the min and max of each statistics bin into
+    a single series, in the order the temperature most likely passed through
+    them (min first where the temperature is rising across the bin, max first
+    where it is falling).  Returns times and vals.
+    """
+    times = np.asarray(times, dtype=float)
+    mins = np.asarray(mins, dtype=float)
+    maxes = np.asarray(maxes, dtype=float)
+    mid = (mins + maxes) / 2
+    trend = np.zeros(len(mid))
+    if len(mid) > 2:
+        trend[1:-1] = mid[2:] - mid[:-2]
+    if len(mid) > 1:
+        trend[0] = mid[1] - mid[0]
+        trend[-1] = mid[-1] - mid[-2]
+    rising = trend >= 0
+    first = np.where(rising, mins, maxes)
+    second = np.where(rising, maxes, mins)
+    out_t = np.column_stack([times - BIN / 4, times + BIN / 4]).ravel()
+    out_v = np.column_stack([first, second]).ravel()
+    return out_t, out_v
+
+def _in_range(vals, limits):
+    if limits == None:
+        return np.ones(len(vals), dtype='bool')
+    return (vals > limits[0]) & (vals < limits[1])
+
+def _spans(mins, maxes, limits):
+    if limits == None:
+        return np.ones(len(mins), dtype='bool')
+    return (mins < limits[1]) & (maxes > limits[0])
+
+def candidate_bins(times, mins, maxes, on_range=None, off_range=None):
+    """This function returns the indices of the statistics bins that may hold
+    a heater transition:  local minima of the coarse series within on_range,
+    local maxima within off_range, any bin whose min is within on_range and
+    max within off_range (a whole transition inside one bin), and any bin 
+    holding a local extremum outside its range (e.g. a dropout) whose span
+    reaches into on_range or off_range, since such an extremum can hide a 
+    transition in the same bin.
+    """
+    mins = np.asarray(mins, dtype=float)
+    maxes = np.asarray(maxes, dtype=float)
+    t, v = coarse_series(times, mins, maxes)
+    dt = np.diff(v)
+    dt1_n0 = np.nonzero(dt)[0]
+    dt1 = dt[dt1_n0]
+    local_min = dt1_n0[np.nonzero((dt1[:-1] < 0.) & (dt1[1:] > 0.))[0] + 1]
+    local_max = dt1_n0[np.nonzero((dt1[:-1] > 0.) & (dt1[1:] < 0.))[0]] + 1
+    min_ok = _in_range(v[local_min], on_range)
+    max_ok = _in_range(v[local_max], off_range)
+    whole = np.nonzero(_in_range(mins, on_range) & _in_range(maxes, off_range))[0]
+    #each bin contributes two points to the coarse series
+    rejected = np.concatenate([local_min[~min_ok], local_max[~max_ok]]) // 2
+    spans = _spans(mins[rejected], maxes[rejected], on_range)
+    spans = spans | _spans(mins[rejected], maxes[rejected], off_range)
+    return np.unique(np.concatenate([local_min[min_ok] // 2, local_max[max_ok] // 2, whole,
+                                     rejected[spans]]))
+
+def refine_windows(times, mins, maxes, bins, pad=PAD, join=JOIN):
+    """This function returns the merged nx2 array of time windows to fetch at
+    full resolution around a set of candidate bins.
+
+    Each window spans the run of neighbouring bins whose ranges overlap the
+    candidate's (e.g. the temperature dithering between two telemetry steps
+    at the bottom of a cycle, where the exact "on" can be anywhere), plus pad
+    seconds either side, and always reaches into the neighbouring bins with
+    telemetry (so an extremum just after a gap isn't a window's first
+    sample).  Windows less than join seconds apart are merged.
+    """
+    times = np.asarray(times, dtype=float)
+    mins = np.asarray(mins, dtype=float)
+    maxes = np.asarray(maxes, dtype=float)
+    if len(bins) == 0:
+        return np.zeros((0, 2))
+    overlap = (mins[1:] < maxes[:-1]) & (mins[:-1] < maxes[1:])
+    run = np.concatenate([[0], np.cumsum(~overlap)])
+    first = np.searchsorted(run, run[bins], side='left')
+    last = np.searchsorted(run, run[bins], side='right') - 1
+    before = times[np.maximum(first - 1, 0)] - BIN / 2
+    after = times[np.minimum(last + 1, len(times) - 1)] + BIN / 2
+    windows = np.column_stack([np.minimum(times[first] - BIN / 2 - pad, before),
+                               np.maximum(times[last] + BIN / 2 + pad, after) + join])
+    windows = merge_ranges(windows)
+    windows[:, 1] = windows[:, 1] - join
+    return windows
+
+def break_changes(times, mins, maxes, t_start, t_stop):
+    """This function returns the changes of the coarse series across a break
+    between two times, as for CycleDetector.restart:  the directions of its
+    runs of rising or falling points, and the times and values of the
+    turning points between them.
+    """
+    t, v = coarse_series(times, mins, maxes)
+    k = np.flatnonzero((np.diff(v) != 0) & (t[1:] > t_start) & (t[:-1] < t_stop))
+    signs = np.sign(v[k + 1] - v[k])
+    turn = np.flatnonzero(signs[1:] != signs[:-1])
+    if len(k) > 0:
+        signs = signs[np.concatenate([[0], turn + 1])]
+    return signs, t[k[turn] + 1], v[k[turn] + 1]
+
+def detect_minmax(fetch_chunk, fetch_stat, t_start, t_stop=None, on_range=None, off_range=None, dur_lim=None, hysteresis=None, max_fraction=MAX_FRACTION, max_windows=MAX_WINDOWS, chunk=None):
+    """This function detects heater cycles from 5-minute min/max telemetry,
+    refined to full resolution around each candidate transition.
+
+    The 5-minute mins and maxes (about 100x fewer samples than full
+    resolution) locate the bins that may hold a heater on or off.  Full
+    resolution telemetry is then fetched only in a window around each of
+    these, and each window is fed to one detector in turn.  The detector is
+    restarted at each window (see CycleDetector.restart) with the changes of
+    the coarse series in between, so no extremum is found where two windows
+    meet, while an "on" in one window still pairs with the "off" in a later
+    one.  Any extremum between windows is outside on_range/off_range (or
+    its bin would be a candidate, including a bin where a dropout hides it),
+    so leaving those samples out does not change the cycles found.
+
+    The mode only pays off for heaters that cycle rarely or slowly.  If the
+    windows cover more than max_fraction of the timeframe, or there are
+    more than max_windows of them per day, the whole timeframe is fetched at
+    full resolution instead (in chunks of chunk seconds, if supplied).
+
+    Inputs:
+       fetch_chunk  Function of (t_start, t_stop) returning full resolution
+                    telemetry (an object with .times and .vals)
+       fetch_stat   Function of (t_start, t_stop, stat) returning the
+                    '5min.mins' and '5min.maxes' telemetry
+       chunk        Length of each full resolution fetch in the fallback
+                    [sec] (default is the whole timeframe at once)
+       Others are as for cycles.CycleDetector.
+
+    Returns the cycles (as from CycleDetector.update, with i_on and i_off
+    counted within the refined samples only), the time of the last sample,
+    and a dictionary describing the refinement:  'n_bins', 'n_candidates',
+    'n_windows', 'n_samples' (full resolution samples fetched), 'fraction'
+    (of the timeframe fetched at full resolution) and 'fallback'.
+    """
+    start = DateTime(t_start).secs
+    stop = DateTime(t_stop).secs
+    mins = fetch_stat(start, stop, STAT + '.mins')
+    maxes = fetch_stat(start, stop, STAT + '.maxes')
+    cands = candidate_bins(mins.times, mins.vals, maxes.vals, on_range, off_range)
+    windows = refine_windows(mins.times, mins.vals, maxes.vals, cands)
+    windows = np.clip(windows, start, stop)
+    days = (stop - start) / 86400.
+    fraction = np.sum(windows[:, 1] - windows[:, 0]) / (stop - start) if stop > start else 1.
+    fallback = fraction > max_fraction or len(windows) > max_windows * max(days, 1.)
+    detector = CycleDetector(on_range, off_range, dur_lim, hysteresis)
+    if fallback:
+        found = concatenate_cycles(stream_cycles(fetch_chunk, start, stop,
+                                                 stop - start if chunk == None else chunk,
+                                                 detector))
+        n_windows = 1
+        fraction = 1.
+    else:
+        found = []
+        t_prev = start
+        for w_start, w_stop in windows:
+            x = fetch_chunk(w_start, w_stop)
+            detector.restart(*break_changes(mins.times, mins.vals, maxes.vals, t_prev, w_start))
+            found.append(detector.update(x.times, x.vals))
+            t_prev = w_stop
+        #confirm any extremum at the end of the last window with the first bin
+        #after it where the temperature has moved on (by at least hysteresis)
+        if len(windows) > 0 and detector.t_last != None:
+            t, v = coarse_series(mins.times, mins.vals, maxes.vals)
+            moved = np.abs(v - detector.v_last) >= (hysteresis if hysteresis != None else 0.)
+            k = np.flatnonzero(moved & (v != detector.v_last) & (t > t_prev))
+            if len(k) > 0:
+                w_start = max(t[k[0]] - BIN, t_prev)
+                x = fetch_chunk(w_start, min(t[k[0]] + BIN, stop))
+                detector.restart(*break_changes(mins.times, mins.vals, maxes.vals, t_prev, w_start))
+                found.append(detector.update(x.times, x.vals))
+        found = concatenate_cycles(found)
+        n_windows = len(windows)
+    #the last full resolution sample may be well before t_stop; use the end of
+    #the statistics instead so a store picks up from the right place
+    t_last = detector.t_last
+    if len(maxes.times) > 0 and (t_last == None or maxes.times[-1] > t_last):
+        t_last = maxes.times[-1]
+    info = {'n_bins':len(mins.times), 'n_candidates':len(cands), 'n_windows':n_windows,
+            'n_samples':detector.n, 'fraction':min(fraction, 1.), 'fallback':bool(fallback),
+            't_unpaired':detector.t_unpaired()}
+    return found, t_last, info
+
+def compare_cycles(ref, test, tol=2*BIN):
+    """This function reports how much a set of detected cycles (test, e.g.
+    from detect_minmax) differs from a reference set (ref, e.g. from full
+    resolution).  A reference cycle is matched when a test cycle's on and
+    off times are both within tol seconds of it.
+
+    Returns a dictionary with the number of reference, test and matched
+    cycles, those missing from test and extra in test, and the median and
+    largest on/off time differences and total on-time difference [sec] of
+    the matched cycles.
+    """
+    r_on = np.asarray(ref['t_on'])
+    r_off = np.asarray(ref['t_off'])
+    t_on = np.asarray(test['t_on'])
+    t_off = np.asarray(test['t_off'])
+    out = {'n_ref':len(r_on), 'n_test':len(t_on), 'n_matched':0, 'n_missing':len(r_on),
+           'n_extra':len(t_on), 'med_on_diff':0., 'max_on_diff':0., 'med_off_diff':0.,
+           'max_off_diff':0., 'on_time_diff':0.}
+    if len(r_on) == 0 or len(t_on) == 0:
+        return out
+    j = np.clip(np.searchsorted(t_on, r_on), 1, max(len(t_on) - 1, 1))
+    j = np.where(np.abs(t_on[j - 1] - r_on) <= np.abs(t_on[np.minimum(j, len(t_on) - 1)] - r_on),
+                 j - 1, np.minimum(j, len(t_on) - 1))
+    on_diff = np.abs(t_on[j] - r_on)
+    off_diff = np.abs(t_off[j] - r_off)
+    ok = (on_diff <= tol) & (off_diff <= tol)
+    n_matched = len(np.unique(j[ok]))
+    out.update({'n_matched':n_matched, 'n_missing':len(r_on) - n_matched,
+                'n_extra':len(t_on) - n_matched})
+    if np.any(ok):
+        out.update({'med_on_diff':float(np.median(on_diff[ok])),
+                    'max_on_diff':float(np.max(on_diff[ok])),
+                    'med_off_diff':float(np.median(off_diff[ok])),
+                    'max_off_diff':float(np.max(off_diff[ok])),
+                    'on_time_diff':float(np.sum(t_off[j[ok]] - t_on[j[ok]]) -
+                                         np.sum(r_off[ok] - r_on[ok]))})
+    return out
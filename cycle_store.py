@@ -0,0 +1,114 @@
+import os
+import glob
+import hashlib
+import numpy as np
+
+from energy import RESISTANCE
+
+# Columns saved for each detected heater cycle
+COLUMNS = ['t_on', 't_off', 'dur', 'voltage', 'pwr']
+
+# Telemetry re-fetched before the last stored "off" (or the pending "on") so
+# that a cycle that straddles the end of the previous run is re-paired from
+# scratch [sec]
+OVERLAP = 3600.
+
+def param_key(on_range=None, off_range=None, dur_lim=None, dropout_pairs=None, hysteresis=None, resolution=None, resistance=None):
+    """This function returns a short hash identifying a set of cycle detection
+    parameters (and the heater resistance the stored power was computed
+    with).  Stored cycles are only reused when this key matches.
+    """
+    params = (None if on_range is None else [float(r) for r in on_range],
+              None if off_range is None else [float(r) for r in off_range],
+              None if dur_lim is None else float(dur_lim))
+    #the resistance is always part of the key, so stores written before power
+    #was integrated over each cycle (see energy.py) are recomputed
+    params = params + (('resistance', float(RESISTANCE if resistance is None else resistance)),)
+    if dropout_pairs is not None:
+        params = params + ([(str(a), str(b), float(t)) for a, b, t in dropout_pairs],)
+    if hysteresis != None:
+        params = params + (('hysteresis', float(hysteresis)),)
+    if resolution != None:
+        params = params + (('resolution', str(resolution)),)
+    params = repr(params)
+    return hashlib.sha1(params.encode('ascii')).hexdigest()[:12]
+
+def store_file(store_dir, msid, key):
+    """This function returns the path of the cycle store for a given msid and
+    parameter key.
+    """
+    return os.path.join(store_dir, 'cycles_' + msid + '_' + key + '.npz')
+
+def empty_cycles():
+    """This function returns a cycle table with no entries."""
+    return dict((col, np.zeros(0)) for col in COLUMNS)
+
+def load_cycles(store_dir, msid, key):
+    """This function loads the stored cycle table for a given msid and
+    parameter key.  Returns a dictionary with the cycle columns plus 't_start'
+    (start of the stored timeframe), 't_last' (time of the last telemetry
+    sample processed, None if there was none) and 't_pending' (time of the 
+    earliest extremum not yet paired into a cycle, e.g. an "on" still awaiting
+    its "off", None if there was none), or None if no matching store exists.
+    """
+    filename = store_file(store_dir, msid, key)
+    if not os.path.exists(filename):
+        return None
+    f = np.load(filename)
+    out = dict((col, f[col]) for col in COLUMNS)
+    out['t_start'] = float(f['t_start'])
+    for col in ['t_last', 't_pending']:
+        out[col] = float(f[col]) if col in f.files else np.nan
+        if np.isnan(out[col]):
+            out[col] = None
+    f.close()
+    return out
+
+def save_cycles(store_dir, msid, key, cycles, t_start, t_last, t_pending=None):
+    """This function saves a cycle table for a given msid and parameter key.
+    The file is written to a temporary name and renamed into place so that a
+    failed run never leaves a partial store behind.  Stores for the same msid
+    with other parameter keys are removed.
+    """
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    filename = store_file(store_dir, msid, key)
+    tmp = filename + '.tmp.npz'
+    arrays = dict((col, cycles[col]) for col in COLUMNS)
+    np.savez(tmp, t_start=t_start, t_last=np.nan if t_last == None else t_last, 
+             t_pending=np.nan if t_pending == None else t_pending, **arrays)
+    os.rename(tmp, filename)
+    for old in glob.glob(os.path.join(store_dir, 'cycles_' + msid + '_*.npz')):
+        if old != filename:
+            os.remove(old)
+
+def resume_time(cycles):
+    """This function returns the time from which telemetry must be fetched in
+    order to extend a stored cycle table:  OVERLAP before the later of the
+    last stored "off" and the last telemetry sample processed, so a heater
+    that has stopped cycling (or never cycled) only refetches what's new, but
+    no later than OVERLAP before a pending "on", so an "on" longer than
+    OVERLAP is still paired with its "off".  Returns None if no telemetry has 
+    been processed yet.
+    """
+    ends = []
+    if len(cycles['t_off']) > 0:
+        ends.append(cycles['t_off'][-1])
+    if cycles['t_last'] != None:
+        ends.append(cycles['t_last'])
+    if len(ends) == 0:
+        return None
+    resume = max(ends) - OVERLAP
+    if cycles.get('t_pending') != None:
+        resume = min(resume, cycles['t_pending'] - OVERLAP)
+    return resume
+
+def merge_cycles(old, new):
+    """This function appends newly detected cycles to a stored cycle table,
+    keeping only new cycles that start after the last stored "off".
+    """
+    if len(old['t_off']) > 0:
+        keep = new['t_on'] > old['t_off'][-1]
+    else:
+        keep = np.ones(len(new['t_on']), dtype='bool')
+    return dict((col, np.concatenate([old[col], new[col][keep]])) for col in COLUMNS)
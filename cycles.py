@@ -0,0 +1,308 @@
+import numpy as np
+
+from Chandra.Time import DateTime
+
+# Event types in the filtered sequence of heater transitions
+ON = 0
+OFF = 1
+
+class CycleDetector(object):
+    """Detects heater cycles from a thermistor series that is fed in one chunk
+    at a time, yielding the same cycles as running htr_dc's detection on the
+    whole series at once.
+
+    Heater "on" instances are local minima (the last sample before the
+    temperature starts rising) and "off" instances are local maxima (the
+    first sample after it stops rising), ignoring samples where the
+    temperature does not change.  Each "off" is paired with the last "on"
+    since the previous "off".
+
+    With hysteresis, swings of less than hysteresis between neighbouring
+    extrema are treated as noise (see reduce_extrema):  the minimum and
+    maximum of each small wiggle are dropped, so a noisy dip just after the
+    heater turns on (or a bump just after it turns off) can no longer split
+    or shift a cycle.  An extremum only counts once the temperature has moved
+    at least hysteresis away from it.
+
+    The state carried from one chunk to the next is limited to the last
+    sample, the direction and location of the last temperature change, any
+    extrema not yet confirmed by hysteresis, and any "on" still waiting for
+    its "off", so memory is set by the chunk size alone.
+
+    Inputs:
+       on_range     Temperature range to constrain identified heater "on" instances
+       off_range    Temperature range to constrain identified heater "off" instances
+       dur_lim      Maximum duration for single heater "on" instance
+       hysteresis   Smallest temperature swing treated as a real heater 
+                    transition (default is None, i.e. every change counts)
+
+    e.g. det = CycleDetector(on_range=[58, 63], off_range=[92, 110])
+         for times, vals in chunks:
+             cycles = det.update(times, vals)
+    """
+    def __init__(self, on_range=None, off_range=None, dur_lim=None, hysteresis=None):
+        self.on_range = on_range
+        self.off_range = off_range
+        self.dur_lim = dur_lim
+        self.hysteresis = hysteresis
+        self.n = 0              #samples processed so far
+        self.t_last = None      #time of the last sample processed
+        self.v_last = None      #value of the last sample processed
+        self.sign = 0           #direction of the last temperature change
+        self.after = None       #(t, v, i) of the sample following the last change
+        self.pending = None     #(t, v, i) of an "on" awaiting its "off"
+        self.tail = None        #(t, v, i, kind) of extrema awaiting hysteresis
+        self.gap = None         #(signs, times, vals) of the changes across a break
+
+    def restart(self, signs=(), times=(), vals=()):
+        """Marks a break in the telemetry before the next chunk (e.g. a
+        stretch left out between refinement windows).  The change from the
+        last sample to the first of the next chunk is replaced by signs, the
+        directions (1 or -1) of the temperature changes within the break in
+        order, no two alike in a row (e.g. from 5-minute statistics), and
+        times and vals give the extrema between them (one fewer than signs).
+        These extrema take part in hysteresis but should be outside on_range
+        and off_range, as their times are only approximate.
+        """
+        self.gap = (np.asarray(signs, dtype=float), np.asarray(times, dtype=float),
+                    np.asarray(vals, dtype=float))
+
+    def t_unpaired(self):
+        """Returns the time of the earliest extremum not yet paired into a
+        cycle (the pending "on", or the first extremum awaiting hysteresis),
+        or None if there is none.  Telemetry from before this time is needed
+        to reproduce the detector's state.
+        """
+        times = []
+        if self.pending != None:
+            times.append(self.pending[0])
+        if self.tail != None and len(self.tail[0]) > 0:
+            times.append(self.tail[0][0])
+        if len(times) == 0:
+            return None
+        return min(times)
+
+    def _in_range(self, vals, limits):
+        if limits == None:
+            return np.ones(len(vals), dtype='bool')
+        return (vals > limits[0]) & (vals < limits[1])
+
+    def update(self, times, vals):
+        """Processes the next chunk of telemetry (times must follow those of
+        the previous chunk; any overlap is dropped).  Returns a dictionary of
+        arrays describing the cycles completed within this chunk:  t_on,
+        t_off, v_on, v_off and the sample indices i_on and i_off (counted from
+        the first sample passed to the detector).
+        """
+        times = np.asarray(times)
+        vals = np.asarray(vals)
+        if self.t_last != None:
+            new = times > self.t_last
+            times = times[new]
+            vals = vals[new]
+        if len(times) == 0:
+            return empty_cycles()
+
+        #extend the chunk with the last sample of the previous chunk
+        if self.t_last != None:
+            ext_t = np.concatenate([[self.t_last], times])
+            ext_v = np.concatenate([[self.v_last], vals])
+            i0 = self.n - 1
+        else:
+            ext_t = times
+            ext_v = vals
+            i0 = 0
+        ext_i = np.arange(i0, i0 + len(ext_t))
+
+        #find local extrema, carrying the last change from the previous chunk
+        dt = np.diff(ext_v)
+        dt1_n0 = np.nonzero(dt)[0]
+        sign = np.sign(dt[dt1_n0])
+        pos = dt1_n0
+        if self.gap != None and self.t_last != None:
+            #replace the change across a break with the changes within it
+            across = pos == 0
+            sign = np.concatenate([self.gap[0], sign[~across]])
+            pos = np.concatenate([np.zeros(len(self.gap[0]), dtype=int), pos[~across]])
+        elif self.gap != None and len(self.gap[0]) > 0:
+            self.sign = self.gap[0][-1]
+            self.after = None
+        first = 0
+        if self.sign != 0:
+            sign = np.concatenate([[self.sign], sign])
+            pos = np.concatenate([[-1], pos])
+            first = 1
+        local_min_i = np.nonzero((sign[:-1] < 0.) & (sign[1:] > 0.))[0]
+        local_max_i = np.nonzero((sign[:-1] > 0.) & (sign[1:] < 0.))[0]
+
+        min_pos = pos[local_min_i + 1]
+        on_t = ext_t[min_pos]
+        on_v = ext_v[min_pos]
+        on_i = ext_i[min_pos]
+
+        max_pos = pos[local_max_i] + 1
+        carried = max_pos == 0 #sample following the change carried from the last chunk
+        off_t = ext_t[max_pos].astype(float)
+        off_v = ext_v[max_pos].astype(float)
+        off_i = ext_i[max_pos]
+        if np.any(carried) and self.after != None:
+            off_t[carried] = self.after[0]
+            off_v[carried] = self.after[1]
+            off_i[carried] = self.after[2]
+        #extrema within a break (between two of its changes)
+        for k, ext_t_k, ext_v_k in [(local_min_i, on_t, on_v), (local_max_i, off_t, off_v)]:
+            within = (pos[k] == 0) & (pos[k + 1] == 0)
+            if np.any(within):
+                ext_t_k[within] = self.gap[1][k[within] - first]
+                ext_v_k[within] = self.gap[2][k[within] - first]
+
+        if self.hysteresis != None:
+            on_t, on_v, on_i, off_t, off_v, off_i = self._hysteresis(
+                on_t, on_v, on_i, off_t, off_v, off_i, vals[-1], local_min_i, local_max_i)
+
+        keep_on = self._in_range(on_v, self.on_range)
+        keep_off = self._in_range(off_v, self.off_range)
+
+        #merge into a single time-ordered sequence of transitions
+        ev_t = np.concatenate([on_t[keep_on], off_t[keep_off]])
+        ev_v = np.concatenate([on_v[keep_on], off_v[keep_off]])
+        ev_i = np.concatenate([on_i[keep_on], off_i[keep_off]])
+        ev_k = np.concatenate([np.zeros(np.sum(keep_on), dtype=int) + ON,
+                               np.zeros(np.sum(keep_off), dtype=int) + OFF])
+        if self.pending != None:
+            ev_t = np.concatenate([[self.pending[0]], ev_t])
+            ev_v = np.concatenate([[self.pending[1]], ev_v])
+            ev_i = np.concatenate([[self.pending[2]], ev_i])
+            ev_k = np.concatenate([[ON], ev_k])
+        order = np.argsort(ev_i, kind='mergesort')
+        ev_t = ev_t[order]
+        ev_v = ev_v[order]
+        ev_i = ev_i[order]
+        ev_k = ev_k[order]
+
+        #an "off" completes a cycle if it directly follows an "on"
+        match = np.nonzero((ev_k[:-1] == ON) & (ev_k[1:] == OFF))[0]
+        out = {'t_on': ev_t[match], 't_off': ev_t[match + 1],
+               'v_on': ev_v[match], 'v_off': ev_v[match + 1],
+               'i_on': ev_i[match], 'i_off': ev_i[match + 1]}
+        if self.dur_lim != None:
+            ok = (out['t_off'] - out['t_on']) <= self.dur_lim
+            out = dict((col, out[col][ok]) for col in out)
+
+        #carry state into the next chunk
+        if len(ev_k) > 0 and ev_k[-1] == ON:
+            self.pending = (ev_t[-1], ev_v[-1], ev_i[-1])
+        else:
+            self.pending = None
+        if len(pos) > 0 and pos[-1] >= 0:
+            last = pos[-1] + 1
+            self.sign = sign[-1]
+            self.after = (ext_t[last], ext_v[last], ext_i[last])
+        self.n = self.n + len(times)
+        self.t_last = times[-1]
+        self.v_last = vals[-1]
+        self.gap = None
+        return out
+
+    def _hysteresis(self, on_t, on_v, on_i, off_t, off_v, off_i, v_end, on_k, off_k):
+        """Reduces this chunk's local minima and maxima (along with any
+        carried from the last chunk) to those confirmed by hysteresis, 
+        carrying the rest into the next chunk.  v_end is the last sample and
+        on_k and off_k give the order of the extrema (extrema within a break
+        share a sample index).
+        """
+        t = np.concatenate([on_t, off_t])
+        v = np.concatenate([on_v, off_v])
+        i = np.concatenate([on_i, off_i])
+        k = np.concatenate([np.zeros(len(on_t), dtype=int) + ON,
+                            np.zeros(len(off_t), dtype=int) + OFF])
+        order = np.argsort(np.concatenate([on_k, off_k]), kind='mergesort')
+        t, v, i, k = t[order], v[order], i[order], k[order]
+        if self.tail != None:
+            t, v, i, k = [np.concatenate([a, b]) for a, b in zip(self.tail, (t, v, i, k))]
+        keep, n_confirmed = reduce_extrema(v, self.hysteresis, v_end)
+        t, v, i, k = t[keep], v[keep], i[keep], k[keep]
+        self.tail = (t[n_confirmed:], v[n_confirmed:], i[n_confirmed:], k[n_confirmed:])
+        t, v, i, k = t[:n_confirmed], v[:n_confirmed], i[:n_confirmed], k[:n_confirmed]
+        on = k == ON
+        return t[on], v[on], i[on], t[~on], v[~on], i[~on]
+
+def reduce_extrema(v, hysteresis, v_end):
+    """This function applies hysteresis to an alternating sequence of local
+    minima and maxima with values v, followed by a last sample of value 
+    v_end.  Returns the indices of the extrema kept and how many of those 
+    (from the start) are confirmed.
+
+    Wherever the swing between neighbouring extrema is less than hysteresis
+    and smaller than the swings on either side, that minimum and maximum are
+    dropped, which leaves the lower minimum and the higher maximum of the
+    wiggle in place.  This repeats until no swing below hysteresis remains
+    (the swing after the last extremum, up to v_end, is never dropped since
+    more data may extend it).  An extremum is confirmed once the swing after
+    it reaches hysteresis; only the last few can still be unconfirmed, and
+    these may be revised when more data is added.
+    """
+    idx = np.arange(len(v))
+    while len(idx) > 1:
+        d = np.abs(np.diff(v[idx]))
+        d_end = np.abs(v_end - v[idx[-1]])
+        left = np.concatenate([[np.inf], d[:-1]])
+        right = np.concatenate([d[1:], [d_end]])
+        small = np.nonzero((d < hysteresis) & (d <= left) & (d < right))[0]
+        if len(small) == 0:
+            break
+        drop = np.zeros(len(idx), dtype='bool')
+        drop[small] = True
+        drop[small + 1] = True
+        idx = idx[~drop]
+    if len(idx) == 0:
+        return idx, 0
+    swing = np.abs(np.diff(np.concatenate([v[idx], [v_end]])))
+    unconfirmed = np.nonzero(swing < hysteresis)[0]
+    n_confirmed = unconfirmed[0] if len(unconfirmed) > 0 else len(idx)
+    return idx, n_confirmed
+
+COLUMNS = ['t_on', 't_off', 'v_on', 'v_off', 'i_on', 'i_off']
+
+def empty_cycles():
+    """This function returns a cycle dictionary with no entries."""
+    out = dict((col, np.zeros(0)) for col in COLUMNS)
+    out['i_on'] = np.zeros(0, dtype=int)
+    out['i_off'] = np.zeros(0, dtype=int)
+    return out
+
+def concatenate_cycles(chunks):
+    """This function joins a list of cycle dictionaries into one."""
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return empty_cycles()
+    return dict((col, np.concatenate([c[col] for c in chunks])) for col in COLUMNS)
+
+def detect_cycles(times, vals, on_range=None, off_range=None, dur_lim=None, hysteresis=None):
+    """This function detects the heater cycles in a complete thermistor series
+    held in memory, in a single pass.  See CycleDetector.
+    """
+    return CycleDetector(on_range, off_range, dur_lim, hysteresis).update(times, vals)
+
+def stream_cycles(fetch_chunk, t_start, t_stop=None, chunk=30*86400., detector=None):
+    """This function fetches a thermistor series in fixed-length time chunks
+    and yields the heater cycles completed in each chunk, so that only one
+    chunk of telemetry is held in memory at a time.
+
+    Inputs:
+       fetch_chunk  Function of (t_start, t_stop) returning an object with
+                    .times and .vals (e.g. a wrapper around fetch.Msid)
+       t_start      Start of timeframe to analyze
+       t_stop       End of timeframe to analyze (default is current time)
+       chunk        Length of each chunk [sec] (default is 30 days)
+       detector     CycleDetector holding the detection parameters; its state
+                    (e.g. detector.t_last) can be inspected after streaming
+    """
+    if detector == None:
+        detector = CycleDetector()
+    start = DateTime(t_start).secs
+    stop = DateTime(t_stop).secs
+    while start < stop:
+        x = fetch_chunk(start, min(start + chunk, stop))
+        yield detector.update(x.times, x.vals)
+        start = start + chunk
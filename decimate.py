@@ -0,0 +1,56 @@
+import numpy as np
+
+def minmax_indices(x, y, n_cols, x_range=None):
+    """This function returns the indices of the points needed to draw a line
+    plot of y vs. x that is n_cols pixels wide without any visible change:
+    the first, last, minimum and maximum point falling in each pixel column
+    (plus the first NaN, so gaps in the line are kept).  Assumes x is sorted.
+
+    If x_range is supplied, only the points within that range (and one on
+    either side, so the line runs off the edge of the axes) are considered
+    and the pixel columns span x_range instead of the data.
+
+    Series that are already no more than 4 points per column are returned
+    whole.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if x_range != None:
+        i0 = max(np.searchsorted(x, x_range[0], side='left') - 1, 0)
+        i1 = min(np.searchsorted(x, x_range[1], side='right') + 1, n)
+        lo, hi = x_range
+    else:
+        i0, i1 = 0, n
+        lo, hi = (x[0], x[-1]) if n > 0 else (0, 1)
+    if i1 - i0 <= 4 * n_cols or hi <= lo:
+        return np.arange(i0, i1)
+
+    xs = x[i0:i1]
+    ys = y[i0:i1]
+    col = np.clip(((xs - lo) / float(hi - lo) * n_cols).astype(int), -1, n_cols)
+    starts = np.concatenate([[0], np.nonzero(np.diff(col))[0] + 1])
+    ends = np.concatenate([starts[1:], [len(xs)]]) - 1
+    seg = np.cumsum(np.concatenate([[0], np.diff(col) != 0]))
+
+    finite = np.isfinite(ys)
+    idx = np.arange(len(xs))
+    big = len(xs)
+    y_lo = np.where(finite, ys, np.inf)
+    y_hi = np.where(finite, ys, -np.inf)
+    seg_min = np.minimum.reduceat(y_lo, starts)
+    seg_max = np.maximum.reduceat(y_hi, starts)
+    i_min = np.minimum.reduceat(np.where(finite & (ys == seg_min[seg]), idx, big), starts)
+    i_max = np.minimum.reduceat(np.where(finite & (ys == seg_max[seg]), idx, big), starts)
+    i_nan = np.minimum.reduceat(np.where(~finite, idx, big), starts)
+
+    keep = np.concatenate([starts, ends, i_min, i_max, i_nan])
+    keep = np.unique(keep[keep < big])
+    return keep + i0
+
+def minmax_decimate(x, y, n_cols, x_range=None):
+    """This function reduces a series to the per-pixel-column min/max envelope
+    described in minmax_indices.  Returns the reduced x and y.
+    """
+    idx = minmax_indices(x, y, n_cols, x_range)
+    return np.asarray(x)[idx], np.asarray(y)[idx]
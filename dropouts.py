@@ -0,0 +1,52 @@
+import numpy as np
+
+# Default tolerance for pairing samples of two thermistors [sec]
+# (about one major frame)
+TOL = 33.
+
+def align_nearest(t_ref, t_other, tol=TOL):
+    """This function returns an array of length t_ref with the index of the
+    sample in t_other nearest in time to each t_ref, or -1 where there is no
+    sample within tol seconds.  Assumes both arrays are sorted.
+    """
+    t_ref = np.asarray(t_ref)
+    t_other = np.asarray(t_other)
+    if len(t_other) == 0:
+        return np.zeros(len(t_ref), dtype=int) - 1
+    right = np.clip(np.searchsorted(t_other, t_ref), 0, len(t_other) - 1)
+    left = np.clip(right - 1, 0, len(t_other) - 1)
+    use_left = np.abs(t_ref - t_other[left]) <= np.abs(t_other[right] - t_ref)
+    out = np.where(use_left, left, right)
+    out[np.abs(t_other[out] - t_ref) > tol] = -1
+    return out
+
+def dropout_masks(tlm, pairs, tol=TOL):
+    """This function flags dropouts in sets of redundant thermistors without
+    requiring their timestamps to match.
+
+    Inputs:
+       tlm      Telemetry for each msid (e.g. from fetch.Msidset), as a mapping
+                of msid to an object with .times and .vals
+       pairs    List of (msid_a, msid_b, threshold):  a sample of either msid
+                is flagged when it differs from the nearest sample of the other
+                by more than threshold
+       tol      Maximum time between samples to compare them [sec]
+
+    Returns a dictionary of boolean masks, one per msid in tlm, that are True
+    for the samples to keep.  The telemetry itself is not copied or modified.
+
+    e.g. masks = dropout_masks(tlm, [('PM1THV1T', 'PM1THV2T', 10),
+                                     ('PM2THV1T', 'PM2THV2T', 10),
+                                     ('PM1THV2T', 'PM2THV2T', 30)])
+    """
+    masks = dict((msid, np.ones(len(tlm[msid].times), dtype='bool')) for msid in tlm.keys())
+    for msid_a, msid_b, threshold in pairs:
+        a = tlm[msid_a]
+        b = tlm[msid_b]
+        for x, y, msid in ((a, b, msid_a), (b, a, msid_b)):
+            j = align_nearest(x.times, y.times, tol)
+            paired = j >= 0
+            bad = np.zeros(len(x.times), dtype='bool')
+            bad[paired] = np.abs(x.vals[paired] - y.vals[j[paired]]) > threshold
+            masks[msid] &= ~bad
+    return masks
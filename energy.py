@@ -0,0 +1,71 @@
+import numpy as np
+
+# Default heater resistance [ohms]
+RESISTANCE = 40.
+
+def v2_integral(times, vals):
+    """This function returns the running integral of V^2 [V^2-sec] at each
+    sample of a voltage series, holding each sample until the next (the
+    prefix-sum table used by v2_between).
+    """
+    times = np.asarray(times, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+    out = np.zeros(len(times))
+    if len(times) > 1:
+        w = vals[:-1]**2
+        w *= np.diff(times)
+        np.cumsum(w, out=out[1:])
+    return out
+
+def _sample_before(times, t):
+    """Returns the index of the last sample at or before each t (the first
+    sample for times before it).
+    """
+    return np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 1)
+
+def _v2_at(times, vals, cum, t, i):
+    return cum[i] + vals[i]**2 * (t - times[i])
+
+def v2_between(times, vals, cum, t0, t1):
+    """This function returns the integral of V^2 [V^2-sec] from each t0 to
+    the matching t1, given the voltage series and its running integral from
+    v2_integral.  Times before the first sample use the first sample's value.
+    """
+    times = np.asarray(times, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+    t0 = np.asarray(t0, dtype=float)
+    t1 = np.asarray(t1, dtype=float)
+    return (_v2_at(times, vals, cum, t1, _sample_before(times, t1)) - 
+            _v2_at(times, vals, cum, t0, _sample_before(times, t0)))
+
+def heater_energy(times, vals, t_on, t_off, resistance=None):
+    """This function integrates heater power over each on-interval in one
+    vectorized pass, using the bus voltage averaged over the interval rather
+    than a single sample.
+
+    Inputs:
+       times, vals  Bus voltage telemetry (e.g. ELBV 5-minute means), sorted
+       t_on, t_off  Start and end of each heater on-interval
+       resistance   Heater resistance [ohms] (default is RESISTANCE)
+
+    Returns the RMS voltage over each interval [V] (the voltage at t_on for
+    zero-length intervals) and the energy of each [W-hrs].  Both are NaN if
+    there is no voltage telemetry.
+    """
+    if resistance == None:
+        resistance = RESISTANCE
+    t_on = np.asarray(t_on, dtype=float)
+    t_off = np.asarray(t_off, dtype=float)
+    if len(times) == 0:
+        nan = np.zeros(len(t_on)) * np.nan
+        return nan, nan
+    times = np.asarray(times, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+    cum = v2_integral(times, vals)
+    i_on = _sample_before(times, t_on)
+    v2 = _v2_at(times, vals, cum, t_off, _sample_before(times, t_off)) - \
+         _v2_at(times, vals, cum, t_on, i_on)
+    dur = t_off - t_on
+    mean_v2 = vals[i_on]**2
+    mean_v2[dur > 0] = v2[dur > 0] / dur[dur > 0]
+    return np.sqrt(mean_v2), v2 / resistance / 3600 #W-hrs
@@ -0,0 +1,134 @@
+"""Superposed-epoch analysis of heater cycling around kadi events:  the
+cycles within a window before and after every occurrence of an event type
+(e.g. momentum dumps, safe suns, eclipses) are aligned on the event and
+reduced to mean and percentile curves across occurrences.
+
+usage:  python epochs.py MSID EVENT_TYPE [--before 21600] [--after 21600]
+                         [--width 1800] [--metric dur] [--products products]
+                         [--t_start 2008:001] [--t_stop NOW]
+"""
+import sys
+import argparse
+import warnings
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+# Default window either side of each event and bin width [sec]
+BEFORE = 6 * 3600.
+AFTER = 6 * 3600.
+BIN = 1800.
+
+# Percentiles of the per-event curves reported
+PERCENTILES = [10, 50, 90]
+
+def event_times(event_type, t_start='2008:001', t_stop=None):
+    """This function returns the start times [sec] of every occurrence of a
+    kadi event type (e.g. 'dumps', 'safe_suns', 'eclipses') in a timeframe.
+    """
+    from kadi import events
+    table = getattr(events, event_type).filter(DateTime(t_start).date, DateTime(t_stop).date).table
+    if len(table) == 0:
+        return np.zeros(0)
+    return np.asarray(table['tstart'], dtype=float)
+
+def epoch_pairs(t_events, times, before=BEFORE, after=AFTER):
+    """This function finds every (event, sample) pair with the sample time
+    (times must be sorted) within before seconds before to after seconds
+    after the event, using two searchsorted calls for all events at once.
+    Returns the event index, sample index and time relative to the event of
+    each pair.
+    """
+    t_events = np.asarray(t_events, dtype=float)
+    times = np.asarray(times, dtype=float)
+    i0 = np.searchsorted(times, t_events - before, side='left')
+    i1 = np.searchsorted(times, t_events + after, side='left')
+    n = i1 - i0
+    ev = np.repeat(np.arange(len(t_events)), n)
+    #position of each pair within its event's run of samples
+    offs = np.arange(np.sum(n)) - np.repeat(np.cumsum(n) - n, n)
+    sample = np.repeat(i0, n) + offs
+    return ev, sample, times[sample] - t_events[ev]
+
+def superposed_epoch(t_events, times, vals=None, before=BEFORE, after=AFTER, width=BIN, percentiles=PERCENTILES):
+    """This function aligns a per-cycle metric (e.g. dur, per, dc or pwr of
+    a cycle table, at its t_on times) on a set of events and reduces it to
+    curves across events.
+
+    Each event's cycles are binned by time relative to the event, giving one
+    curve per event (the mean metric in each bin, or with vals=None the
+    number of cycles starting in each bin).  The curves are then combined
+    bin by bin.
+
+    Returns a dictionary with 't' (bin centers relative to the events [sec]),
+    'n_events', 'curves' (n_events x n_bins), 'n' (events with a value in
+    each bin), 'mean', and 'p' + str(q) for each percentile q.
+    """
+    edges = np.arange(-before, after + width / 2., width)
+    n_bins = len(edges) - 1
+    n_events = len(t_events)
+    ev, sample, rel = epoch_pairs(t_events, times, before, after)
+    b = np.minimum(np.floor((rel + before) / width).astype(int), n_bins - 1)
+    cell = ev * n_bins + b
+    count = np.bincount(cell, minlength=n_events * n_bins).reshape(n_events, n_bins)
+    if vals is None:
+        curves = count.astype(float)
+    else:
+        v = np.asarray(vals, dtype=float)[sample]
+        ok = ~np.isnan(v)
+        total = np.bincount(cell[ok], weights=v[ok], minlength=n_events * n_bins)
+        n_ok = np.bincount(cell[ok], minlength=n_events * n_bins)
+        curves = np.zeros(n_events * n_bins) * np.nan
+        curves[n_ok > 0] = total[n_ok > 0] / n_ok[n_ok > 0]
+        curves = curves.reshape(n_events, n_bins)
+    out = {'t':(edges[:-1] + edges[1:]) / 2, 'n_events':n_events, 'curves':curves,
+           'n':np.sum(~np.isnan(curves), axis=0)}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) #bins with no values are NaN
+        out['mean'] = np.nanmean(curves, axis=0) if n_events > 0 else np.zeros(n_bins) * np.nan
+        for q in percentiles:
+            out['p' + str(q)] = (np.nanpercentile(curves, q, axis=0) if n_events > 0
+                                 else np.zeros(n_bins) * np.nan)
+    return out
+
+def cycle_epochs(cycles, t_events, metric='dur', before=BEFORE, after=AFTER, width=BIN):
+    """This function runs superposed_epoch on a cycle table (e.g. an
+    HtrDcResult's cycles or products.load_table(..., 'cycles')) for one of
+    its columns, or 'count' for the number of cycles starting in each bin.
+    """
+    t_on = np.asarray(cycles['t_on'])
+    vals = None if metric == 'count' else np.asarray(cycles[metric])
+    return superposed_epoch(t_events, t_on, vals, before, after, width)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Heater cycling around kadi events')
+    parser.add_argument('msid', help='Heater thermistor with a cycle product table')
+    parser.add_argument('event_type', help="kadi event type, e.g. 'dumps' or 'safe_suns'")
+    parser.add_argument('--before', type=float, default=BEFORE, help='Window before [sec]')
+    parser.add_argument('--after', type=float, default=AFTER, help='Window after [sec]')
+    parser.add_argument('--width', type=float, default=BIN, help='Bin width [sec]')
+    parser.add_argument('--metric', default='dur', help="Cycle column, or 'count'")
+    parser.add_argument('--products', default='products', help='Products directory')
+    parser.add_argument('--t_start', default='2008:001', help='Start of events')
+    parser.add_argument('--t_stop', default=None, help='End of events')
+    parser.add_argument('--plot', action='store_true', help='Also save a figure')
+    opt = parser.parse_args(args)
+
+    from products import load_table
+    cycles = load_table(opt.products, opt.msid, 'cycles', ['t_on', opt.metric]
+                        if opt.metric != 'count' else ['t_on'])
+    t_events = event_times(opt.event_type, opt.t_start, opt.t_stop)
+    out = cycle_epochs(cycles, t_events, opt.metric, opt.before, opt.after, opt.width)
+    print('%s %s around %d %s' % (opt.msid, opt.metric, out['n_events'], opt.event_type))
+    print('%10s %8s %12s' % ('t [hr]', 'events', 'mean') +
+          ''.join('%12s' % ('p' + str(q)) for q in PERCENTILES))
+    for i in range(len(out['t'])):
+        print('%10.2f %8d %12.2f' % (out['t'][i] / 3600, out['n'][i], out['mean'][i]) +
+              ''.join('%12.2f' % out['p' + str(q)][i] for q in PERCENTILES))
+    if opt.plot:
+        from htr_dc_plots import plot_epochs
+        plot_epochs(out, opt.msid, opt.metric, opt.event_type)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,169 @@
+import os
+import numpy as np
+
+class _Histogram(object):
+    """Saving and loading shared by Hist1D and Hist2D, which define the
+    arrays they are saved as (_arrays) and restored from (_set).
+    """
+    def save(self, filename, **meta):
+        """Saves the histogram (and any extra scalar meta values) to a .npz
+        file, written to a temporary name and renamed into place.
+        """
+        tmp = filename + '.tmp.npz'
+        arrays = self._arrays()
+        arrays.update(meta)
+        np.savez(tmp, **arrays)
+        os.rename(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a saved histogram.  Returns the histogram and a dictionary
+        of the meta values saved with it.
+        """
+        f = np.load(filename)
+        arrays = dict((k, f[k]) for k in f.files)
+        f.close()
+        h = cls.__new__(cls)
+        h._set(arrays)
+        meta = dict((k, arrays[k][()]) for k in arrays if k not in h._arrays())
+        return h, meta
+
+class Hist1D(_Histogram):
+    """Fixed-bin histogram accumulated one chunk at a time, in constant
+    memory.  Histograms with the same edges can be merged (e.g. across
+    heaters or worker processes) and saved between runs.  Values outside the
+    edges are counted as underflow and overflow; NaNs are ignored.
+
+    e.g. h = Hist1D(np.arange(0, 241, 2.))
+         for chunk in chunks:
+             h.update(chunk)
+         h.save('on_time_hist.npz')
+    """
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=float)
+        self.counts = np.zeros(len(self.edges) - 1)
+        self.under = 0.
+        self.over = 0.
+
+    def update(self, vals, weights=None):
+        """Adds values (optionally weighted) to the histogram."""
+        vals = np.asarray(vals, dtype=float).ravel()
+        weights = np.ones(len(vals)) if weights is None else np.asarray(weights, dtype=float).ravel()
+        ok = ~np.isnan(vals)
+        vals, weights = vals[ok], weights[ok]
+        i = np.searchsorted(self.edges, vals, side='right') - 1
+        i[vals == self.edges[-1]] = len(self.counts) - 1 #last bin includes its right edge
+        inside = (i >= 0) & (i < len(self.counts))
+        self.counts += np.bincount(i[inside], weights=weights[inside], minlength=len(self.counts))
+        self.under += np.sum(weights[i < 0])
+        self.over += np.sum(weights[i >= len(self.counts)])
+        return self
+
+    def merge(self, other):
+        """Adds another histogram with the same edges to this one."""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Histogram edges differ')
+        self.counts += other.counts
+        self.under += other.under
+        self.over += other.over
+        return self
+
+    def total(self):
+        """Returns the total count, including underflow and overflow."""
+        return np.sum(self.counts) + self.under + self.over
+
+    def occupied(self, n_bins=None):
+        """Returns the edges and counts of the bins from the first to the last
+        non-empty one, optionally merged in groups to at most n_bins bins
+        (for plotting fine fixed bins over an unknown range of values).
+        """
+        nz = np.flatnonzero(self.counts)
+        if len(nz) == 0:
+            return self.edges[:2], np.zeros(1)
+        edges = self.edges[nz[0]:nz[-1] + 2]
+        counts = self.counts[nz[0]:nz[-1] + 1]
+        if n_bins != None and len(counts) > n_bins:
+            group = int(np.ceil(len(counts) / float(n_bins)))
+            starts = np.arange(0, len(counts), group)
+            counts = np.add.reduceat(counts, starts)
+            edges = np.append(edges[starts], edges[-1])
+        return edges, counts
+
+    def _arrays(self):
+        return {'edges':self.edges, 'counts':self.counts, 'under':self.under, 'over':self.over}
+
+    def _set(self, arrays):
+        self.edges = arrays['edges']
+        self.counts = arrays['counts']
+        self.under = float(arrays['under'])
+        self.over = float(arrays['over'])
+
+class Hist2D(_Histogram):
+    """Fixed-bin 2-D histogram accumulated one chunk at a time (e.g. of
+    temperature vs. duty cycle over mission-length telemetry), mergeable and
+    persistable like Hist1D.  Pairs outside the edges in either dimension
+    are counted as outside; pairs with a NaN are ignored.
+
+    e.g. h = Hist2D(np.arange(40, 101, 1.), np.arange(0, 101, 5.))
+         h.update(temps, dcs)
+         utilities.heat_map(h)
+    """
+    def __init__(self, xedges, yedges):
+        self.xedges = np.asarray(xedges, dtype=float)
+        self.yedges = np.asarray(yedges, dtype=float)
+        self.counts = np.zeros((len(self.xedges) - 1, len(self.yedges) - 1))
+        self.outside = 0.
+
+    def update(self, x, y, weights=None):
+        """Adds (x, y) pairs (optionally weighted) to the histogram."""
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        weights = np.ones(len(x)) if weights is None else np.asarray(weights, dtype=float).ravel()
+        ok = ~(np.isnan(x) | np.isnan(y))
+        x, y, weights = x[ok], y[ok], weights[ok]
+        nx, ny = self.counts.shape
+        i = np.searchsorted(self.xedges, x, side='right') - 1
+        j = np.searchsorted(self.yedges, y, side='right') - 1
+        i[x == self.xedges[-1]] = nx - 1 #last bins include their right edges
+        j[y == self.yedges[-1]] = ny - 1
+        inside = (i >= 0) & (i < nx) & (j >= 0) & (j < ny)
+        flat = np.bincount(i[inside] * ny + j[inside], weights=weights[inside], minlength=nx * ny)
+        self.counts += flat.reshape(nx, ny)
+        self.outside += np.sum(weights[~inside])
+        return self
+
+    def merge(self, other):
+        """Adds another histogram with the same edges to this one."""
+        if not (np.array_equal(self.xedges, other.xedges) and
+                np.array_equal(self.yedges, other.yedges)):
+            raise ValueError('Histogram edges differ')
+        self.counts += other.counts
+        self.outside += other.outside
+        return self
+
+    def total(self):
+        """Returns the total count, including pairs outside the edges."""
+        return np.sum(self.counts) + self.outside
+
+    def _arrays(self):
+        return {'xedges':self.xedges, 'yedges':self.yedges, 'counts':self.counts,
+                'outside':self.outside}
+
+    def _set(self, arrays):
+        self.xedges = arrays['xedges']
+        self.yedges = arrays['yedges']
+        self.counts = arrays['counts']
+        self.outside = float(arrays['outside'])
+
+def merge_all(hists):
+    """This function returns the sum of a list of histograms with the same
+    edges (e.g. one per heater or worker process), leaving them unchanged.
+    """
+    out = None
+    for h in hists:
+        if out == None:
+            out = h.__class__.__new__(h.__class__)
+            out._set(dict((k, np.array(v, copy=True)) for k, v in h._arrays().items()))
+        else:
+            out.merge(h)
+    return out
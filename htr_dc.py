@@ -1,10 +1,36 @@
-import time
-from matplotlib import pyplot as pp
+import os
+import glob
+import hashlib
+import numpy as np
 
+import Ska.engarchive.fetch_eng as fetch
+from Chandra.Time import DateTime
+from astropy.table import Table
 from kadi import events
 
+from bucket_stats import bucket_count, bucket_sum, bucket_mean
+from time_bins import day_number, month_number, day_start, month_start, day_month, day_range, strs_to_secs
+from intervals import IntervalIndex
+from dropouts import dropout_masks, TOL as DROPOUT_TOL
+from energy import heater_energy
+from tlm_cache import CachedMsid, split_stat
+from cycles import CycleDetector, stream_cycles, concatenate_cycles
+import coarse
+from cycle_store import param_key, load_cycles, save_cycles, resume_time, merge_cycles
+from instrument import Recorder, write_records, peak_rss
+from products import write_products
+from stats_index import build_index
+from histograms import Hist1D
+
 #from utilities import append_to_array, find_first_after, find_last_before, find_closest
 
+# Lock shared by parallel heater runs (see htr_dc_runner) so log writes don't interleave
+LOG_LOCK = None
+
+# Fixed bins of the on-time duration histogram [min]:  0.1 min (6 sec), fine
+# enough for valves whose on-times are only a few samples long
+ON_TIME_EDGES = np.arange(0, 24 * 60 * 10 + 1) / 10.
+
 def append_to_array(a, pos=-1, val=0):
     """Appends a zero (or user-defined value) to a given one-dimensional array, 
     either at the end (pos=-1) or beginning (pos=0).
@@ -19,15 +45,6 @@ def append_to_array(a, pos=-1, val=0):
         out = np.concatenate([a, val_a])
     return out
     
-def find_last_before(a, b):
-    """This function returns an array of length a with the indices of 
-    array b that are closest without going over the values of array a.
-    (Bob Barker rules.  Assumes b is sorted by magnitude.)
-    """
-    out = np.searchsorted(b,a,side='left') - 1
-    out[out==-1] = 0
-    return out    
-     
 def find_first_after(a, b):
     """This function returns an array of length a with the indices of 
     array b that are closest without being less than the values of array a.
@@ -36,23 +53,232 @@ def find_first_after(a, b):
     out = np.searchsorted(b,a,side='right')
     return out  
 
-def find_closest(a, b):
-    """This function returns an array of length a with the indices of 
-    array b that are closest to the values of array a.
+def fetch_msid(msid, t_start, t_stop=None, stat=None, source=None):
+    """This function fetches telemetry through a telemetry source (anything with 
+    a get(msid, t_start, t_stop, stat) method, e.g. tlm_cache.TlmCache) if one is
+    supplied, otherwise directly from the engineering archive.  The mins or
+    maxes of a statistic can be fetched as stat='5min.mins' or '5min.maxes'.
     """
-    idx = np.array([(np.abs(b-a_i)).argmin() for a_i in a])
-    return idx
+    if source == None:
+        archive_stat, attr = split_stat(stat)
+        x = fetch.Msid(msid, t_start, t_stop, stat=archive_stat)
+        if attr != 'vals':
+            return CachedMsid(msid, stat, x.times, getattr(x, attr))
+        return x
+    return source.get(msid, t_start, t_stop, stat=stat)
 
-def htr_dc(temp, t_start='2008:001', t_stop=None, on_range=None, off_range=None, name=None, event=None, dur_lim=None, plot_cycles=False, logfile='htr_dc_log.txt'):
-    """This function generates heater cycling metrics based on a nearby  
-    temperature.  Output plots include:
-       - On-time durations
-       - Period
-       - Duty cycle
-       - Cycles per day
-       - Accumulated on-time per day
-       - Accumulated power per day
-       - Time history (optional)
+def fetch_without_dropouts(temp, t_start, t_stop=None, dropout_pairs=None, source=None):
+    """This function fetches a thermistor along with its redundant partners and
+    returns the thermistor's telemetry with dropouts removed (see
+    dropouts.dropout_masks).  Only the pairs that include temp are used.
+    The partners are fetched TOL beyond each end of the timeframe, so samples
+    near the edges of a chunk are compared just as they would be in one 
+    fetch of the whole timeframe.
+    """
+    pairs = [pair for pair in dropout_pairs if temp in pair[:2]]
+    msids = set([temp] + [pair[0] for pair in pairs] + [pair[1] for pair in pairs])
+    pad_start = DateTime(t_start).secs - DROPOUT_TOL
+    pad_stop = None if t_stop == None else DateTime(t_stop).secs + DROPOUT_TOL
+    tlm = dict((msid, fetch_msid(msid, pad_start, pad_stop, source=source)) for msid in msids 
+               if msid != temp)
+    tlm[temp] = fetch_msid(temp, t_start, t_stop, source=source)
+    keep = dropout_masks(tlm, pairs)[temp]
+    return CachedMsid(temp, None, tlm[temp].times[keep], tlm[temp].vals[keep])
+
+def window_start(window, t_stop=None):
+    """This function returns the start of an output window (see htr_dc_stats)
+    in seconds:  its t_start, or the start of the day days before the one
+    containing t_stop (as for htr_dc_live.LiveHeater, so the window's first
+    day is a whole one).
+    """
+    if 't_start' in window:
+        return DateTime(window['t_start']).secs
+    return day_start(day_number(DateTime(t_stop).secs) - window['days'])
+
+def tlm_start(windows, t_stop=None):
+    """This function returns the earliest start of the output windows that
+    keep the thermistor time history, or None if none do.
+    """
+    starts = [window_start(w, t_stop) for w in windows or [] if w.get('plot_cycles', False)]
+    if len(starts) == 0:
+        return None
+    return min(starts)
+
+def fetch_range(temp, t_start='2008:001', t_stop=None, on_range=None, off_range=None, dur_lim=None, keep_tlm=False, store_dir=None, dropout_pairs=None, hysteresis=None, resolution=None, windows=None, resistance=None):
+    """This function returns the start time from which htr_dc needs telemetry
+    for a given heater, along with the stored cycle table it will extend (None
+    if the cycles will be detected from scratch).  Inputs are as for htr_dc_stats.
+    """
+    if store_dir == None or t_stop != None or keep_tlm == True:
+        return t_start, None
+    store = load_cycles(store_dir, temp, param_key(on_range, off_range, dur_lim, dropout_pairs, 
+                                                   hysteresis, resolution, resistance))
+    if store == None or store['t_start'] > DateTime(t_start).secs:
+        return t_start, None #stored timeframe doesn't reach back far enough
+    resume = resume_time(store)
+    if resume == None:
+        return t_start, store
+    #windows keeping the time history need it even where cycles are stored
+    if tlm_start(windows, t_stop) != None:
+        resume = min(resume, tlm_start(windows, t_stop))
+    return DateTime(resume).date, store
+
+class HtrDcResult(object):
+    """Heater cycling metrics computed by htr_dc_stats.
+
+    Attributes:
+       temp, name, event, t_start, t_stop    As passed to htr_dc_stats
+       t_last       Time of the last telemetry sample processed
+       cycles       Table with one row per heater cycle:  t_on, t_off, dur [sec],
+                    voltage [V, RMS over the cycle], pwr [W-hrs], per [sec] and dc [%] (period and 
+                    duty cycle to the next cycle, NaN for the last cycle), plus 
+                    the sample indices i_on and i_off if keep_tlm was set
+       daily        Table with one row per day:  t (start of day), on_freq, 
+                    on_time [sec], dur [sec], acc_pwr [W-hrs], per [sec], dc [%]
+       monthly      Table of monthly means with the same columns as daily, 
+                    t being the start of each month
+       times, vals  Thermistor time history (only if keep_tlm was set)
+       metrics      List of span records (see instrument.Recorder) for each
+                    processing stage:  fetch, detect, power, calendar and 
+                    stats
+       timings      List of (stage, wall seconds) for each processing stage
+       refinement   Dictionary describing the full resolution refinement
+                    windows if resolution was '5min' (see coarse.detect_minmax),
+                    otherwise None
+       windows      HtrDcResult for each output window (see htr_dc_stats), 
+                    with window set to its definition
+       window       Output window definition this result covers (None for
+                    the whole timeframe)
+       on_time_hist histograms.Hist1D of the cycle durations [min] on 
+                    ON_TIME_EDGES (see on_time_hist), or None for windows
+    """
+    def __init__(self, temp, name, event, t_start, t_stop, t_last, cycles, daily, monthly):
+        self.temp = temp
+        self.name = name
+        self.event = event
+        self.t_start = t_start
+        self.t_stop = t_stop
+        self.t_last = t_last
+        self.cycles = cycles
+        self.daily = daily
+        self.monthly = monthly
+        self.times = None
+        self.vals = None
+        self.metrics = []
+        self.timings = []
+        self.refinement = None
+        self.windows = []
+        self.window = None
+        self.on_time_hist = None
+
+def cycle_tables(t_on, t_off, dur_each, voltage, pwr, days):
+    """This function returns the per-cycle, daily and monthly tables of an
+    HtrDcResult for a set of cycles over a range of day numbers.  Monthly
+    means are over the days of each month within the range only.
+    """
+    mos = np.arange(day_month(days[0]), day_month(days[-1]) + 1)
+    t_days = day_start(days)
+    t_mos = month_start(mos)
+    n_days = len(days)
+    n_mos = len(mos)
+    on_day_i = day_number(t_on) - days[0]
+    on_mo_i = month_number(t_on) - mos[0]
+    days_mo_i = day_month(days) - mos[0]
+    
+    on_freq = bucket_count(on_day_i, n_days)
+    on_freq_mo_mean = bucket_mean(days_mo_i, on_freq, n_mos)
+
+    on_time = bucket_sum(on_day_i, dur_each, n_days)
+    on_time_mo_mean = bucket_mean(days_mo_i, on_time, n_mos)
+    
+    dur = bucket_mean(on_day_i, dur_each, n_days)
+    dur_mo_mean = bucket_mean(on_mo_i, dur_each, n_mos)
+    
+    acc_pwr = bucket_sum(on_day_i, pwr, n_days)
+    acc_pwr_mo_mean = bucket_mean(days_mo_i, acc_pwr, n_mos)
+    
+    per_each = np.diff(t_on)
+    per = bucket_mean(on_day_i[:-1], per_each, n_days)
+    per_mo_mean = bucket_mean(on_mo_i[:-1], per_each, n_mos)
+    
+    dc_each = dur_each[:-1] / per_each * 100
+    dc = on_time / (3600*24) * 100
+    dc_mo_mean = bucket_mean(days_mo_i, dc, n_mos)
+    
+    per_col = np.zeros(len(t_on)) * np.nan #period and duty cycle to the next cycle
+    per_col[:-1] = per_each
+    dc_col = np.zeros(len(t_on)) * np.nan
+    dc_col[:-1] = dc_each
+    cycles = Table([t_on, t_off, dur_each, voltage, pwr, per_col, dc_col],
+                   names=['t_on', 't_off', 'dur', 'voltage', 'pwr', 'per', 'dc'])
+    daily = Table([t_days, on_freq, on_time, dur, acc_pwr, per, dc],
+                  names=['t', 'on_freq', 'on_time', 'dur', 'acc_pwr', 'per', 'dc'])
+    monthly = Table([t_mos, on_freq_mo_mean, on_time_mo_mean, dur_mo_mean, acc_pwr_mo_mean, 
+                     per_mo_mean, dc_mo_mean],
+                    names=['t', 'on_freq', 'on_time', 'dur', 'acc_pwr', 'per', 'dc'])
+    return cycles, daily, monthly
+
+def window_result(result, window, t_start, times=None, vals=None):
+    """This function slices an HtrDcResult to an output window starting at
+    t_start (in seconds):  the cycles starting within it (and lasting no
+    longer than the window's dur_lim, if it has one) and the days from the
+    one containing t_start, with the monthly means over those days only (as
+    htr_dc_live.py computes them).  If the window's time history is
+    supplied, it is kept along with the sample indices of each heater on and
+    off within it.
+    """
+    cycles = result.cycles[np.asarray(result.cycles['t_on']) >= t_start]
+    if window.get('dur_lim') != None:
+        cycles = cycles[np.asarray(cycles['dur']) <= window['dur_lim']]
+    cycles, daily, monthly = cycle_tables(*[np.asarray(cycles[col]) for col in 
+                                            ['t_on', 't_off', 'dur', 'voltage', 'pwr']] +
+                                          [day_range(t_start, result.t_stop)])
+    out = HtrDcResult(result.temp, result.name, result.event, DateTime(t_start).date, 
+                      result.t_stop, result.t_last, cycles, daily, monthly)
+    out.window = window
+    if times is not None:
+        keep = times >= t_start
+        out.times = times[keep]
+        out.vals = vals[keep]
+        cycles['i_on'] = np.searchsorted(out.times, cycles['t_on'])
+        cycles['i_off'] = np.searchsorted(out.times, cycles['t_off'])
+    return out
+
+def on_time_hist(temp, t_on, dur_each, store_dir=None, key=None):
+    """This function returns the histogram of a heater's cycle durations
+    [min] on ON_TIME_EDGES.  If store_dir is supplied, the histogram is kept
+    there between runs (for the given key, identifying everything that
+    decides which cycles are counted) and only cycles starting after the last
+    one counted are added to it.  It is rebuilt from all the cycles if it
+    doesn't match them.
+    """
+    hist = None
+    if store_dir != None:
+        filename = os.path.join(store_dir, 'on_time_hist_' + temp + '_' + key + '.npz')
+        if os.path.exists(filename):
+            hist, meta = Hist1D.load(filename)
+            if not np.array_equal(hist.edges, ON_TIME_EDGES):
+                hist = None
+    if hist != None:
+        new = t_on > meta['t_counted']
+        hist.update(dur_each[new] / 60)
+        if hist.total() != len(t_on):
+            hist = None
+    if hist == None:
+        hist = Hist1D(ON_TIME_EDGES).update(dur_each / 60)
+    if store_dir != None:
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        hist.save(filename, t_counted=t_on[-1] if len(t_on) > 0 else -np.inf)
+        for old in glob.glob(os.path.join(store_dir, 'on_time_hist_' + temp + '_*.npz')):
+            if old != filename:
+                os.remove(old)
+    return hist
+
+def htr_dc_stats(temp, t_start='2008:001', t_stop=None, on_range=None, off_range=None, name=None, event=None, dur_lim=None, keep_tlm=False, store_dir=None, source=None, chunk_days=None, exclude=None, dropout_pairs=None, hysteresis=None, resolution=None, windows=None, resistance=None):
+    """This function computes heater cycling metrics based on a nearby 
+    temperature, without plotting.  Returns an HtrDcResult holding the 
+    per-cycle table along with the daily and monthly aggregates.
     
     Inputs:
        temp         Thermistor near heater, preferably close to thermostat
@@ -63,286 +289,307 @@ def htr_dc(temp, t_start='2008:001', t_stop=None, on_range=None, off_range=None,
        name         Identifying name of heater
        event        Significant time for which it is desired to highlight via vertical line
        dur_lim      Maximum duration for single heater "on" instance
-       plot_cycles  Option to plot time-history, highlighting htr on and off points 
-                    (default is False)
-    
-    Figures will be saved to local directory as 'htr_' + msid + '*.png'
+       keep_tlm     Option to keep the thermistor time history and the sample indices
+                    of each heater on and off in the result (default is False)
+       store_dir    Directory of persisted cycle tables.  If supplied (and t_stop
+                    and keep_tlm are not), previously detected cycles are reused
+                    and only telemetry after the last stored cycle (or the last
+                    sample processed, if later) is fetched.
+                    Stores are keyed by on_range, off_range, dur_lim,
+                    dropout_pairs, hysteresis, resolution and resistance.
+       source       Telemetry source to fetch through, e.g. a tlm_cache.TlmCache
+                    or a tlm_batch.TlmBundle acquired for the whole run
+                    (default is to fetch directly from the engineering archive)
+       chunk_days   If supplied (and keep_tlm is not), fetch and detect cycles in 
+                    chunks of this many days so memory use doesn't grow with the 
+                    length of the timeframe.  Results are identical.
+       exclude      nx2 list of time ranges (e.g. bad times or kadi events, in any
+                    DateTime format) to exclude; any cycle overlapping one of these
+                    ranges is dropped
+       dropout_pairs  List of (msid_a, msid_b, threshold) comparing redundant 
+                    thermistors; samples of temp that differ from the nearest 
+                    sample of its partner by more than threshold are treated as 
+                    dropouts and removed before detecting cycles
+       hysteresis   Smallest temperature swing treated as a real heater on or
+                    off; smaller wiggles are ignored as noise (default is None,
+                    i.e. every change counts; see cycles.CycleDetector)
+       resolution   Telemetry used to detect cycles.  None (default) detects
+                    them from full resolution telemetry.  '5min' locates
+                    candidate transitions from the 5-minute mins and maxes and
+                    fetches full resolution only in windows around them (see
+                    coarse.detect_minmax), which is much less telemetry over
+                    long timeframes for heaters that cycle rarely (it falls
+                    back to full resolution, in chunk_days chunks, where it 
+                    doesn't pay off).  Ignored if keep_tlm is set.
+       windows      List of narrower output windows to slice from the result
+                    (in result.windows), each a dictionary with an 'id', a
+                    start given as 'days' before t_stop or as 't_start', and
+                    optionally 'plot_cycles' to keep the window's thermistor
+                    time history and 'dur_lim' to count only the window's
+                    cycles lasting no longer than that (e.g. where the whole
+                    timeframe needs no limit).  Telemetry is fetched and
+                    cycles detected once, over the whole timeframe (or since
+                    the last stored cycle, extended back to cover windows
+                    keeping the time history).
+       resistance   Heater resistance [ohms] used for power (default is 40)
     """
     
-    pp.close('all')
-    t0 = time.time()    
-    
-    #fetch data
-    x = fetch.Msid(temp, t_start, t_stop)
-    v = fetch.Msid('ELBV', t_start, t_stop, stat='5min')
-    
-    #find htr on and off times
-    t1 = time.time()
-    dt = np.diff(x.vals)
-    dt1_n0 = np.nonzero(dt)[0]
-    dt1 = dt[dt!=0]
-    local_min_i = np.nonzero((dt1[:-1] < 0.) & (dt1[1:] > 0.))[0]
-    local_max_i = np.nonzero((dt1[:-1] > 0.) & (dt1[1:] < 0.))[0]
-    local_min = np.zeros(len(x.vals), dtype='bool')
-    local_max = np.zeros(len(x.vals), dtype='bool')
-    local_min[dt1_n0[local_min_i+1]] = 1
-    local_max[dt1_n0[local_max_i]+1] = 1
-    
-    if on_range != None:
-        htr_on_range = (x.vals > on_range[0]) & (x.vals < on_range[1])
-        htr_on = local_min & htr_on_range
-    else:    
-        htr_on = local_min 
-
-    if off_range != None:
-        htr_off_range = (x.vals > off_range[0]) & (x.vals < off_range[1])      
-        htr_off = local_max & htr_off_range
+    rec = Recorder()
+    rec.begin('fetch')
+    
+    #fetch data (only what's new since the last stored cycle, if available)
+    use_store = store_dir != None and t_stop == None and keep_tlm == False
+    fetch_start, store = fetch_range(temp, t_start, t_stop, on_range, off_range, dur_lim, 
+                                     keep_tlm, store_dir, dropout_pairs, hysteresis, 
+                                     resolution, windows, resistance)
+    t_tlm = tlm_start(windows, t_stop)
+    window_tlm = []
+    if use_store:
+        store_key = param_key(on_range, off_range, dur_lim, dropout_pairs, hysteresis, resolution,
+                              resistance)
+    v = fetch_msid('ELBV', fetch_start, t_stop, stat='5min', source=source)
+    minmax = resolution == coarse.STAT and keep_tlm == False
+    stream = chunk_days != None and keep_tlm == False and not minmax
+    if dropout_pairs != None:
+        fetch_temp = lambda c_start, c_stop: fetch_without_dropouts(temp, c_start, c_stop, 
+                                                                    dropout_pairs, source)
     else:
-        htr_off = local_max
-    
-    #remove any incomplete heater cycles at end of timeframe
-    t2 = time.time()
-    last_off = np.nonzero(htr_off)[0][-1]
-    htr_on[last_off:] = 0
-    
-    t_on = x.times[htr_on]
-    t_off = x.times[htr_off]
-    
-    #find matching cycles
-    match_i1 = find_first_after(t_on, t_off)
-    t_off = np.unique(t_off[match_i1]) #removes duplicate "offs"
-    
-    match_i2 = find_last_before(t_off, t_on)
-    t_on = t_on[match_i2] #removes duplicate "ons"
-    
-    if plot_cycles == True:    #time-intensive, not used if not plotting
-        htr_on = find_closest(t_on, x.times) 
-        htr_off = find_closest(t_off, x.times)
+        fetch_temp = lambda c_start, c_stop: fetch_msid(temp, c_start, c_stop, source=source)
+    if not stream and not minmax:
+        x = fetch_temp(fetch_start, t_stop)
+    rec.end(rows=len(v.times) + (0 if stream or minmax else len(x.times)))
+    
+    #find htr on and off times, pairing each "off" with the last "on" before
+    #it in the same pass (see cycles.CycleDetector); dur_lim is applied inline
+    rec.begin('detect')
+    detector = CycleDetector(on_range, off_range, dur_lim, hysteresis)
+    #chunk and window fetches are recorded as 'fetch'
+    def fetch_chunk(c_start, c_stop):
+        with rec.span('fetch') as span:
+            chunk = fetch_temp(c_start, c_stop)
+            span.rows = len(chunk.times)
+        if stream and t_tlm != None:
+            keep = chunk.times >= t_tlm
+            window_tlm.append((chunk.times[keep], chunk.vals[keep]))
+        return chunk
+    refinement = None
+    if minmax:
+        #find candidate transitions in the 5-minute mins and maxes, then
+        #detect cycles from full resolution windows around them
+        def fetch_stat(c_start, c_stop, stat):
+            with rec.span('fetch') as span:
+                chunk = fetch_msid(temp, c_start, c_stop, stat=stat, source=source)
+                span.rows = len(chunk.times)
+            return chunk
+        found, t_last, refinement = coarse.detect_minmax(fetch_chunk, fetch_stat, fetch_start, 
+                                                         t_stop, on_range, off_range, dur_lim, 
+                                                         hysteresis, chunk=None if chunk_days == None
+                                                         else chunk_days * 86400.)
+        n_samples = refinement['n_samples']
+        t_unpaired = refinement['t_unpaired']
+        if t_tlm != None:
+            with rec.span('fetch') as span:
+                chunk = fetch_temp(DateTime(t_tlm).date, t_stop)
+                span.rows = len(chunk.times)
+            window_tlm.append((chunk.times, chunk.vals))
+    else:
+        if stream:
+            #fetch and detect one chunk at a time to bound memory use
+            found = concatenate_cycles(stream_cycles(fetch_chunk, fetch_start, t_stop, 
+                                                     chunk_days*86400., detector))
+        else:
+            found = detector.update(x.times, x.vals)
+        t_last = detector.t_last
+        t_unpaired = detector.t_unpaired()
+        n_samples = detector.n
+    t_on = found['t_on']
+    t_off = found['t_off']
+    htr_on = found['i_on']
+    htr_off = found['i_off']
+    rec.end(rows=n_samples)
     
     #compute duration and power
-    t3 = time.time()
+    rec.begin('power')
     dur_each = t_off - t_on
     
-    if dur_lim != None:
-        too_long = dur_each > dur_lim
-        t_on = t_on[~too_long]
-        t_off = t_off[~too_long]
-        htr_on = htr_on[~too_long]
-        htr_off = htr_off[~too_long]
-        dur_each = dur_each[~too_long]
-    
-    voltage_i = find_first_after(t_on, v.times)
-    voltage = v.vals[voltage_i]
-    pwr = voltage**2/40 * dur_each/3600 #W-hrs
+    #bus voltage averaged (as V^2) over each on-interval, from prefix sums
+    voltage, pwr = heater_energy(v.times, v.vals, t_on, t_off, resistance) #V, W-hrs
+    
+    if use_store:
+        cycles = {'t_on':t_on, 't_off':t_off, 'dur':dur_each, 'voltage':voltage, 'pwr':pwr}
+        if store != None:
+            cycles = merge_cycles(store, cycles)
+            store_start = store['t_start']
+            if store['t_last'] != None and (t_last == None or store['t_last'] > t_last):
+                t_last = store['t_last'] #no new telemetry since the last run
+                t_unpaired = store['t_pending']
+        else:
+            store_start = DateTime(t_start).secs
+        #an "on" older than dur_lim can no longer start a kept cycle
+        if t_unpaired != None and dur_lim != None and t_unpaired < t_last - dur_lim:
+            t_unpaired = None
+        save_cycles(store_dir, temp, store_key, cycles, store_start, t_last, t_unpaired)
+        in_range = cycles['t_on'] >= DateTime(t_start).secs
+        t_on = cycles['t_on'][in_range]
+        t_off = cycles['t_off'][in_range]
+        dur_each = cycles['dur'][in_range]
+        voltage = cycles['voltage'][in_range]
+        pwr = cycles['pwr'][in_range]
+    
+    if exclude is not None:
+        exclude = strs_to_secs(np.ravel(exclude)).reshape(-1, 2)
+        excluded = IntervalIndex(exclude).overlaps(
+                                 np.column_stack([t_on, t_off]))
+        t_on = t_on[~excluded]
+        t_off = t_off[~excluded]
+        dur_each = dur_each[~excluded]
+        voltage = voltage[~excluded]
+        pwr = pwr[~excluded]
+        if keep_tlm == True:
+            htr_on = htr_on[~excluded]
+            htr_off = htr_off[~excluded]
+    
+    rec.end(rows=len(t_on))
     
     #calendar bookkeeping
-    t4 = time.time()
-    on_dates = DateTime(t_on).iso
-    on_dates_days = np.floor(DateTime(t_on).mjd)
-    on_dates_mos = np.array([date[0:7] for date in on_dates])
-    
-    days = np.arange(np.floor(DateTime(t_start).mjd), DateTime(t_stop).mjd)
-    days_dates = DateTime(days, format='mjd').iso
-    days_mos = np.array([date[0:7] for date in days_dates])
-    mos = np.unique(days_mos)
-    
-    t_days = DateTime(days, format='mjd').secs
-    t_mos = DateTime([mo + '-01 00:00:00.00' for mo in mos]).secs
+    rec.begin('calendar')
+    days = day_range(t_start, t_stop)
+    n_days = len(days)
+    rec.end(rows=n_days)
     
     #compute stats
-    t5 = time.time()
-    on_freq = np.array([np.sum(on_dates_days == day) for day in days])
-    on_freq[np.isnan(on_freq)] = 0
-    on_freq_mo_mean = np.array([np.mean(on_freq[days_mos == mo]) for mo in mos])
-
-    on_time = np.array([np.sum(dur_each[on_dates_days == day]) for day in days])
-    on_time[np.isnan(on_time)] = 0
-    on_time_mo_mean = np.array([np.mean(on_time[days_mos == mo]) for mo in mos])
-    
-    dur = np.array([np.mean(dur_each[on_dates_days == day]) for day in days])
-    dur_mo_mean = np.array([np.mean(dur_each[on_dates_mos == mo]) for mo in mos])
-    
-    acc_pwr = np.array([np.sum(pwr[on_dates_days == day]) for day in days])
-    acc_pwr[np.isnan(acc_pwr)] = 0
-    acc_pwr_mo_mean = np.array([np.mean(acc_pwr[days_mos == mo]) for mo in mos])
-    
-    per_each = np.diff(t_on)
-    per = np.array([np.mean(per_each[on_dates_days[:-1] == day]) for day in days])
-    per_mo_mean = np.array([np.mean(per_each[on_dates_mos[:-1] == mo]) for mo in mos])
-    
-    dc_each = dur_each[:-1] / per_each * 100
-    dc = on_time / (3600*24) * 100
-    dc_mo_mean = np.array([np.mean(dc[days_mos == mo]) for mo in mos])
- 
-    #plots
-    t6 = time.time()
-    
-    t_event = np.array([DateTime(event).secs, DateTime(event).secs])
-    
-    if plot_cycles == True:
-        pp.figure(1, figsize=(6,3)) #- only plot for short timeframes when troubleshooting
-        plot_cxctime(x.times, x.vals, mew=0)
-        plot_cxctime(x.times, x.vals, 'b*',mew=0)
-        plot_cxctime(x.times[htr_on], x.vals[htr_on], 'c*',mew=0, label='Heater On')
-        plot_cxctime(x.times[htr_off], x.vals[htr_off], 'r*',mew=0, label='Heater Off')
-        if event != None:
-            plot_cxctime(t_event, ylim(),'r:')
-        pp.ylabel('deg F')
-        pp.legend(loc=0)
-        pp.title(name + ' Heater Cycling per ' + temp)
-        #pp.tight_layout()
-        pp.savefig('htr_' + temp + '_sample_cycles.png')
-    
-    pp.figure(2, figsize=(6,3))
-    pp.hist(dur_each/60, bins=100)
-    pp.ylabel('instances')
-    pp.xlabel('min')
-    pp.title(name + ' Heater On-Time Durations')
-    pp.savefig('htr_' + temp + '_on_time_hist.png')
-    
-    pp.figure(3, figsize=(6,3))
-    plot_cxctime(t_on, dur_each/60, 'r', alpha=.2, label='Each Cycle')
-    plot_cxctime(t_days[:-1], dur[:-1]/60, 'b', alpha=.5, label='Daily Mean')
-    #omit last month in this case due to small sample size
-    plot_cxctime(t_mos[:-1], dur_mo_mean[:-1]/60, 'k', label='Monthly Mean')
-    if event != None:    
-        plot_cxctime(t_event, ylim(),'r:')
-    pp.title(name + ' Heater On-Time')
-    pp.ylabel('min')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_on_time.png')
-    pp.xlim([DateTime(pp.xlim()[1]-90, format='plotdate').plotdate, pp.xlim()[1]])
-    pp.title(name + ' Heater On-Time (ZOOM)')
-    pp.legend(loc=0)
-    #pp.tight_layout()
-    pp.savefig('htr_' + temp + '_on_time_zoom.png')
-    
-    pp.figure(4, figsize=(6,3))
-    plot_cxctime(t_on[:-1], per_each/60, 'r', alpha=.2, label='Each Cycle')
-    plot_cxctime(t_days[:-1], per[:-1]/60, 'b', alpha=.5, label='Daily Mean')
-    #omit last month in this case due to small sample size
-    plot_cxctime(t_mos[:-1], per_mo_mean[:-1]/60, 'k', label='Monthly Mean')
-    if event != None:    
-        plot_cxctime(t_event, ylim(),'r:')
-    pp.title(name + ' Heater Period')
-    pp.ylabel('min')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_period.png')
-    pp.xlim([DateTime(pp.xlim()[1]-90, format='plotdate').plotdate, pp.xlim()[1]])
-    pp.title(name + ' Heater Period (ZOOM)')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_period_zoom.png')
-        
-    #figure(5, figsize=(6,3))
-    #as a first-order hold, this plotting is more accurate than fig 6
-    #(holds values til the next), but isn't necessary if there's a long
-    #timespan.  Disadvantage is the unhelpful x-axis.
-    #dc_each_step = append_to_array(dc_each, pos=0, val=dc_each[0])
-    #step(t_on, dc_each_step, 'r')
-    #title(name + ' Heater Duty Cycle')
-    #ylabel('%')
-    #savefig('htr_' + temp + '_duty_cycle_step.png')
+    rec.begin('stats')
+    cycles, daily, monthly = cycle_tables(t_on, t_off, dur_each, voltage, pwr, days)
+    result = HtrDcResult(temp, name, event, t_start, t_stop, t_last, cycles, daily, monthly)
+    result.refinement = refinement
+    if use_store:
+        hist_key = hashlib.sha1(repr((store_key, DateTime(t_start).secs, None if exclude is None 
+                                      else exclude.tolist())).encode(
+                                'utf-8')).hexdigest()[:12]
+        result.on_time_hist = on_time_hist(temp, t_on, dur_each, store_dir, hist_key)
+    else:
+        result.on_time_hist = on_time_hist(temp, t_on, dur_each)
+    if not stream and not minmax and t_tlm != None:
+        keep = x.times >= t_tlm
+        window_tlm.append((x.times[keep], x.vals[keep]))
+    if t_tlm != None:
+        tlm_times = np.concatenate([t for t, v in window_tlm])
+        tlm_vals = np.concatenate([v for t, v in window_tlm])
+    for window in windows or []:
+        if window.get('plot_cycles', False):
+            result.windows.append(window_result(result, window, window_start(window, t_stop),
+                                                tlm_times, tlm_vals))
+        else:
+            result.windows.append(window_result(result, window, window_start(window, t_stop)))
+    if keep_tlm == True:
+        cycles['i_on'] = htr_on
+        cycles['i_off'] = htr_off
+        result.times = x.times
+        result.vals = x.vals
+    rec.end(rows=n_days)
+    result.metrics = rec.records()
+    result.timings = rec.timings()
+    return result
 
-    pp.figure(6, figsize=(6,3))
-    plot_cxctime(t_on[:-1], dc_each, 'r', alpha=.2, label='Each Cycle')
-    plot_cxctime(t_days[:-1], dc[:-1], 'b', alpha=.5, label='Daily Mean')
-    #omit last month in this case due to small sample size
-    plot_cxctime(t_mos[:-1], dc_mo_mean[:-1], 'k', label='Monthly Mean') 
-    if event != None:    
-        plot_cxctime(t_event, ylim(),'r:')
-    pp.title(name + ' Heater Duty Cycle')
-    pp.ylabel('%')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_duty_cycle.png')
-    pp.xlim([DateTime(pp.xlim()[1]-90, format='plotdate').plotdate, pp.xlim()[1]])
-    pp.title(name + ' Heater Duty Cycle(ZOOM)')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_duty_cycle_zoom.png')
-    
-    pp.figure(7, figsize=(6,3))
-    plot_cxctime(t_days[:-1], on_freq[:-1], 'b', alpha=.3, label='Cycles Per Day')
-    #omit last month in this case due to small sample size
-    plot_cxctime(t_mos[:-1], on_freq_mo_mean[:-1], 'k', label='Monthly Mean')
-    if event != None:    
-        plot_cxctime(t_event, ylim(),'r:')
-    pp.title(name + ' Heater Cycles Per Day')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_on_freq.png')
-    pp.xlim([DateTime(pp.xlim()[1]-90, format='plotdate').plotdate, pp.xlim()[1]])
-    pp.title(name + ' Heater Cycles Per Day (ZOOM)')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_on_freq_zoom.png')
+def htr_dc(temp, t_start='2008:001', t_stop=None, on_range=None, off_range=None, name=None, event=None, dur_lim=None, plot_cycles=False, logfile='htr_dc_log.txt', store_dir=None, source=None, chunk_days=None, exclude=None, dropout_pairs=None, hysteresis=None, resolution=None, windows=None, resistance=None, epoch_events=None, workers=1, metrics_file='htr_dc_metrics.jsonl', metrics_tags=None, products_dir=None):
+    """This function generates heater cycling metrics based on a nearby  
+    temperature.  Output plots include:
+       - On-time durations
+       - Period
+       - Duty cycle
+       - Cycles per day
+       - Accumulated on-time per day
+       - Accumulated power per day
+       - Time history (optional)
     
-    pp.figure(8, figsize=(6,3))
-    plot_cxctime(t_days[:-1], on_time[:-1]/3600, 'b', alpha=.3, label='On-Time Per Day')
-    #omit last month in this case due to small sample size
-    plot_cxctime(t_mos[:-1], on_time_mo_mean[:-1]/3600, 'k', label='Monthly Mean')
-    if event != None:    
-        plot_cxctime(t_event, ylim(),'r:')
-    pp.title('Accumulated ' + name + ' Heater On-Time Per Day')
-    pp.ylabel('hrs')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_acc_on_time.png')
-    pp.xlim([DateTime(pp.xlim()[1]-90, format='plotdate').plotdate, pp.xlim()[1]])
-    pp.title('Accumulated ' + name + ' Heater On-Time Per Day (ZOOM)')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_acc_on_time_zoom.png')
+    Inputs are as for htr_dc_stats, plus:
+       plot_cycles  Option to plot time-history, highlighting htr on and off points 
+                    (default is False)
+       logfile      Log to record the update in (None for no log); the log is
+                    copied to the web folder once per run (see publish.py)
+       workers      Number of processes to draw the figures with (default is 1)
+       metrics_file JSON-lines file to append this heater's stage metrics to 
+                    (None for no metrics; see instrument.py to summarize it)
+       metrics_tags Extra fields for the metrics record (e.g. the run and round)
+       products_dir Directory to append the per-cycle, daily and monthly tables
+                    to, and to rebuild the heater's statistics index in (see 
+                    products.py and stats_index.py; default is None, i.e. plots 
+                    only)
+    
+       epoch_events List of kadi event types (e.g. ['dumps', 'safe_suns']) to
+                    draw the superposed-epoch on-time of the cycles around 
+                    (see epochs.py) as 'htr_' + msid + '_epoch_*.png'
+    
+    Each output window (see htr_dc_stats) draws the figures listed as its
+    'figures' (default is the time-history if its plot_cycles is set), saving
+    the ZOOM version of those that have one.
     
-    pp.figure(9, figsize=(6,3))
-    plot_cxctime(t_days[:-1], acc_pwr[:-1], 'b', alpha=.3, label='Power Per Day')
-    #omit last month in this case due to small sample size
-    plot_cxctime(t_mos[:-1], acc_pwr_mo_mean[:-1], 'k', label='Monthly Mean')
-    if event != None:    
-        plot_cxctime(t_event, ylim(),'r:')
-    pp.title('Accumulated ' + name + ' Heater Power Per Day')
-    pp.ylabel('W-hrs')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_acc_pwr.png')
-    pp.xlim([DateTime(pp.xlim()[1]-90, format='plotdate').plotdate, pp.xlim()[1]])
-    pp.title('Accumulated ' + name + ' Heater Power Per Day (ZOOM)')
-    pp.legend(loc=0)
-    pp.savefig('htr_' + temp + '_acc_pwr_zoom.png')
+    Figures will be saved to local directory as 'htr_' + msid + '*.png'
+    """
+    result = htr_dc_stats(temp, t_start, t_stop, on_range, off_range, name, event, dur_lim, 
+                          keep_tlm=plot_cycles, store_dir=store_dir, source=source, 
+                          chunk_days=chunk_days, exclude=exclude, 
+                          dropout_pairs=dropout_pairs, hysteresis=hysteresis, 
+                          resolution=resolution, windows=windows, resistance=resistance)
+    
+    rec = Recorder()
+    rec.extend(result.metrics)
+    
+    #data products
+    if products_dir != None:
+        with rec.span('products', rows=len(result.cycles)):
+            write_products(result, products_dir)
+            build_index(products_dir, temp)
+    
+    #plots (only those whose inputs changed since they were last drawn)
+    from htr_dc_plots import render
+    plotted, skipped = render(result, workers=workers)
+    rec.extend(plotted)
+    for w in result.windows:
+        figures = w.window.get('figures', ['sample_cycles'] if w.window.get('plot_cycles') else [])
+        plotted, w_skipped = render(w, workers=workers, figures=figures, zoom_only=True)
+        rec.extend(plotted)
+        skipped = skipped + [w.window['id'] + ':' + figure for figure in w_skipped]
+    for event_type in epoch_events or []:
+        from epochs import event_times, cycle_epochs
+        from htr_dc_plots import plot_epochs
+        with rec.span('epochs:' + event_type) as span:
+            out = cycle_epochs(result.cycles, event_times(event_type, t_start, t_stop), 'dur')
+            plot_epochs(out, temp, 'dur', event_type)
+            span.rows = out['n_events']
     
     print('Processing times for ' + temp + ':')
-    print(str(t1 - t0) + ' - fetching data')
-    print(str(t2 - t1) + ' - find htr on and off times')
-    print(str(t3 - t2) + ' - find matching cycles')
-    print(str(t4 - t3) + ' - compute dur_each and power')
-    print(str(t5 - t4) + ' - calendar bookkeeping')
-    print(str(t6 - t5) + ' - compute stats')
-    print(str(time.time() - t6) + ' - plots')
-    print('Updated through:  ' + DateTime(x.times[-1]).date)
+    for stage, secs in rec.timings():
+        print(str(secs) + ' - ' + stage)
+    if len(skipped) > 0:
+        print('Unchanged (not redrawn):  ' + ', '.join(skipped))
+    print('Updated through:  ' + DateTime(result.t_last).date)
     print('Processing completed at:  ' + DateTime().date)
     print(' ')
     
     if logfile != None:
-        f = open(logfile, 'a')
-        f.write(temp + ' updated through ' + DateTime(x.times[-1]).date + ', completed at ' + DateTime().date + '\n')
-        f.close()
-        f2 = open('updated_thru.html', 'w')
-        f2.write('<font face="sans-serif" size=4> \n')
-        f2.write(DateTime(x.times[-1]).date)
-        f2.close()
-        shutil.copy('/home/aarvai/python/htr_dc/htr_dc_log.txt', '/share/FOT/engineering/prop/Heater_Trending')
-
-
-
-
-    
-
-
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+        if LOG_LOCK != None:
+            LOG_LOCK.acquire()
+        try:
+            f = open(logfile, 'a')
+            f.write(temp + ' updated through ' + DateTime(result.t_last).date + ', completed at ' + DateTime().date + '\n')
+            f.close()
+            f2 = open('updated_thru.html', 'w')
+            f2.write('<font face="sans-serif" size=4> \n')
+            f2.write(DateTime(result.t_last).date)
+            f2.close()
+        finally:
+            if LOG_LOCK != None:
+                LOG_LOCK.release()
+    
+    if metrics_file != None:
+        record = {'type':'heater', 'msid':temp, 'date':DateTime().date, 
+                  't_start':DateTime(t_start).date, 't_stop':DateTime(t_stop).date,
+                  'updated_thru':DateTime(result.t_last).date, 'n_cycles':len(result.cycles),
+                  'wall':sum(s['wall'] for s in rec.records()), 
+                  'cpu':sum(s['cpu'] for s in rec.records()), 'rss':peak_rss(),
+                  'stages':rec.records(), 'skipped':skipped}
+        if result.refinement != None:
+            record['refinement'] = result.refinement
+        record.update(metrics_tags or {})
+        write_records(metrics_file, [record], LOG_LOCK)
@@ -0,0 +1,408 @@
+"""Keeps the heater trending page current by polling for new telemetry,
+instead of recomputing the last 90 days once per batch run.
+
+Each heater keeps its cycle detector, the thermistor telemetry, the
+detected cycles and the daily aggregates of a rolling window (90 days by
+default) in memory; the bus voltage is shared by all heaters and fetched
+once per poll.  Each poll fetches only the telemetry since the last one, so
+the work per poll is proportional to the new data.  Cycles
+and days that age out of the window are evicted.  The ZOOM figures and the
+sample cycles figure are redrawn (and published) only when a heater's
+aggregates changed.
+
+Heaters and detection settings come from a round of the config (see
+htr_dc_runner.py), with the window length taken from the round's days or its
+first output window; the nightly run still produces the mission figures.
+
+usage:  python htr_dc_live.py [--config heaters.json] [--round mission] [--poll 300]
+                              [--web-dir DIR] [--once]
+"""
+import os
+import sys
+import time
+import argparse
+import traceback
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+
+from Chandra.Time import DateTime
+from astropy.table import Table
+
+import htr_dc as htr_dc_module
+from htr_dc_runner import load_config, heater_kwargs, write_log
+from cycles import CycleDetector
+from intervals import IntervalIndex
+from time_bins import day_number, day_start, day_month, month_start, strs_to_secs
+from bucket_stats import bucket_sum
+from energy import heater_energy
+from publish import publish
+
+# Seconds between polls for new telemetry
+POLL = 300.
+
+# Default length of the rolling window [days]
+DAYS = 90
+
+# Figures redrawn from the rolling window (the on-time histogram is left to
+# the nightly mission run)
+FIGURES = ['sample_cycles', 'on_time', 'period', 'duty_cycle', 'on_freq', 'acc_on_time',
+           'acc_pwr']
+
+# Daily aggregates kept per day:  cycle count, on-time [sec], power [W-hrs],
+# and the sum and count of periods starting that day
+DAY_FIELDS = ['on_freq', 'on_time', 'acc_pwr', 'per_sum', 'per_n']
+
+class RingBuffer(object):
+    """First-in first-out table of numpy columns stored in a circular buffer,
+    so appending new rows and evicting old ones doesn't move the rest.  The
+    capacity doubles whenever an append would overflow it.
+
+    Rows must be appended in order of the column used to evict them.  The
+    number of rows evicted so far is kept as dropped, i.e. the index (from
+    the first row ever appended) of the oldest row still held.
+
+    e.g. ring = RingBuffer(['times', 'vals'])
+         ring.append(times=x.times, vals=x.vals)
+         ring.drop_before('times', t_start)
+         ring.column('vals')
+    """
+    def __init__(self, columns, capacity=1024, dtypes=None):
+        dtypes = dtypes or {}
+        self.columns = list(columns)
+        self.data = dict((col, np.zeros(capacity, dtype=dtypes.get(col, float)))
+                         for col in self.columns)
+        self.start = 0      #position of the oldest row
+        self.size = 0       #number of rows held
+        self.dropped = 0    #number of rows evicted so far
+
+    def __len__(self):
+        return self.size
+
+    def capacity(self):
+        return len(self.data[self.columns[0]])
+
+    def _segments(self, col):
+        """Returns the rows of a column as (at most) two contiguous views, oldest first."""
+        a = self.data[col]
+        stop = self.start + self.size
+        if stop <= len(a):
+            return a[self.start:stop], a[:0]
+        return a[self.start:], a[:stop - len(a)]
+
+    def column(self, col, first=0):
+        """Returns a copy of a column from row first on, oldest row first."""
+        a, b = self._segments(col)
+        if first >= len(a):
+            return b[first - len(a):].copy()
+        return np.concatenate([a[first:], b])
+
+    def count_before(self, col, value):
+        """Returns the number of rows whose col is less than value."""
+        first, second = self._segments(col)
+        n = np.searchsorted(first, value)
+        if n == len(first):
+            n = n + np.searchsorted(second, value)
+        return n
+
+    def _grow(self, n):
+        capacity = max(2 * self.capacity(), self.size + n)
+        for col in self.columns:
+            a = np.zeros(capacity, dtype=self.data[col].dtype)
+            a[:self.size] = self.column(col)
+            self.data[col] = a
+        self.start = 0
+
+    def append(self, **cols):
+        """Appends rows (one array per column)."""
+        n = len(cols[self.columns[0]])
+        if n == 0:
+            return
+        if self.size + n > self.capacity():
+            self._grow(n)
+        pos = (self.start + self.size + np.arange(n)) % self.capacity()
+        for col in self.columns:
+            self.data[col][pos] = cols[col]
+        self.size = self.size + n
+
+    def drop_before(self, col, value):
+        """Evicts the rows whose col is less than value.  Returns the number
+        of rows evicted.
+        """
+        n = self.count_before(col, value)
+        self.start = (self.start + n) % self.capacity()
+        self.size = self.size - n
+        self.dropped = self.dropped + n
+        return n
+
+def update_volts(volts, start, now, source=None):
+    """This function appends the bus voltage (ELBV 5-minute means) since the
+    last row of a RingBuffer of times and vals (or since start, if it is
+    empty) up to now.
+    """
+    v_last = volts.column('times', len(volts) - 1) if len(volts) > 0 else []
+    v = htr_dc_module.fetch_msid('ELBV', start if len(v_last) == 0 else v_last[0], now,
+                                 stat='5min', source=source)
+    v_new = np.ones(len(v.times), dtype='bool') if len(v_last) == 0 else v.times > v_last[0]
+    volts.append(times=v.times[v_new], vals=v.vals[v_new])
+
+class LiveHeater(object):
+    """Rolling-window heater cycling state for one heater, updated with only
+    the telemetry since the last update.
+
+    Inputs:
+       msid         Thermistor near heater
+       kwargs       htr_dc keyword arguments for the heater (see
+                    htr_dc_runner.heater_kwargs); on_range, off_range, dur_lim,
+                    hysteresis, dropout_pairs, exclude, name and event are used
+       days         Length of the rolling window [days]
+       source       Telemetry source (default is the engineering archive)
+       volts        RingBuffer of bus voltage shared with other heaters and
+                    kept current by the caller (see poll); by default each
+                    heater fetches its own
+
+    The window starts at the beginning of the day days before the current
+    one, so it (and the daily aggregates) only move at day boundaries.
+    """
+    def __init__(self, msid, kwargs, days=DAYS, source=None, volts=None):
+        self.msid = msid
+        self.kwargs = kwargs
+        self.days = days
+        self.source = source
+        self.detector = CycleDetector(kwargs.get('on_range'), kwargs.get('off_range'),
+                                      kwargs.get('dur_lim'), kwargs.get('hysteresis'))
+        self.tlm = RingBuffer(['times', 'vals'], capacity=1 << 18)
+        self.shared_volts = volts != None
+        self.volts = volts if self.shared_volts else RingBuffer(['times', 'vals'], capacity=1 << 15)
+        self.cycles = RingBuffer(['t_on', 't_off', 'dur', 'voltage', 'pwr', 'i_on', 'i_off'],
+                                 dtypes={'i_on':int, 'i_off':int})
+        self.daily = {}             #day number -> array of DAY_FIELDS
+        self.first_day = None       #first day of the window
+        self.last_day = None        #day of the last update
+        self.exclude = None
+        if kwargs.get('exclude') is not None:
+            self.exclude = IntervalIndex(strs_to_secs(np.ravel(kwargs['exclude'])).reshape(-1, 2))
+
+    def _fetch_temp(self, t_start, t_stop):
+        pairs = self.kwargs.get('dropout_pairs')
+        if pairs != None:
+            return htr_dc_module.fetch_without_dropouts(self.msid, t_start, t_stop, pairs,
+                                                        self.source)
+        return htr_dc_module.fetch_msid(self.msid, t_start, t_stop, source=self.source)
+
+    def _add_days(self, days, field, vals):
+        """Adds values to one of the daily aggregates, by day number."""
+        uniq, inv = np.unique(days, return_inverse=True)
+        sums = np.bincount(inv, weights=vals, minlength=len(uniq))
+        for day, val in zip(uniq, sums):
+            if day not in self.daily:
+                self.daily[day] = np.zeros(len(DAY_FIELDS))
+            self.daily[day][DAY_FIELDS.index(field)] += val
+
+    def update(self, t_now=None):
+        """Fetches the telemetry since the last update (or for the whole
+        window, the first time), detects the cycles it completes and rolls
+        the window forward to t_now (default is current time).  Returns True
+        if the aggregates changed.
+        """
+        now = DateTime(t_now).secs
+        today = day_number(now)
+        first_day = today - self.days
+        start = day_start(first_day)
+        changed = today != self.last_day or first_day != self.first_day
+
+        #new telemetry (the detector drops anything it has already seen, so
+        #drop it from the buffers too)
+        t_last = self.detector.t_last
+        x = self._fetch_temp(start if t_last == None else t_last, now)
+        new = np.ones(len(x.times), dtype='bool') if t_last == None else x.times > t_last
+        self.tlm.append(times=x.times[new], vals=x.vals[new])
+        if not self.shared_volts:
+            update_volts(self.volts, start, now, self.source)
+        found = self.detector.update(x.times[new], x.vals[new])
+
+        t_on = found['t_on']
+        t_off = found['t_off']
+        keep = np.ones(len(t_on), dtype='bool')
+        if self.exclude is not None and len(t_on) > 0:
+            keep = ~self.exclude.overlaps(np.column_stack([t_on, t_off]))
+        if np.any(keep):
+            t_on = t_on[keep]
+            t_off = t_off[keep]
+            dur = t_off - t_on
+            #only the voltage from the sample before the first new "on" is needed
+            first = max(self.volts.count_before('times', t_on[0]) - 1, 0)
+            voltage, pwr = heater_energy(self.volts.column('times', first), 
+                                         self.volts.column('vals', first), t_on, t_off,
+                                         self.kwargs.get('resistance'))
+
+            #the period of the previous cycle ends with the first new "on"
+            prev = self.cycles.column('t_on')[-1:]
+            per_on = np.concatenate([prev, t_on])
+            per_each = np.diff(per_on)
+            days = day_number(t_on)
+            self._add_days(days, 'on_freq', np.ones(len(t_on)))
+            self._add_days(days, 'on_time', dur)
+            self._add_days(days, 'acc_pwr', pwr)
+            self._add_days(day_number(per_on[:-1]), 'per_sum', per_each)
+            self._add_days(day_number(per_on[:-1]), 'per_n', np.ones(len(per_each)))
+            self.cycles.append(t_on=t_on, t_off=t_off, dur=dur, voltage=voltage, pwr=pwr,
+                               i_on=found['i_on'][keep], i_off=found['i_off'][keep])
+            changed = True
+
+        #evict what has aged out of the window
+        self.cycles.drop_before('t_on', start)
+        self.tlm.drop_before('times', start)
+        if not self.shared_volts:
+            self.volts.drop_before('times', start)
+        for day in [day for day in self.daily if day < first_day]:
+            del self.daily[day]
+        self.first_day = first_day
+        self.last_day = today
+        return changed
+
+    def result(self):
+        """Returns the rolling window as an htr_dc.HtrDcResult (with the
+        thermistor time history, as if computed with keep_tlm).
+        """
+        days = np.arange(self.first_day, self.last_day + 1)
+        agg = np.array([self.daily.get(day, np.zeros(len(DAY_FIELDS))) for day in days])
+        agg = dict((field, agg[:, j]) for j, field in enumerate(DAY_FIELDS))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dur = np.where(agg['on_freq'] > 0, agg['on_time'] / agg['on_freq'], np.nan)
+            per = np.where(agg['per_n'] > 0, agg['per_sum'] / agg['per_n'], np.nan)
+        dc = agg['on_time'] / (3600*24) * 100
+        daily = Table([day_start(days), agg['on_freq'], agg['on_time'], dur, agg['acc_pwr'],
+                       per, dc], names=['t', 'on_freq', 'on_time', 'dur', 'acc_pwr', 'per', 'dc'])
+
+        mos = day_month(days)
+        mo_i = mos - mos[0]
+        n_mos = mo_i[-1] + 1
+        n_days = np.bincount(mo_i, minlength=n_mos)
+        def mo_mean(vals):
+            return bucket_sum(mo_i, vals, n_mos) / n_days
+        def mo_ratio(num, den):
+            num = bucket_sum(mo_i, num, n_mos)
+            den = bucket_sum(mo_i, den, n_mos)
+            out = np.zeros(n_mos) * np.nan
+            out[den > 0] = num[den > 0] / den[den > 0]
+            return out
+        monthly = Table([month_start(np.arange(mos[0], mos[-1] + 1)), mo_mean(agg['on_freq']),
+                         mo_mean(agg['on_time']), mo_ratio(agg['on_time'], agg['on_freq']),
+                         mo_mean(agg['acc_pwr']), mo_ratio(agg['per_sum'], agg['per_n']),
+                         mo_mean(dc)],
+                        names=['t', 'on_freq', 'on_time', 'dur', 'acc_pwr', 'per', 'dc'])
+
+        t_on = self.cycles.column('t_on')
+        t_off = self.cycles.column('t_off')
+        dur_each = self.cycles.column('dur')
+        per_col = np.zeros(len(t_on)) * np.nan #period and duty cycle to the next cycle
+        per_col[:-1] = np.diff(t_on)
+        dc_col = np.zeros(len(t_on)) * np.nan
+        dc_col[:-1] = dur_each[:-1] / per_col[:-1] * 100
+        cycles = Table([t_on, t_off, dur_each, self.cycles.column('voltage'),
+                        self.cycles.column('pwr'), per_col, dc_col,
+                        self.cycles.column('i_on') - self.tlm.dropped,
+                        self.cycles.column('i_off') - self.tlm.dropped],
+                       names=['t_on', 't_off', 'dur', 'voltage', 'pwr', 'per', 'dc',
+                              'i_on', 'i_off'])
+        result = htr_dc_module.HtrDcResult(self.msid, self.kwargs.get('name'),
+                                           self.kwargs.get('event'),
+                                           DateTime(day_start(self.first_day)).date, None,
+                                           self.detector.t_last, cycles, daily, monthly)
+        result.times = self.tlm.column('times')
+        result.vals = self.tlm.column('vals')
+        return result
+
+def write_updated_thru(heaters):
+    """This function writes the updated-through page for the earliest heater.
+    Nothing is written until some heater has telemetry.
+    """
+    t_lasts = [h.detector.t_last for h in heaters if h.detector.t_last != None]
+    if len(t_lasts) == 0:
+        return
+    t_last = min(t_lasts)
+    f = open('updated_thru.html', 'w')
+    f.write('<font face="sans-serif" size=4> \n')
+    f.write(DateTime(t_last).date)
+    f.close()
+
+def poll(config, heaters, volts=None):
+    """This function updates every heater once, redraws the figures of those
+    whose aggregates changed and publishes them.  If the heaters share a
+    RingBuffer of bus voltage (volts), it is fetched once for all of them.
+    Returns the list of msids updated.
+    """
+    from htr_dc_plots import render, figure_files
+    now = DateTime().secs
+    if volts != None:
+        start = min(day_start(day_number(now) - h.days) for h in heaters)
+        update_volts(volts, start, now, heaters[0].source)
+        volts.drop_before('times', start)
+    updated = []
+    files = []
+    for h in heaters:
+        try:
+            if not h.update(now):
+                continue
+            render(h.result(), figures=FIGURES, zoom_only=True)
+        except Exception:
+            print('Update FAILED for ' + h.msid + ':')
+            print(traceback.format_exc())
+            continue
+        updated.append(h.msid)
+        files.extend(file for figure in FIGURES for file in figure_files(h.msid, figure, True))
+    if len(updated) > 0:
+        write_updated_thru(heaters)
+        files = [file for file in files if os.path.exists(file)] + ['updated_thru.html']
+        publish(files, os.path.join(config['web_dir'], 'plots'), config.get('publish_workers', 8))
+    return updated
+
+def live_kwargs(heater, rnd, config):
+    """This function returns the htr_dc keyword arguments and the window
+    length [days] for one heater in a round:  the round's days, or else its
+    first output window with days, whose dur_lim (if any) also applies.
+    """
+    kwargs = heater_kwargs(heater, rnd, config)
+    if rnd.get('days') != None:
+        return kwargs, rnd['days']
+    windows = [w for w in kwargs['windows'] or [] if 'days' in w]
+    if len(windows) == 0:
+        return kwargs, DAYS
+    dur_lim = windows[0].get('dur_lim')
+    if dur_lim != None:
+        kwargs['dur_lim'] = dur_lim if kwargs['dur_lim'] == None else min(dur_lim, kwargs['dur_lim'])
+    return kwargs, windows[0]['days']
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Keep heater trending current')
+    parser.add_argument('--config', default='heaters.json', help='Heater config file')
+    parser.add_argument('--round', default='mission',
+                        help='Round whose heater settings and window are used')
+    parser.add_argument('--poll', type=float, default=POLL, help='Seconds between polls')
+    parser.add_argument('--web-dir', default=None, help='Folder to publish to (default from config)')
+    parser.add_argument('--once', action='store_true', help='Update once and exit')
+    opt = parser.parse_args(args)
+
+    config = load_config(opt.config)
+    if opt.web_dir != None:
+        config['web_dir'] = opt.web_dir
+    rnd = [r for r in config['rounds'] if r['id'] == opt.round][0]
+    volts = RingBuffer(['times', 'vals'], capacity=1 << 15)
+    heaters = []
+    for heater in config['heaters']:
+        kwargs, days = live_kwargs(heater, rnd, config)
+        heaters.append(LiveHeater(heater['msid'], kwargs, days, volts=volts))
+    write_log(config, ['Live updates of ' + rnd['title'] + ' started at ' + DateTime().date])
+    while True:
+        t0 = time.time()
+        updated = poll(config, heaters, volts)
+        if len(updated) > 0:
+            print(DateTime().date + ' updated ' + ', '.join(updated))
+        if opt.once:
+            break
+        time.sleep(max(opt.poll - (time.time() - t0), 0))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
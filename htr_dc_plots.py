@@ -0,0 +1,411 @@
+import os
+import glob
+import json
+import fcntl
+import contextlib
+import hashlib
+import multiprocessing
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as pp
+import numpy as np
+
+from Chandra.Time import DateTime
+from Ska.Matplotlib import plot_cxctime
+
+from decimate import minmax_indices
+from instrument import Recorder
+from histograms import Hist1D
+
+def _event_line(r):
+    if r.event != None:
+        t_event = np.array([DateTime(r.event).secs, DateTime(r.event).secs])
+        plot_cxctime(t_event, pp.ylim(),'r:')
+
+def _pixels():
+    """Returns the width of the current figure in saved pixels."""
+    dpi = matplotlib.rcParams['savefig.dpi']
+    if not isinstance(dpi, (int, float)):
+        dpi = pp.gcf().dpi
+    return int(pp.gcf().get_figwidth() * dpi)
+
+def _plot(t, y, fmt, window, **kwargs):
+    """plot_cxctime of a series decimated to a min/max envelope per pixel
+    column of the current figure, over the window (in secs) being shown.
+    """
+    idx = minmax_indices(t, y, _pixels(), window)
+    plot_cxctime(np.asarray(t)[idx], np.asarray(y)[idx], fmt, **kwargs)
+
+def _full_and_zoom(r, draw, title, filename):
+    """Draws and saves a figure over the full timeframe, then redraws it for 
+    the last 90 days shown (so each version is decimated for its own window)
+    and saves it as the ZOOM version.  draw is a function of the window (in 
+    secs, None for everything) and the y-limits to use (None for automatic).
+    If only ZOOM versions are being rendered, the full figure is drawn (for
+    its limits) but not saved.
+    """
+    draw(None, None)
+    pp.title(title)
+    pp.legend(loc=0)
+    if not _ZOOM_ONLY:
+        pp.savefig(filename + '.png')
+    ylim = pp.ylim()
+    x1 = pp.xlim()[1]
+    x0 = DateTime(x1-90, format='plotdate').plotdate
+    pp.clf()
+    draw((DateTime(x0, format='plotdate').secs, DateTime(x1, format='plotdate').secs), ylim)
+    pp.xlim([x0, x1])
+    pp.title(title + ' (ZOOM)')
+    pp.legend(loc=0)
+    #pp.tight_layout()
+    pp.savefig(filename + '_zoom.png')
+
+def _finish(r, ylim):
+    if ylim != None:
+        pp.ylim(ylim)
+    _event_line(r)
+
+def plot_sample_cycles(r):
+    """Time-history, highlighting htr on and off points (requires the result
+    to have been computed with keep_tlm).
+    """
+    if r.times is None:
+        return
+    i_on = r.cycles['i_on']
+    i_off = r.cycles['i_off']
+    pp.figure(1, figsize=(6,3)) #- only plot for short timeframes when troubleshooting
+    _plot(r.times, r.vals, '-', None, mew=0)
+    _plot(r.times, r.vals, 'b*', None, mew=0)
+    plot_cxctime(r.times[i_on], r.vals[i_on], 'c*',mew=0, label='Heater On')
+    plot_cxctime(r.times[i_off], r.vals[i_off], 'r*',mew=0, label='Heater Off')
+    _event_line(r)
+    pp.ylabel('deg F')
+    pp.legend(loc=0)
+    pp.title(r.name + ' Heater Cycling per ' + r.temp)
+    #pp.tight_layout()
+    pp.savefig('htr_' + r.temp + '_sample_cycles.png')
+
+def plot_on_time_hist(r):
+    hist = r.on_time_hist
+    if hist is None:
+        from htr_dc import ON_TIME_EDGES
+        hist = Hist1D(ON_TIME_EDGES).update(np.asarray(r.cycles['dur']) / 60)
+    edges, counts = hist.occupied(100)
+    pp.figure(2, figsize=(6,3))
+    pp.bar(edges[:-1], counts, width=np.diff(edges), align='edge')
+    pp.ylabel('instances')
+    pp.xlabel('min')
+    pp.title(r.name + ' Heater On-Time Durations')
+    pp.savefig('htr_' + r.temp + '_on_time_hist.png')
+
+def plot_on_time(r):
+    c, d, m = r.cycles, r.daily, r.monthly
+    def draw(window, ylim):
+        _plot(c['t_on'], c['dur']/60, 'r', window, alpha=.2, label='Each Cycle')
+        _plot(d['t'][:-1], d['dur'][:-1]/60, 'b', window, alpha=.5, label='Daily Mean')
+        #omit last month in this case due to small sample size
+        plot_cxctime(m['t'][:-1], m['dur'][:-1]/60, 'k', label='Monthly Mean')
+        _finish(r, ylim)
+        pp.ylabel('min')
+    pp.figure(3, figsize=(6,3))
+    _full_and_zoom(r, draw, r.name + ' Heater On-Time', 'htr_' + r.temp + '_on_time')
+
+def plot_period(r):
+    c, d, m = r.cycles, r.daily, r.monthly
+    def draw(window, ylim):
+        _plot(c['t_on'][:-1], c['per'][:-1]/60, 'r', window, alpha=.2, label='Each Cycle')
+        _plot(d['t'][:-1], d['per'][:-1]/60, 'b', window, alpha=.5, label='Daily Mean')
+        #omit last month in this case due to small sample size
+        plot_cxctime(m['t'][:-1], m['per'][:-1]/60, 'k', label='Monthly Mean')
+        _finish(r, ylim)
+        pp.ylabel('min')
+    pp.figure(4, figsize=(6,3))
+    _full_and_zoom(r, draw, r.name + ' Heater Period', 'htr_' + r.temp + '_period')
+
+#figure(5, figsize=(6,3))
+#as a first-order hold, this plotting is more accurate than fig 6
+#(holds values til the next), but isn't necessary if there's a long
+#timespan.  Disadvantage is the unhelpful x-axis.
+#dc_each_step = append_to_array(dc_each, pos=0, val=dc_each[0])
+#step(t_on, dc_each_step, 'r')
+#title(name + ' Heater Duty Cycle')
+#ylabel('%')
+#savefig('htr_' + temp + '_duty_cycle_step.png')
+
+def plot_duty_cycle(r):
+    c, d, m = r.cycles, r.daily, r.monthly
+    def draw(window, ylim):
+        _plot(c['t_on'][:-1], c['dc'][:-1], 'r', window, alpha=.2, label='Each Cycle')
+        _plot(d['t'][:-1], d['dc'][:-1], 'b', window, alpha=.5, label='Daily Mean')
+        #omit last month in this case due to small sample size
+        plot_cxctime(m['t'][:-1], m['dc'][:-1], 'k', label='Monthly Mean') 
+        _finish(r, ylim)
+        pp.ylabel('%')
+    pp.figure(6, figsize=(6,3))
+    _full_and_zoom(r, draw, r.name + ' Heater Duty Cycle', 'htr_' + r.temp + '_duty_cycle')
+
+def plot_on_freq(r):
+    d, m = r.daily, r.monthly
+    def draw(window, ylim):
+        _plot(d['t'][:-1], d['on_freq'][:-1], 'b', window, alpha=.3, label='Cycles Per Day')
+        #omit last month in this case due to small sample size
+        plot_cxctime(m['t'][:-1], m['on_freq'][:-1], 'k', label='Monthly Mean')
+        _finish(r, ylim)
+    pp.figure(7, figsize=(6,3))
+    _full_and_zoom(r, draw, r.name + ' Heater Cycles Per Day', 'htr_' + r.temp + '_on_freq')
+
+def plot_acc_on_time(r):
+    d, m = r.daily, r.monthly
+    def draw(window, ylim):
+        _plot(d['t'][:-1], d['on_time'][:-1]/3600, 'b', window, alpha=.3, label='On-Time Per Day')
+        #omit last month in this case due to small sample size
+        plot_cxctime(m['t'][:-1], m['on_time'][:-1]/3600, 'k', label='Monthly Mean')
+        _finish(r, ylim)
+        pp.ylabel('hrs')
+    pp.figure(8, figsize=(6,3))
+    _full_and_zoom(r, draw, 'Accumulated ' + r.name + ' Heater On-Time Per Day', 
+                   'htr_' + r.temp + '_acc_on_time')
+
+def plot_acc_pwr(r):
+    d, m = r.daily, r.monthly
+    def draw(window, ylim):
+        _plot(d['t'][:-1], d['acc_pwr'][:-1], 'b', window, alpha=.3, label='Power Per Day')
+        #omit last month in this case due to small sample size
+        plot_cxctime(m['t'][:-1], m['acc_pwr'][:-1], 'k', label='Monthly Mean')
+        _finish(r, ylim)
+        pp.ylabel('W-hrs')
+    pp.figure(9, figsize=(6,3))
+    _full_and_zoom(r, draw, 'Accumulated ' + r.name + ' Heater Power Per Day', 
+                   'htr_' + r.temp + '_acc_pwr')
+
+def plot_epochs(out, temp, metric, event_type):
+    """Superposed-epoch curves of a cycle metric around an event type (see
+    epochs.superposed_epoch):  the mean, median and 10th-90th percentile band
+    across events.
+    """
+    scale, units = {'dur':(60., 'min'), 'per':(60., 'min'), 'dc':(1., '%'), 
+                    'pwr':(1., 'W-hrs'), 'count':(1., 'cycles')}.get(metric, (1., ''))
+    t = out['t'] / 3600
+    pp.figure(10, figsize=(6,3))
+    pp.fill_between(t, out['p10'] / scale, out['p90'] / scale, color='b', alpha=.2,
+                    label='10th-90th Percentile')
+    pp.plot(t, out['p50'] / scale, 'b--', label='Median')
+    pp.plot(t, out['mean'] / scale, 'k', label='Mean')
+    pp.axvline(0, color='r', linestyle=':')
+    pp.xlabel('hours from event')
+    pp.ylabel(units)
+    pp.title(temp + ' ' + metric + ' around ' + str(out['n_events']) + ' ' + event_type)
+    pp.legend(loc=0)
+    pp.savefig('htr_' + temp + '_epoch_' + event_type + '_' + metric + '.png')
+    pp.close(10)
+
+FIGURES = [('sample_cycles', plot_sample_cycles),
+           ('on_time_hist', plot_on_time_hist),
+           ('on_time', plot_on_time),
+           ('period', plot_period),
+           ('duty_cycle', plot_duty_cycle),
+           ('on_freq', plot_on_freq),
+           ('acc_on_time', plot_acc_on_time),
+           ('acc_pwr', plot_acc_pwr)]
+
+# Inputs drawn by each figure, as (table, column); see fingerprint
+FIGURE_INPUTS = {'sample_cycles': [('tlm', 'times'), ('tlm', 'vals'), ('cycles', 'i_on'), 
+                                   ('cycles', 'i_off')],
+                 'on_time_hist': [('cycles', 'dur')],
+                 'on_time': [('cycles', 't_on'), ('cycles', 'dur'), ('daily', 't'), ('daily', 'dur'),
+                             ('monthly', 't'), ('monthly', 'dur')],
+                 'period': [('cycles', 't_on'), ('cycles', 'per'), ('daily', 't'), ('daily', 'per'),
+                            ('monthly', 't'), ('monthly', 'per')],
+                 'duty_cycle': [('cycles', 't_on'), ('cycles', 'dc'), ('daily', 't'), ('daily', 'dc'),
+                                ('monthly', 't'), ('monthly', 'dc')],
+                 'on_freq': [('daily', 't'), ('daily', 'on_freq'), ('monthly', 't'), 
+                             ('monthly', 'on_freq')],
+                 'acc_on_time': [('daily', 't'), ('daily', 'on_time'), ('monthly', 't'), 
+                                 ('monthly', 'on_time')],
+                 'acc_pwr': [('daily', 't'), ('daily', 'acc_pwr'), ('monthly', 't'), 
+                             ('monthly', 'acc_pwr')]}
+
+# Figures drawn once (the rest are also saved as a _zoom version)
+SINGLE = ['sample_cycles', 'on_time_hist']
+
+# Bump whenever the figures' appearance changes, so every figure is redrawn
+RENDER_VERSION = 3
+
+def figure_files(temp, figure, zoom_only=False):
+    """This function returns the PNG files saved for one figure."""
+    base = 'htr_' + temp + '_' + figure
+    if figure in SINGLE:
+        return [base + '.png']
+    if zoom_only:
+        return [base + '_zoom.png']
+    return [base + '.png', base + '_zoom.png']
+
+def _print_key(figure, zoom_only):
+    """Returns the key a figure's fingerprint is kept under (ZOOM-only
+    renders are tracked separately from full ones).
+    """
+    if zoom_only and figure not in SINGLE:
+        return figure + ':zoom'
+    return figure
+
+def fingerprint(result, figure):
+    """This function returns a hash of what a figure of an HtrDcResult plots:
+    the columns it draws (the whole daily and monthly tables), the heater's
+    msid, name and event, the timeframe and output window it covers, and 
+    RENDER_VERSION.  A figure is redrawn whenever its timeframe moves, even
+    if the heater has stopped cycling, so its axes (and ZOOM view) keep up.
+    """
+    h = hashlib.sha1()
+    h.update(repr((RENDER_VERSION, figure, result.temp, result.name, result.event,
+                   str(result.t_start), str(result.t_stop),
+                   None if result.window is None else sorted(result.window.items()))
+                  ).encode('utf-8'))
+    for table, column in FIGURE_INPUTS[figure]:
+        if table == 'tlm':
+            vals = getattr(result, column)
+        elif column in getattr(result, table).colnames:
+            vals = np.asarray(getattr(result, table)[column])
+        else:
+            vals = None
+        if vals is None:
+            h.update(b'-')
+            continue
+        vals = np.ascontiguousarray(vals)
+        h.update(str(vals.dtype).encode('ascii') + str(len(vals)).encode('ascii'))
+        h.update(vals.tobytes())
+    return h.hexdigest()
+
+def fingerprint_file(temp):
+    return 'htr_' + temp + '_fingerprints.json'
+
+def read_fingerprints(temp):
+    """This function returns the fingerprints of a heater's last rendered
+    figures:  a dictionary of figure name to 'fingerprint', 'files' and
+    'rendered' (date drawn), plus 'skipped' (date skipped, if it was).
+    """
+    if not os.path.exists(fingerprint_file(temp)):
+        return {}
+    f = open(fingerprint_file(temp))
+    out = json.load(f)
+    f.close()
+    return out
+
+@contextlib.contextmanager
+def _fingerprint_lock(temp):
+    f = open(fingerprint_file(temp) + '.lock', 'a')
+    fcntl.flock(f, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+def write_fingerprints(temp, fingerprints):
+    """This function merges fingerprints (as from read_fingerprints, for the
+    figures just drawn or skipped) into a heater's fingerprint file.  The
+    file is re-read and rewritten under a lock, through a temporary file
+    renamed into place, so the nightly run and htr_dc_live.py can render the
+    same heater without losing each other's entries.
+    """
+    filename = fingerprint_file(temp)
+    with _fingerprint_lock(temp):
+        prints = read_fingerprints(temp)
+        prints.update(fingerprints)
+        tmp = filename + '.' + str(os.getpid()) + '.tmp'
+        f = open(tmp, 'w')
+        json.dump(prints, f, indent=1, sort_keys=True)
+        f.close()
+        os.rename(tmp, filename)
+
+def rendered_since(directory, since):
+    """This function returns the PNG files in a directory that were drawn at
+    or after since (a DateTime date), according to the heaters' fingerprint
+    files, along with those whose drawing was skipped as unchanged.
+    """
+    changed = []
+    skipped = []
+    for filename in glob.glob(os.path.join(directory, 'htr_*_fingerprints.json')):
+        f = open(filename)
+        prints = json.load(f)
+        f.close()
+        for figure in sorted(prints):
+            files = [os.path.join(directory, file) for file in prints[figure]['files']]
+            if prints[figure]['rendered'] >= since:
+                changed.extend(files)
+            else:
+                skipped.extend(files)
+    return changed, skipped
+
+# Result being rendered by a worker process, and whether only the ZOOM
+# versions are saved (set by _init_worker)
+_RESULT = None
+_ZOOM_ONLY = False
+
+def _init_worker(result, zoom_only=False):
+    global _RESULT, _ZOOM_ONLY
+    _RESULT = result
+    _ZOOM_ONLY = zoom_only
+
+def _render_one(figure):
+    rec = Recorder()
+    with rec.span('plot:' + figure, rows=len(_RESULT.cycles)):
+        dict(FIGURES)[figure](_RESULT)
+        pp.close('all')
+    return rec.records()[0]
+
+def render(result, workers=1, figures=None, force=False, zoom_only=False):
+    """This function draws the 'htr_' + msid + '*.png' figures for an
+    HtrDcResult (see htr_dc.htr_dc_stats) with the Agg backend.
+
+    Inputs:
+       result       HtrDcResult to plot
+       workers      Number of processes to spread the figures across
+                    (default is 1, i.e. draw in this process)
+       figures      Names of the figures to draw (default is all of FIGURES)
+       force        Draw every figure, even those whose inputs are unchanged
+       zoom_only    Save only the ZOOM version of each figure that has one
+                    (e.g. for htr_dc_live.py, whose result only covers the 
+                    ZOOM window), leaving the full versions as they are
+
+    A figure is skipped (neither drawn nor saved) when its fingerprint matches
+    the one recorded when its files were last saved and the files still exist.
+    Fingerprints, with the date each figure was last drawn or skipped, are 
+    kept in 'htr_' + msid + '_fingerprints.json'.
+
+    Returns a span record (see instrument.Recorder) for each figure drawn and
+    the list of figures skipped.
+    """
+    if figures == None:
+        figures = [figure for figure, func in FIGURES]
+    if result.times is None:
+        figures = [figure for figure in figures if figure != 'sample_cycles']
+    prints = read_fingerprints(result.temp)
+    key = dict((figure, _print_key(figure, zoom_only)) for figure in figures)
+    new = dict((figure, fingerprint(result, figure)) for figure in figures)
+    skipped = [figure for figure in figures if not force and key[figure] in prints and
+               prints[key[figure]]['fingerprint'] == new[figure] and
+               all(os.path.exists(file) for file in figure_files(result.temp, figure, zoom_only))]
+    figures = [figure for figure in figures if figure not in skipped]
+    pp.close('all')
+    if workers > 1 and len(figures) > 1:
+        pool = multiprocessing.Pool(min(workers, len(figures)), initializer=_init_worker,
+                                    initargs=(result, zoom_only))
+        try:
+            out = pool.map(_render_one, figures, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(result, zoom_only)
+        out = [_render_one(figure) for figure in figures]
+    
+    now = DateTime().date
+    for figure in figures:
+        prints[key[figure]] = {'fingerprint': new[figure], 'rendered': now,
+                               'files': figure_files(result.temp, figure, zoom_only)}
+    for figure in skipped:
+        prints[key[figure]]['skipped'] = now
+    write_fingerprints(result.temp, dict((key[figure], prints[key[figure]])
+                                         for figure in figures + skipped))
+    return out, skipped
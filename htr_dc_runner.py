@@ -0,0 +1,264 @@
+"""Runs htr_dc for every heater listed in a config file (heaters.json by
+default), spreading the heaters in each round across a pool of worker
+processes.
+
+Each heater's stage metrics, and a record for the run as a whole, are
+appended to the metrics file (see instrument.py).  Changed plots and the
+run log are published to the web folder at the end of the run (see
+publish.py).
+
+usage:  python htr_dc_runner.py [--config heaters.json] [--workers N] [--web-dir DIR]
+"""
+import os
+import sys
+import glob
+import json
+import shutil
+import tempfile
+import argparse
+import resource
+import traceback
+import multiprocessing
+
+import matplotlib
+matplotlib.use('Agg')
+
+from Chandra.Time import DateTime
+
+import coarse
+import htr_dc as htr_dc_module
+from tlm_cache import TlmCache
+from tlm_batch import acquire
+from publish import publish
+from instrument import Recorder, write_records, peak_rss
+
+# Telemetry source shared by every heater in the run (set by _init_worker)
+_SOURCE = None
+
+def load_config(filename):
+    """This function reads the heater table and run settings from a JSON
+    config file.
+    """
+    f = open(filename)
+    config = json.load(f)
+    f.close()
+    return config
+
+def heater_kwargs(heater, rnd, config, t_stop=None):
+    """This function returns the htr_dc keyword arguments for one heater in
+    one round, applying any round-specific overrides listed for the heater
+    and any overrides of the round's output windows (e.g. a window's
+    dur_lim), listed by window id.
+    """
+    params = dict(heater)
+    params.update(heater.get('rounds', {}).get(rnd['id'], {}))
+    windows = rnd.get('windows')
+    if windows != None:
+        windows = [dict(w, **params.get('windows', {}).get(w['id'], {})) for w in windows]
+    kwargs = {'on_range': params.get('on_range'),
+              'off_range': params.get('off_range'),
+              'dur_lim': params.get('dur_lim'),
+              'name': params['name'],
+              'event': params.get('event'),
+              'exclude': params.get('exclude'),
+              'dropout_pairs': params.get('dropout_pairs'),
+              'hysteresis': params.get('hysteresis'),
+              'resolution': params.get('resolution', rnd.get('resolution')),
+              'windows': windows,
+              'resistance': params.get('resistance'),
+              'epoch_events': rnd.get('epoch_events'),
+              'plot_cycles': rnd.get('plot_cycles', False),
+              'chunk_days': rnd.get('chunk_days'),
+              'logfile': config['logfile'],
+              'metrics_file': config.get('metrics_file', 'htr_dc_metrics.jsonl'),
+              'metrics_tags': {'run': DateTime(t_stop).date, 'round': rnd['id']}}
+    if 'days' in rnd:
+        t2 = DateTime(t_stop).mjd
+        kwargs['t_start'] = DateTime(t2 - rnd['days'], format='mjd').date
+        kwargs['t_stop'] = DateTime(t2, format='mjd').date
+    else:
+        kwargs['t_start'] = rnd.get('t_start', '2008:001')
+    if rnd.get('use_store', False) and config.get('cycle_store') != None:
+        kwargs['store_dir'] = config['cycle_store']
+    if rnd.get('products', False) and config.get('products_dir') != None:
+        kwargs['products_dir'] = config['products_dir']
+    return kwargs
+
+def run_needs(config, jobs):
+    """This function lists the (msid, t_start, t_stop, stat) telemetry needed
+    by a set of htr_dc jobs, including the bus voltage used for power.
+
+    Full resolution thermistor telemetry is left out for jobs that stream in
+    chunks (chunk_days), since holding every heater's series at once would
+    defeat the bounded memory chunking gives; those heaters fetch their own
+    chunks (through the run's cache, if any).  Their bus voltage and 5-minute
+    statistics are still acquired.
+    """
+    needs = []
+    for msid, kwargs in jobs:
+        full_res = kwargs.get('chunk_days') == None
+        fetch_start, store = htr_dc_module.fetch_range(msid, kwargs['t_start'], kwargs.get('t_stop'),
+                                                       kwargs['on_range'], kwargs['off_range'], 
+                                                       kwargs['dur_lim'], kwargs['plot_cycles'], 
+                                                       kwargs.get('store_dir'), 
+                                                       kwargs.get('dropout_pairs'),
+                                                       kwargs.get('hysteresis'),
+                                                       kwargs.get('resolution'),
+                                                       kwargs.get('windows'),
+                                                       kwargs.get('resistance'))
+        if kwargs.get('resolution') == coarse.STAT and not kwargs['plot_cycles']:
+            #only the statistics are acquired; the full resolution windows 
+            #around each transition are fetched by the heater itself
+            needs.append((msid, fetch_start, kwargs.get('t_stop'), coarse.STAT + '.mins'))
+            needs.append((msid, fetch_start, kwargs.get('t_stop'), coarse.STAT + '.maxes'))
+            t_tlm = htr_dc_module.tlm_start(kwargs.get('windows'), kwargs.get('t_stop'))
+            if t_tlm != None and full_res:
+                needs.append((msid, t_tlm, kwargs.get('t_stop'), None))
+            needs.append(('ELBV', fetch_start, kwargs.get('t_stop'), '5min'))
+            continue
+        if full_res:
+            needs.append((msid, fetch_start, kwargs.get('t_stop'), None))
+            for pair in kwargs.get('dropout_pairs') or []:
+                needs.append((pair[0], fetch_start, kwargs.get('t_stop'), None))
+                needs.append((pair[1], fetch_start, kwargs.get('t_stop'), None))
+        needs.append(('ELBV', fetch_start, kwargs.get('t_stop'), '5min'))
+    return needs
+
+def write_log(config, lines, lock=None):
+    """This function appends lines to the run log, holding the log lock if
+    one is supplied.
+    """
+    if lock != None:
+        lock.acquire()
+    try:
+        f = open(config['logfile'], 'a')
+        for line in lines:
+            f.write(line + '\n')
+        f.close()
+    finally:
+        if lock != None:
+            lock.release()
+
+def _init_worker(lock, source):
+    global _SOURCE
+    htr_dc_module.LOG_LOCK = lock
+    _SOURCE = source
+
+def run_heater(job):
+    """This function runs htr_dc for a single heater, catching any failure so
+    that one bad thermistor does not abort the rest of the run.  Returns the
+    msid and the formatted traceback (None if successful).
+    """
+    msid, kwargs = job
+    try:
+        htr_dc_module.htr_dc(msid, source=_SOURCE, **kwargs)
+        return msid, None
+    except Exception:
+        return msid, traceback.format_exc()
+
+def round_jobs(config, rnd, t_stop=None):
+    """This function returns the (msid, htr_dc kwargs) jobs for one round."""
+    return [(heater['msid'], heater_kwargs(heater, rnd, config, t_stop)) for heater in config['heaters']]
+
+def run_round(config, rnd, workers=1, lock=None, source=None, t_stop=None):
+    """This function runs every heater for one round, in parallel if workers
+    is greater than one.  Returns a list of (msid, traceback) for the heaters
+    that failed.
+    """
+    jobs = round_jobs(config, rnd, t_stop)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(lock, source))
+        try:
+            results = pool.map(run_heater, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(lock, source)
+        results = [run_heater(job) for job in jobs]
+    return [(msid, tb) for msid, tb in results if tb != None]
+
+def copy_to_web(config):
+    """This function publishes the PNGs and the updated-through page to the
+    plots folder of the web-accessible folder, copying only those that
+    changed since the last run (see publish.py).  Returns the number of files
+    copied.
+    """
+    plots_dir = os.path.join(config['web_dir'], 'plots')
+    files = sorted(glob.glob(os.path.join(config['home_dir'], '*.png')))
+    files.append(os.path.join(config['home_dir'], 'updated_thru.html'))
+    copied, unchanged = publish(files, plots_dir, config.get('publish_workers', 8))
+    return len(copied)
+
+def publish_log(config):
+    """This function publishes the run log to the web-accessible folder."""
+    publish([os.path.join(config['home_dir'], config['logfile'])], config['web_dir'], 1)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Update heater duty cycle trending')
+    parser.add_argument('--config', default='heaters.json', help='Heater config file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes (default from config)')
+    parser.add_argument('--web-dir', default=None,
+                        help='Folder to publish to (default from config), e.g. a local '
+                             'directory standing in for the web share')
+    opt = parser.parse_args(args)
+
+    config = load_config(opt.config)
+    if opt.web_dir != None:
+        config['web_dir'] = opt.web_dir
+    workers = opt.workers if opt.workers != None else config.get('workers', 1)
+    lock = multiprocessing.Lock()
+    t_now = DateTime().date
+    rec = Recorder()
+    source = None
+    if config.get('tlm_cache') != None:
+        source = TlmCache(config['tlm_cache'])
+    spill_dir = None
+    if config.get('batch_fetch', False):
+        #fetch the bus voltage (and any unchunked thermistors) once for the
+        #whole run; workers map the spilled bundle and take zero-copy slices
+        jobs = [job for rnd in config['rounds'] for job in round_jobs(config, rnd, t_now)]
+        with rec.span('acquire'):
+            source = acquire(run_needs(config, jobs), source=source)
+            spill_dir = tempfile.mkdtemp(prefix='htr_dc_tlm_')
+            source.spill(spill_dir)
+
+    run_failed = 0
+    write_log(config, ['', '', ''])
+    try:
+        for rnd in config['rounds']:
+            write_log(config, ['-' * 98,
+                               'Starting Processing for ' + rnd['title'] + ' at ' + DateTime().date,
+                               '-' * 98])
+            with rec.span('round:' + rnd['id'], rows=len(config['heaters'])):
+                failed = run_round(config, rnd, workers=workers, lock=lock, source=source, 
+                                   t_stop=t_now)
+            run_failed = run_failed + len(failed)
+            for msid, tb in failed:
+                print('Processing FAILED for ' + msid + ':')
+                print(tb)
+                write_log(config, [msid + ' FAILED in ' + rnd['title'] + ' at ' + DateTime().date + 
+                                   ': ' + tb.strip().splitlines()[-1]])
+    finally:
+        if spill_dir != None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    with rec.span('copy_to_web') as span:
+        span.rows = copy_to_web(config)
+    metrics_file = config.get('metrics_file', 'htr_dc_metrics.jsonl')
+    if metrics_file != None:
+        write_records(metrics_file, [{'type': 'run', 'run': t_now, 'date': DateTime().date,
+                                      'workers': workers, 'n_failed': run_failed,
+                                      'wall': sum(s['wall'] for s in rec.records()),
+                                      'cpu': sum(s['cpu'] for s in rec.records()),
+                                      'rss': peak_rss(), 
+                                      'rss_children': peak_rss(resource.RUSAGE_CHILDREN),
+                                      'stages': rec.records()}], lock)
+    write_log(config, ['-' * 82,
+                       'Website Updated at ' + DateTime().date,
+                       '-' * 82])
+    publish_log(config)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
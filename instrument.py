@@ -0,0 +1,208 @@
+"""Named stage spans recording wall time, CPU time, peak RSS growth and row
+counts, written as JSON lines (htr_dc_metrics.jsonl by default) next to the
+htr_dc log.  Run as a script to summarize a metrics file:
+
+usage:  python instrument.py [--metrics htr_dc_metrics.jsonl] [--top 10] [--runs 10]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+from contextlib import contextmanager
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """This function returns the peak resident set size of this process (or
+    of its largest finished child, with RUSAGE_CHILDREN) [MB].
+    """
+    return resource.getrusage(who).ru_maxrss / 1024.
+
+def cpu_time():
+    """This function returns the user plus system CPU time of this process [sec]."""
+    t = os.times()
+    return t[0] + t[1]
+
+class Span(object):
+    """One timed stage.  rows may be set while the span is open (e.g. to the
+    number of samples fetched).
+    """
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.wall = 0.
+        self.cpu = 0.
+        self.rss = 0.
+        self.child_wall = 0.
+        self.child_cpu = 0.
+
+    def record(self):
+        return {'stage':self.name, 'wall':self.wall, 'cpu':self.cpu, 'rss':self.rss,
+                'rows':self.rows}
+
+class Recorder(object):
+    """Collects stage spans for one heater (or one run).
+
+    Each span records wall and CPU time, the growth of the process's peak RSS
+    while the span was open [MB] (i.e. how far the stage raised the memory
+    high-water mark), and an optional row count.  Times are exclusive:  time
+    spent in a span nested inside another is only counted in the inner one.
+    Spans with the same name (e.g. one per fetched chunk) are combined.
+
+    e.g. rec = Recorder()
+         with rec.span('fetch') as s:
+             x = fetch.Msid(temp, t_start)
+             s.rows = len(x.times)
+         rec.begin('detect')
+         ...
+         rec.end(rows=n_found)
+         rec.records()
+    """
+    def __init__(self):
+        self.spans = []
+        self.stack = []
+
+    def begin(self, name, rows=None):
+        """Opens a span (nested inside any open span) and returns it."""
+        s = Span(name, rows)
+        s.start = (time.time(), cpu_time(), peak_rss())
+        self.stack.append(s)
+        return s
+
+    def end(self, rows=None):
+        """Closes the innermost open span, optionally setting its row count."""
+        s = self.stack.pop()
+        wall = time.time() - s.start[0]
+        cpu = cpu_time() - s.start[1]
+        if len(self.stack) > 0:
+            self.stack[-1].child_wall += wall
+            self.stack[-1].child_cpu += cpu
+        s.wall = wall - s.child_wall
+        s.cpu = cpu - s.child_cpu
+        s.rss = peak_rss() - s.start[2]
+        if rows != None:
+            s.rows = rows
+        self._add(s)
+        return s
+
+    @contextmanager
+    def span(self, name, rows=None):
+        s = self.begin(name, rows)
+        try:
+            yield s
+        finally:
+            if len(self.stack) > 0 and self.stack[-1] is s:
+                self.end()
+
+    def _add(self, s):
+        for old in self.spans:
+            if old.name == s.name:
+                old.wall += s.wall
+                old.cpu += s.cpu
+                old.rss = max(old.rss, s.rss)
+                if s.rows != None:
+                    old.rows = s.rows + (old.rows or 0)
+                return
+        self.spans.append(s)
+
+    def extend(self, records):
+        """Adds span records made elsewhere (e.g. in a worker process)."""
+        for r in records:
+            s = Span(r['stage'], r['rows'])
+            s.wall, s.cpu, s.rss = r['wall'], r['cpu'], r['rss']
+            self._add(s)
+
+    def records(self):
+        return [s.record() for s in self.spans]
+
+    def timings(self):
+        """Returns (stage, wall seconds) for each span, in order."""
+        return [(s.name, s.wall) for s in self.spans]
+
+def write_records(filename, records, lock=None):
+    """This function appends records to a JSON-lines metrics file, holding
+    the lock (if supplied) so parallel heaters don't interleave lines.
+    """
+    if lock != None:
+        lock.acquire()
+    try:
+        f = open(filename, 'a')
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+        f.close()
+    finally:
+        if lock != None:
+            lock.release()
+
+def read_records(filename):
+    f = open(filename)
+    out = [json.loads(line) for line in f if line.strip()]
+    f.close()
+    return out
+
+def stage_totals(records):
+    """This function sums the wall time of each stage (plots combined as
+    'plots') over a set of heater records.  Returns a dictionary.
+    """
+    out = {}
+    for record in records:
+        for s in record['stages']:
+            stage = 'plots' if s['stage'].startswith('plot:') else s['stage']
+            out[stage] = out.get(stage, 0.) + s['wall']
+    return out
+
+def summarize(records, top=10, runs=10):
+    """This function returns the lines of a report on a metrics file:  the
+    slowest heater stages of the latest run, then the total time of each
+    stage and the run wall time and peak memory over the last few runs.
+    """
+    heaters = [r for r in records if r.get('type') == 'heater']
+    run_ids = []
+    for r in records:
+        if r.get('run') not in run_ids:
+            run_ids.append(r.get('run'))
+    run_ids = run_ids[-runs:]
+    if len(run_ids) == 0:
+        return ['No records']
+
+    lines = ['Slowest stages of run ' + str(run_ids[-1]) + ':']
+    latest = [r for r in heaters if r.get('run') == run_ids[-1]]
+    spans = [(s['wall'], s['cpu'], s['rss'], s['rows'], r['msid'], r.get('round'), s['stage'])
+             for r in latest for s in r['stages']]
+    spans.sort(reverse=True)
+    for wall, cpu, rss, rows, msid, rnd, stage in spans[:top]:
+        lines.append('%9.2f s wall %9.2f s cpu %8.1f MB  %-10s %-8s %-22s %s rows' % (
+                     wall, cpu, rss, msid, rnd, stage, rows))
+
+    totals = [stage_totals([r for r in heaters if r.get('run') == run_id]) for run_id in run_ids]
+    stages = []
+    for t in totals:
+        stages.extend(stage for stage in t if stage not in stages)
+    lines.append('')
+    lines.append('Stage totals over the last ' + str(len(run_ids)) + ' runs [sec]:')
+    lines.append('%-24s' % 'run' + ''.join('%12s' % stage[:11] for stage in stages) +
+                 '%12s%12s' % ('run wall', 'peak MB'))
+    for run_id, t in zip(run_ids, totals):
+        run = [r for r in records if r.get('type') == 'run' and r.get('run') == run_id]
+        wall = '%12.1f' % run[-1]['wall'] if len(run) > 0 else '%12s' % '-'
+        rss = '%12.0f' % max(run[-1]['rss'], run[-1]['rss_children']) if len(run) > 0 else '%12s' % '-'
+        lines.append('%-24s' % str(run_id)[:23] +
+                     ''.join('%12.1f' % t.get(stage, 0.) for stage in stages) + wall + rss)
+    if len(totals) > 1:
+        first, last = totals[0], totals[-1]
+        lines.append('%-24s' % 'change' + ''.join(
+            '%12s' % ('%+.0f%%' % (100 * (last.get(s, 0.) / first[s] - 1)) if first.get(s) else '-')
+            for s in stages))
+    return lines
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Summarize htr_dc stage metrics')
+    parser.add_argument('--metrics', default='htr_dc_metrics.jsonl', help='Metrics file')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest stages to list')
+    parser.add_argument('--runs', type=int, default=10, help='Number of recent runs to trend')
+    opt = parser.parse_args(args)
+    for line in summarize(read_records(opt.metrics), opt.top, opt.runs):
+        print(line)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
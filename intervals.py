@@ -0,0 +1,74 @@
+import numpy as np
+
+class IntervalIndex(object):
+    """Index of a set of closed [start, stop] intervals (usually times in
+    seconds) for batch overlap queries.  The intervals may overlap each other
+    and need not be sorted.
+
+    Intervals are sorted by start, with a running maximum of the stops, so
+    whether a query range overlaps any interval takes two binary searches.
+    Enumerating the overlapping pairs takes O((N+M) log(N+M) + K) for N
+    queries, M intervals and K pairs, however long the intervals are:  the
+    intervals starting within a query range are contiguous in start order, 
+    and the queries starting within an interval (after its start) are 
+    contiguous in the queries' start order.
+
+    e.g. idx = IntervalIndex(str_to_secs(bad_times))
+         mask = idx.overlaps(np.column_stack([t_on, t_off]))
+    """
+    def __init__(self, table):
+        table = np.asarray(table, dtype=float).reshape(-1, 2)
+        self.order = np.argsort(table[:, 0], kind='mergesort')
+        self.starts = table[self.order, 0]
+        self.stops = table[self.order, 1]
+        self.max_stop = np.maximum.accumulate(self.stops) if len(table) > 0 else self.stops
+        self.max_len = np.max(self.stops - self.starts) if len(table) > 0 else 0.
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, table):
+        """Returns a boolean array, one per row of the nx2 query table, that is
+        True where the query range overlaps any indexed interval.
+        """
+        table = np.asarray(table, dtype=float).reshape(-1, 2)
+        if len(self.starts) == 0:
+            return np.zeros(len(table), dtype='bool')
+        #intervals starting no later than each query stop
+        n = np.searchsorted(self.starts, table[:, 1], side='right')
+        out = np.zeros(len(table), dtype='bool')
+        ok = n > 0
+        out[ok] = self.max_stop[n[ok] - 1] >= table[ok, 0]
+        return out
+
+    def query(self, table):
+        """Returns the overlap mask (as from overlaps) along with the matching
+        pairs as two arrays of equal length:  the row of the query table and
+        the row of the indexed table (in its original order) for every
+        overlapping pair, sorted by query row and then interval start.
+        """
+        table = np.asarray(table, dtype=float).reshape(-1, 2)
+        mask = self.overlaps(table)
+        #intervals starting within each query range
+        q_a, i_a = _expand(np.searchsorted(self.starts, table[:, 0], side='left'),
+                           np.searchsorted(self.starts, table[:, 1], side='right'))
+        #queries starting after each interval starts, up to its stop
+        q_order = np.argsort(table[:, 0], kind='mergesort')
+        q_starts = table[q_order, 0]
+        i_b, q_b = _expand(np.searchsorted(q_starts, self.starts, side='right'),
+                           np.searchsorted(q_starts, self.stops, side='right'))
+        q = np.concatenate([q_a, q_order[q_b]])
+        i = np.concatenate([i_a, i_b])
+        keep = table[q, 0] <= table[q, 1]
+        q, i = q[keep], i[keep]
+        order = np.lexsort([i, q])
+        return mask, q[order], self.order[i[order]]
+
+def _expand(lo, hi):
+    """Returns, for every k and every j in lo[k] <= j < hi[k], the pair
+    (k, j) as two arrays, without a Python loop.
+    """
+    counts = np.maximum(hi - lo, 0)
+    owner = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(lo, counts) + offsets
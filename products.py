@@ -0,0 +1,111 @@
+import os
+import json
+import shutil
+import numpy as np
+
+from astropy.table import Table
+from Chandra.Time import DateTime
+
+# Tables written for each heater, with the time column each is ordered by
+TABLES = [('cycles', 't_on'), ('daily', 't'), ('monthly', 't')]
+
+# Units of each column written
+UNITS = {'t_on':'s', 't_off':'s', 't':'s', 'dur':'s', 'voltage':'V', 'pwr':'W-hr',
+         'per':'s', 'dc':'%', 'on_freq':'cycles/day', 'on_time':'s', 'acc_pwr':'W-hr'}
+
+def table_dir(products_dir, msid, table):
+    """This function returns the directory holding one product table for a
+    heater.  Each column is stored as its own .npy file, with a meta.json
+    listing the columns in order along with their units.
+    """
+    return os.path.join(products_dir, msid, table)
+
+def read_meta(path):
+    f = open(os.path.join(path, 'meta.json'))
+    meta = json.load(f)
+    f.close()
+    return meta
+
+def write_table(path, columns, meta):
+    """This function writes a table (a list of (name, array) columns) to a
+    product directory.  The new directory is written under a temporary name
+    and swapped into place, so readers never see a partial table.
+    """
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name, vals in columns:
+        np.save(os.path.join(tmp, name + '.npy'), np.asarray(vals))
+    meta = dict(meta)
+    meta['columns'] = [name for name, vals in columns]
+    meta['units'] = dict((name, UNITS.get(name)) for name, vals in columns)
+    meta['rows'] = len(columns[0][1]) if len(columns) > 0 else 0
+    f = open(os.path.join(tmp, 'meta.json'), 'w')
+    json.dump(meta, f, indent=1, sort_keys=True)
+    f.close()
+    if os.path.exists(path):
+        os.rename(path, path + '.old')
+    os.rename(tmp, path)
+    if os.path.exists(path + '.old'):
+        shutil.rmtree(path + '.old')
+
+def append_table(path, table, key, meta):
+    """This function appends an astropy Table to a product directory,
+    replacing any stored rows from the first new key value onward (so a rerun
+    over the same timeframe updates rows rather than duplicating them).
+    Stored rows before the new table's timeframe are kept (all of them, if
+    the new table is empty).  Columns missing from the stored table are 
+    filled with NaN.
+    """
+    names = [name for name in table.colnames if name in UNITS]
+    new = [(name, np.asarray(table[name])) for name in names]
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        old = read_meta(path)
+        n_keep = old['rows']
+        if len(table) > 0:
+            n_keep = np.searchsorted(np.load(os.path.join(path, key + '.npy'), mmap_mode='r'),
+                                     table[key][0], side='left')
+        columns = []
+        for name, vals in new:
+            if name in old['columns']:
+                kept = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')[:n_keep]
+            else:
+                kept = np.zeros(n_keep) * np.nan
+            columns.append((name, np.concatenate([kept, vals])))
+        new = columns
+    write_table(path, new, meta)
+
+def write_products(result, products_dir):
+    """This function appends the per-cycle, daily and monthly tables of an
+    HtrDcResult (see htr_dc.htr_dc_stats) to the heater's product tables.
+    """
+    meta = {'msid':result.temp, 'name':result.name, 'updated':DateTime().date,
+            'updated_thru':DateTime(result.t_last).date}
+    tables = {'cycles':result.cycles, 'daily':result.daily, 'monthly':result.monthly}
+    for table, key in TABLES:
+        append_table(table_dir(products_dir, result.temp, table), tables[table], key, meta)
+
+def load_column(products_dir, msid, table, column):
+    """This function memory-maps a single column of a product table without
+    reading any of the others.
+
+    e.g. dc = load_column('products', 'PM3THV1T', 'daily', 'dc')
+    """
+    return np.load(os.path.join(table_dir(products_dir, msid, table), column + '.npy'),
+                   mmap_mode='r')
+
+def load_table(products_dir, msid, table, columns=None):
+    """This function returns a product table (or just the listed columns) as
+    an astropy Table of memory-mapped columns, with units.
+    """
+    path = table_dir(products_dir, msid, table)
+    meta = read_meta(path)
+    if columns == None:
+        columns = meta['columns']
+    out = Table([load_column(products_dir, msid, table, name) for name in columns],
+                names=columns, copy=False)
+    for name in columns:
+        out[name].unit = meta['units'].get(name)
+    out.meta.update(dict((k, meta[k]) for k in meta if k not in ('columns', 'units')))
+    return out
@@ -0,0 +1,124 @@
+"""Publishes files to the web folder (or any destination directory) keeping
+a manifest of the content hash of every file published there, so that only
+new or changed files are copied.  Files are copied in parallel, each under a
+temporary name that is then renamed into place, so the website never serves
+a partly written file.
+
+usage:  python publish.py DEST FILE [FILE ...] [--workers 8]
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from multiprocessing.pool import ThreadPool
+
+# Manifest kept in each destination directory
+MANIFEST = 'publish_manifest.json'
+
+# Read size when hashing files [bytes]
+BLOCK = 1 << 20
+
+def file_hash(filename):
+    """This function returns the sha1 hex digest of a file's contents."""
+    h = hashlib.sha1()
+    f = open(filename, 'rb')
+    try:
+        block = f.read(BLOCK)
+        while len(block) > 0:
+            h.update(block)
+            block = f.read(BLOCK)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+def atomic_copy(src, dst):
+    """This function copies src to dst through a temporary file in the
+    destination directory, renamed over dst once complete.
+    """
+    tmp = os.path.join(os.path.dirname(dst), '.' + os.path.basename(dst) + '.' + str(os.getpid()) +
+                       '.tmp')
+    try:
+        shutil.copyfile(src, tmp)
+        os.rename(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def read_manifest(dest):
+    """This function returns the manifest of a destination directory:  a
+    dictionary of file name to 'sha1' and 'size' as last published.
+    """
+    filename = os.path.join(dest, MANIFEST)
+    if not os.path.exists(filename):
+        return {}
+    f = open(filename)
+    try:
+        return json.load(f)
+    except ValueError:
+        return {} #unreadable manifest; republish everything
+    finally:
+        f.close()
+
+def write_manifest(dest, manifest):
+    filename = os.path.join(dest, MANIFEST)
+    tmp = filename + '.' + str(os.getpid()) + '.tmp'
+    f = open(tmp, 'w')
+    json.dump(manifest, f, indent=1, sort_keys=True)
+    f.close()
+    os.rename(tmp, filename)
+
+def publish(files, dest, workers=8):
+    """This function copies the files (a list of paths) that are new or have
+    changed since they were last published into the dest directory.  A file
+    is copied if its content hash differs from the manifest or it is missing
+    from dest.  Copies run on workers threads (the work is I/O on the
+    destination share).  The manifest is updated after the copies, so a
+    failed copy is retried on the next call.
+
+    Returns the lists of files copied and files left unchanged.
+    """
+    if not os.path.exists(dest):
+        os.makedirs(dest)
+    manifest = read_manifest(dest)
+    copy = []
+    unchanged = []
+    entries = {}
+    for src in files:
+        name = os.path.basename(src)
+        entries[name] = {'sha1':file_hash(src), 'size':os.path.getsize(src)}
+        old = manifest.get(name)
+        if (old != None and old['sha1'] == entries[name]['sha1'] and
+            os.path.exists(os.path.join(dest, name))):
+            unchanged.append(src)
+        else:
+            copy.append(src)
+
+    jobs = [(src, os.path.join(dest, os.path.basename(src))) for src in copy]
+    if workers > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(workers, len(jobs)))
+        try:
+            pool.map(lambda job: atomic_copy(*job), jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for src, dst in jobs:
+            atomic_copy(src, dst)
+
+    manifest.update(entries)
+    write_manifest(dest, manifest)
+    return copy, unchanged
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Copy changed files to a web folder')
+    parser.add_argument('dest', help='Destination directory')
+    parser.add_argument('files', nargs='+', help='Files to publish')
+    parser.add_argument('--workers', type=int, default=8, help='Number of parallel copies')
+    opt = parser.parse_args(args)
+    copied, unchanged = publish(opt.files, opt.dest, opt.workers)
+    print('Copied %d files, %d unchanged' % (len(copied), len(unchanged)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,187 @@
+"""Per-heater index of daily cumulative sums answering heater cycling
+statistics (cycle count, on-time, duty cycle, energy, mean, std, min and max
+cycle duration, mean period) for any date range in constant time, without
+rerunning htr_dc.  The index is built from the heater's per-cycle product
+table (see products.py) and stored alongside it, memory-mapped when queried.
+
+usage:  python stats_index.py T_START T_STOP [--products products]
+                              [--msids PR3TV01T,PR4TV01T] [--build]
+"""
+import os
+import sys
+import argparse
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from time_bins import day_number, day_start
+from bucket_stats import bucket_count, bucket_sum, bucket_min, bucket_max
+from products import table_dir, write_table, load_column, read_meta
+
+# Product table the index is stored as
+TABLE = 'index'
+
+# Running sums kept per day, with the per-cycle quantity each sums
+SUMS = [('cum_count', None), ('cum_on_time', 'dur'), ('cum_on_time_sq', 'dur_sq'),
+        ('cum_energy', 'pwr'), ('cum_per', 'per'), ('cum_per_n', 'per_n')]
+
+def sparse_table(vals, func):
+    """This function returns the sparse table of a 1-d array for range
+    minimum (func=np.minimum) or maximum (np.maximum) queries:  row k holds
+    func over vals[i:i+2**k] for each i (padded with the last full value).
+    """
+    vals = np.asarray(vals, dtype=float)
+    levels = max(int(np.floor(np.log2(len(vals)))) + 1, 1) if len(vals) > 0 else 1
+    out = np.zeros((levels, len(vals)))
+    out[0] = vals
+    for k in range(1, levels):
+        half = 1 << (k - 1)
+        out[k] = out[k - 1]
+        out[k, :len(vals) - half] = func(out[k - 1, :len(vals) - half], out[k - 1, half:])
+    return out
+
+def range_query(table, func, i0, i1):
+    """This function returns func over elements i0 to i1 (exclusive) of the
+    array a sparse table was built from, in constant time.
+    """
+    k = int(np.floor(np.log2(i1 - i0)))
+    return func(table[k, i0], table[k, i1 - (1 << k)])
+
+def build_index(products_dir, msid):
+    """This function builds (or rebuilds) a heater's index from its
+    per-cycle product table.  The index covers every day of the products'
+    timeframe (from the first day of the daily table through updated_thru),
+    including days without cycles.  Each running sum has one entry per day
+    boundary, so the sum over days i to j is cum[j] - cum[i].
+    """
+    t_on = np.asarray(load_column(products_dir, msid, 'cycles', 't_on'))
+    dur = np.asarray(load_column(products_dir, msid, 'cycles', 'dur'))
+    pwr = np.asarray(load_column(products_dir, msid, 'cycles', 'pwr'))
+    per = np.asarray(load_column(products_dir, msid, 'cycles', 'per'))
+    t_days = np.asarray(load_column(products_dir, msid, 'daily', 't'))
+    updated_thru = read_meta(table_dir(products_dir, msid, 'cycles')).get('updated_thru')
+    days = day_number(t_on)
+    firsts = list(days[:1]) + list(day_number(t_days[:1]))
+    lasts = list(days[-1:]) + list(day_number(t_days[-1:]))
+    if updated_thru != None:
+        lasts.append(day_number(DateTime(updated_thru).secs))
+    if len(firsts) == 0:
+        return
+    day0 = min(firsts)
+    idx = days - day0
+    n = max(lasts) - day0 + 1
+    ok = np.isfinite(per)
+    each = {'dur':dur, 'dur_sq':dur**2, 'pwr':pwr, 'per':np.where(ok, per, 0.),
+            'per_n':ok.astype(float)}
+    columns = []
+    for name, col in SUMS:
+        daily = bucket_count(idx, n) if col == None else bucket_sum(idx, each[col], n)
+        columns.append((name, np.concatenate([[0.], np.cumsum(daily)])))
+    #days without cycles can't change a range's min or max
+    min_dur = bucket_min(idx, dur, n)
+    max_dur = bucket_max(idx, dur, n)
+    columns.append(('min_dur', sparse_table(np.where(np.isnan(min_dur), np.inf, min_dur),
+                                            np.minimum)))
+    columns.append(('max_dur', sparse_table(np.where(np.isnan(max_dur), -np.inf, max_dur),
+                                            np.maximum)))
+    meta = {'msid':msid, 'day0':int(day0), 'n_days':int(n), 'built':DateTime().date,
+            'updated_thru':updated_thru}
+    write_table(table_dir(products_dir, msid, TABLE), columns, meta)
+
+class HeaterIndex(object):
+    """Memory-mapped statistics index of one heater (see build_index).
+
+    e.g. idx = HeaterIndex('products', 'PR3TV01T')
+         idx.query('2020:001', '2021:001')['duty_cycle']
+    """
+    def __init__(self, products_dir, msid):
+        path = table_dir(products_dir, msid, TABLE)
+        meta = read_meta(path)
+        self.msid = msid
+        self.day0 = meta['day0']
+        self.n_days = meta['n_days']
+        self.updated_thru = meta.get('updated_thru')
+        self.cols = dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+                         for name in meta['columns'])
+
+    def day_bounds(self, t_start, t_stop=None):
+        """Returns the range of index days (i0 to i1, exclusive) covering the
+        days that begin on or after the day containing t_start and before
+        t_stop.
+        """
+        start = DateTime(t_start).secs
+        stop = DateTime(t_stop).secs
+        last = day_number(stop)
+        if day_start(last) == stop:
+            last = last - 1
+        i0 = min(max(day_number(start) - self.day0, 0), self.n_days)
+        i1 = min(max(last + 1 - self.day0, 0), self.n_days)
+        return i0, max(i1, i0)
+
+    def query(self, t_start, t_stop=None):
+        """This function returns a heater's cycling statistics over whole
+        days from the day containing t_start until t_stop (default is current
+        time), using a constant number of lookups:  'days', 'count',
+        'on_time' [sec], 'duty_cycle' [%], 'energy' [W-hrs], 'mean_dur',
+        'std_dur', 'min_dur', 'max_dur' [sec] (of the cycles starting in the
+        range) and 'mean_period' [sec].  Only the days within the products'
+        timeframe are counted (in 'days' and the duty cycle), so a range with
+        no cycles in it has a duty cycle of 0; the other statistics of no
+        cycles are NaN.
+        """
+        i0, i1 = self.day_bounds(t_start, t_stop)
+        c = self.cols
+        total = dict((name, float(c[name][i1] - c[name][i0])) for name, col in SUMS)
+        count = total['cum_count']
+        out = {'days':int(i1 - i0), 'count':int(round(count)), 'on_time':total['cum_on_time'],
+               'energy':total['cum_energy'], 'duty_cycle':np.nan, 'mean_dur':np.nan,
+               'std_dur':np.nan, 'min_dur':np.nan, 'max_dur':np.nan, 'mean_period':np.nan}
+        if i1 > i0:
+            out['duty_cycle'] = total['cum_on_time'] / (int(i1 - i0) * 86400.) * 100
+        if count > 0:
+            mean = total['cum_on_time'] / count
+            out['mean_dur'] = mean
+            out['std_dur'] = float(np.sqrt(max(total['cum_on_time_sq'] / count - mean**2, 0.)))
+            out['min_dur'] = float(range_query(c['min_dur'], np.minimum, i0, i1))
+            out['max_dur'] = float(range_query(c['max_dur'], np.maximum, i0, i1))
+        if total['cum_per_n'] > 0:
+            out['mean_period'] = total['cum_per'] / total['cum_per_n']
+        return out
+
+def heater_msids(products_dir):
+    """This function returns the msids with an index in a products directory."""
+    return sorted(msid for msid in os.listdir(products_dir)
+                  if os.path.exists(os.path.join(table_dir(products_dir, msid, TABLE), 'meta.json')))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Query heater cycling statistics')
+    parser.add_argument('t_start', help='Start of the range (any DateTime format)')
+    parser.add_argument('t_stop', help='End of the range')
+    parser.add_argument('--products', default='products', help='Products directory')
+    parser.add_argument('--msids', default=None, help='Comma-separated msids (default is all)')
+    parser.add_argument('--build', action='store_true',
+                        help='Rebuild the indices from the cycle tables first')
+    opt = parser.parse_args(args)
+
+    if opt.msids != None:
+        msids = opt.msids.split(',')
+    elif opt.build:
+        msids = sorted(os.listdir(opt.products))
+    else:
+        msids = heater_msids(opt.products)
+    if opt.build:
+        for msid in msids:
+            build_index(opt.products, msid)
+    print('%-10s %5s %7s %9s %8s %10s %8s %8s %8s %8s %9s' % (
+          'msid', 'days', 'cycles', 'on [hr]', 'dc [%]', 'pwr [W-hr]', 'dur [m]', 'std [m]',
+          'min [m]', 'max [m]', 'per [m]'))
+    for msid in msids:
+        s = HeaterIndex(opt.products, msid).query(opt.t_start, opt.t_stop)
+        print('%-10s %5d %7d %9.1f %8.2f %10.1f %8.1f %8.1f %8.1f %8.1f %9.1f' % (
+              msid, s['days'], s['count'], s['on_time'] / 3600, s['duty_cycle'], s['energy'],
+              s['mean_dur'] / 60, s['std_dur'] / 60, s['min_dur'] / 60, s['max_dur'] / 60,
+              s['mean_period'] / 60))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,234 @@
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from tlm_cache import CachedMsid
+
+# Sample interval of a full-resolution thermistor [sec]
+DT = 32.8
+
+# Sample interval of a 5-minute statistic [sec]
+DT_5MIN = 328.
+
+class HeaterModel(object):
+    """Parameters of a synthetic thermostatically controlled heater.
+
+    The heater turns on when the temperature falls to t_low and off when it
+    rises to t_high, so the temperature is a sawtooth:  a linear rise while
+    the heater is on and a linear fall while it is off.  Each cycle's on and
+    off durations are drawn with a random jitter.
+
+    Attributes:
+       t_low, t_high    Thermostat set points [deg F]
+       on_time          Mean heater on-time per cycle [sec]
+       off_time         Mean heater off-time per cycle [sec]
+       jitter           Standard deviation of on_time and off_time, as a
+                        fraction of each
+       noise            Standard deviation of the sensor noise [deg F]
+       quant            Telemetry quantization step [deg F] (0 for none)
+       dropout_rate     Fraction of samples replaced by a dropout value
+       dropout_val      Value reported during a dropout [deg F]
+       gap_rate         Number of telemetry gaps per day
+       gap_len          Mean length of each telemetry gap [sec]
+    """
+    def __init__(self, t_low=60., t_high=70., on_time=1800., off_time=5400., jitter=0.1,
+                 noise=0.05, quant=0.36, dropout_rate=1e-4, dropout_val=-40.,
+                 gap_rate=0.2, gap_len=1800.):
+        self.t_low = t_low
+        self.t_high = t_high
+        self.on_time = on_time
+        self.off_time = off_time
+        self.jitter = jitter
+        self.noise = noise
+        self.quant = quant
+        self.dropout_rate = dropout_rate
+        self.dropout_val = dropout_val
+        self.gap_rate = gap_rate
+        self.gap_len = gap_len
+
+def cycle_times(model, t_start, t_stop, rng):
+    """This function returns the true heater on and off times (as two arrays,
+    in DateTime seconds) of the cycles a model heater goes through between
+    t_start and t_stop.  The first cycle starts at t_start.
+    """
+    n = int((t_stop - t_start) / (model.on_time + model.off_time) * 1.2) + 2
+    on = model.on_time * (1 + model.jitter * rng.standard_normal(n))
+    off = model.off_time * (1 + model.jitter * rng.standard_normal(n))
+    on = np.maximum(on, 0.1 * model.on_time)
+    off = np.maximum(off, 0.1 * model.off_time)
+    t_on = t_start + np.concatenate([[0.], np.cumsum(on + off)[:-1]])
+    t_off = t_on + on
+    keep = t_on < t_stop
+    return t_on[keep], t_off[keep]
+
+def sample_times(t_start, t_stop, dt, gap_rate=0., gap_len=0., rng=None):
+    """This function returns regularly spaced sample times from t_start to
+    t_stop with random telemetry gaps removed.  Returns the times along with
+    the nx2 array of gaps.
+    """
+    times = np.arange(t_start, t_stop, dt)
+    n_gaps = 0 if rng is None else rng.poisson(gap_rate * (t_stop - t_start) / 86400.)
+    if n_gaps == 0:
+        return times, np.zeros([0, 2])
+    starts = np.sort(rng.uniform(t_start, t_stop, n_gaps))
+    gaps = np.column_stack([starts, starts + rng.exponential(gap_len, n_gaps)])
+    i0 = np.searchsorted(times, gaps[:, 0])
+    i1 = np.searchsorted(times, gaps[:, 1])
+    #mark the start and end of each gap, then take a running count
+    marks = np.zeros(len(times) + 1, dtype=int)
+    np.add.at(marks, i0, 1)
+    np.add.at(marks, i1, -1)
+    in_gap = np.cumsum(marks)[:-1] > 0
+    return times[~in_gap], gaps
+
+def heater_temps(model, times, t_on, t_off):
+    """This function returns the (noiseless, unquantized) temperature of a
+    model heater at each sample time, given the true cycle times.
+    """
+    span = model.t_high - model.t_low
+    i = np.searchsorted(t_on, times, side='right') - 1
+    i = np.clip(i, 0, len(t_on) - 1)
+    t_next = np.append(t_on[1:], t_on[-1] + model.on_time + model.off_time)[i]
+    heating = times < t_off[i]
+    rise = (times - t_on[i]) / (t_off[i] - t_on[i])
+    fall = (times - t_off[i]) / (t_next - t_off[i])
+    return np.where(heating, model.t_low + span * rise, model.t_high - span * fall)
+
+def synthetic_heater(model, t_start, t_stop, seed=0, dt=DT):
+    """This function generates a synthetic thermistor series for a model
+    heater, with sensor noise, quantization, dropouts and telemetry gaps.
+
+    Inputs:
+       model        HeaterModel
+       t_start      Start of timeframe (any DateTime format)
+       t_stop       End of timeframe (any DateTime format)
+       seed         Random seed, so a series can be regenerated exactly
+       dt           Sample interval [sec]
+
+    Returns a dictionary with 'times' and 'vals' (the telemetry), 'clean'
+    (the same samples without dropouts), and the ground truth:  't_on' and
+    't_off' (true heater on and off times), 'dropouts' (indices of dropout
+    samples) and 'gaps' (nx2 array of telemetry gaps).
+    """
+    rng = np.random.RandomState(seed)
+    start = DateTime(t_start).secs
+    stop = DateTime(t_stop).secs
+    t_on, t_off = cycle_times(model, start, stop, rng)
+    times, gaps = sample_times(start, stop, dt, model.gap_rate, model.gap_len, rng)
+    vals = heater_temps(model, times, t_on, t_off)
+    vals = vals + model.noise * rng.standard_normal(len(vals))
+    if model.quant > 0:
+        vals = np.round(vals / model.quant) * model.quant
+    clean = vals.copy()
+    dropouts = np.nonzero(rng.uniform(size=len(vals)) < model.dropout_rate)[0]
+    vals[dropouts] = model.dropout_val
+    #cycles still in progress at t_stop are not part of the truth
+    done = t_off < times[-1] if len(times) > 0 else t_off < stop
+    return {'times':times, 'vals':vals, 'clean':clean, 't_on':t_on[done], 't_off':t_off[done],
+            'dropouts':dropouts, 'gaps':gaps}
+
+def bus_voltage(t_start, t_stop, seed=0, mean=28.5, swing=0.5, noise=0.05, dt=DT_5MIN):
+    """This function generates a synthetic 5-minute bus voltage (ELBV) series
+    with a slow orbital variation and noise.  Returns times and vals.
+    """
+    rng = np.random.RandomState(seed)
+    times = np.arange(DateTime(t_start).secs, DateTime(t_stop).secs, dt)
+    orbit = 2 * np.pi * times / (63.5 * 3600)
+    vals = mean + swing * np.sin(orbit) + noise * rng.standard_normal(len(times))
+    return times, vals
+
+def bin_stat(times, vals, stat='5min', dt=DT_5MIN):
+    """This function computes a 5-minute statistic of a synthetic series the
+    way the engineering archive does:  bins of dt seconds, time-stamped at
+    their centers, with the mean ('5min'), or the mins or maxes ('5min.mins',
+    '5min.maxes') of the samples in each.  Returns times and vals.
+    """
+    times = np.asarray(times)
+    vals = np.asarray(vals, dtype=float)
+    if len(times) == 0:
+        return np.zeros(0), np.zeros(0)
+    idx = np.floor(times / dt).astype(int)
+    starts = np.concatenate([[0], np.nonzero(np.diff(idx))[0] + 1])
+    if stat.endswith('.mins'):
+        out = np.minimum.reduceat(vals, starts)
+    elif stat.endswith('.maxes'):
+        out = np.maximum.reduceat(vals, starts)
+    else:
+        out = np.add.reduceat(vals, starts) / np.diff(np.append(starts, len(vals)))
+    return (idx[starts] + 0.5) * dt, out
+
+class SyntheticSource(object):
+    """Telemetry source (see htr_dc.fetch_msid) serving generated series in
+    place of the engineering archive, so htr_dc can be run and timed offline.
+
+    Series are added with add (or add_heater, which also adds a redundant
+    partner thermistor that doesn't share the dropouts) and sliced by get.
+    Statistics of an added series (e.g. '5min.mins') are computed from it
+    with bin_stat, and any other msid with stat '5min' is served as a 
+    synthetic bus voltage.
+
+    e.g. source = SyntheticSource('2008:001', '2025:001')
+         truth = source.add_heater('PM1THV1T', HeaterModel(), partner='PM1THV2T')
+         result = htr_dc_stats('PM1THV1T', '2008:001', '2025:001', source=source)
+    """
+    def __init__(self, t_start, t_stop, seed=0):
+        self.t_start = t_start
+        self.t_stop = t_stop
+        self.seed = seed
+        self.series = {}
+
+    def add(self, msid, times, vals, stat=None):
+        self.series[(msid, stat)] = (np.asarray(times), np.asarray(vals))
+
+    def add_heater(self, msid, model, partner=None, seed=None):
+        """Generates a heater series for msid (and optionally a partner
+        thermistor reading the same temperatures) and returns its ground
+        truth (see synthetic_heater).
+        """
+        seed = self.seed if seed == None else seed
+        truth = synthetic_heater(model, self.t_start, self.t_stop, seed)
+        self.add(msid, truth['times'], truth['vals'])
+        if partner != None:
+            self.add(partner, truth['times'], truth['clean'])
+        return truth
+
+    def get(self, msid, t_start, t_stop=None, stat=None):
+        if (msid, stat) not in self.series and (msid, None) in self.series and stat != None:
+            self.add(msid, *bin_stat(*self.series[(msid, None)], stat=stat), stat=stat)
+        if (msid, stat) not in self.series and stat == '5min':
+            self.add(msid, *bus_voltage(self.t_start, self.t_stop, self.seed), stat=stat)
+        times, vals = self.series[(msid, stat)]
+        stop = self.t_stop if t_stop == None else t_stop
+        i0, i1 = np.searchsorted(times, [DateTime(t_start).secs, DateTime(stop).secs])
+        return CachedMsid(msid, stat, times[i0:i1], vals[i0:i1])
+
+def match_cycles(t_on, t_off, truth, tol):
+    """This function compares detected heater cycles to the ground truth of a
+    synthetic series.  A true cycle is matched when a detected cycle's on and
+    off times are both within tol seconds of its own.
+
+    Returns a dictionary with the number of true, detected and matched
+    cycles, the recall and precision, and the largest on/off time errors of
+    the matched cycles [sec].
+    """
+    t_on = np.asarray(t_on)
+    t_off = np.asarray(t_off)
+    n_true = len(truth['t_on'])
+    out = {'n_true':n_true, 'n_detected':len(t_on), 'n_matched':0,
+           'recall':0., 'precision':0., 'max_on_err':0., 'max_off_err':0.}
+    if n_true == 0 or len(t_on) == 0:
+        return out
+    j = np.clip(np.searchsorted(t_on, truth['t_on']), 1, len(t_on) - 1)
+    j = np.where(np.abs(t_on[j - 1] - truth['t_on']) <= np.abs(t_on[j] - truth['t_on']), j - 1, j)
+    if len(t_on) == 1:
+        j = np.zeros(n_true, dtype=int)
+    on_err = np.abs(t_on[j] - truth['t_on'])
+    off_err = np.abs(t_off[j] - truth['t_off'])
+    ok = (on_err <= tol) & (off_err <= tol)
+    n_matched = len(np.unique(j[ok]))
+    out.update({'n_matched':n_matched,
+                'recall':float(n_matched) / n_true,
+                'precision':float(n_matched) / len(t_on),
+                'max_on_err':float(np.max(on_err[ok])) if np.any(ok) else 0.,
+                'max_off_err':float(np.max(off_err[ok])) if np.any(ok) else 0.})
+    return out
@@ -0,0 +1,44 @@
+"""Checks the dropout filter for redundant thermistors against hand-worked
+samples with unaligned timestamps.
+
+usage:  python -m pytest test_dropouts.py
+"""
+import numpy as np
+
+import htr_dc
+from dropouts import align_nearest, dropout_masks
+from synthetic import SyntheticSource, HeaterModel
+
+class Series(object):
+    def __init__(self, times, vals):
+        self.times = np.asarray(times, dtype=float)
+        self.vals = np.asarray(vals, dtype=float)
+
+def test_align_nearest():
+    t_other = np.array([10., 20., 30.])
+    #ties go to the earlier sample; nothing within tol gives -1
+    assert list(align_nearest([9., 15., 24., 26., 80.], t_other, tol=5)) == [0, 0, 1, 2, -1]
+    assert list(align_nearest([1., 2.], [], tol=5)) == [-1, -1]
+
+def test_dropout_masks():
+    #B is sampled 4 sec after A; A drops out at 20, B at 40, and C (compared
+    #to B with a looser threshold) reads 25 degrees off at 24
+    tlm = {'A': Series([0., 10., 20., 30., 40., 50.], [60., 60., -40., 61., 61., 62.]),
+           'B': Series([4., 14., 24., 34., 44.], [60., 60., 60., 61., -40.]),
+           'C': Series([4., 14., 24., 34., 44., 90.], [60., 65., 85., 61., 61., -40.])}
+    masks = dropout_masks(tlm, [('A', 'B', 10), ('B', 'C', 30)], tol=5)
+    #a dropout flags the sample it is compared to as well (A at 20 and B at
+    #24, B at 44 and both A at 40 and C at 44); A at 50 and C at 90 have no
+    #partner within 5 sec and are kept
+    assert list(masks['A']) == [True, True, False, True, False, True]
+    assert list(masks['B']) == [True, True, False, True, False]
+    assert list(masks['C']) == [True, True, True, True, False, True]
+
+def test_fetch_without_dropouts():
+    src = SyntheticSource('2020:001', '2020:021', seed=5)
+    truth = src.add_heater('S1', HeaterModel(dropout_rate=1e-3), partner='S2')
+    x = htr_dc.fetch_without_dropouts('S1', '2020:001', '2020:021', [('S1', 'S2', 10)], src)
+    dropped = truth['vals'] != truth['clean']
+    assert np.sum(dropped) > 0
+    assert np.array_equal(x.times, truth['times'][~dropped])
+    assert np.array_equal(x.vals, truth['clean'][~dropped])
@@ -0,0 +1,31 @@
+"""Checks the prefix-sum V^2 integration of energy.py against integrals
+worked by hand on a three-sample voltage series.
+
+usage:  python -m pytest test_energy.py
+"""
+import numpy as np
+
+from energy import v2_integral, v2_between, heater_energy, RESISTANCE
+
+# Each sample is held until the next (and the last one after it), so V^2 is
+# 4 over [0, 100), 9 over [100, 200) and 16 from 200 on
+TIMES = np.array([0., 100., 200.])
+VALS = np.array([2., 3., 4.])
+
+def test_v2_integral():
+    cum = v2_integral(TIMES, VALS)
+    assert list(cum) == [0., 400., 1300.]
+    assert list(v2_integral([5.], [3.])) == [0.]
+    #within and across samples, past the last sample and before the first
+    v2 = v2_between(TIMES, VALS, cum, [50., 150., -50., 0.], [150., 250., 50., 200.])
+    assert list(v2) == [4*50 + 9*50, 9*50 + 16*50, 4*100, 1300.]
+
+def test_heater_energy():
+    voltage, pwr = heater_energy(TIMES, VALS, [50., 150., 120.], [150., 250., 120.])
+    #a zero-length interval takes the voltage at its start
+    assert np.allclose(voltage, [np.sqrt(6.5), np.sqrt(12.5), 3.])
+    assert np.allclose(pwr, np.array([650., 1250., 0.]) / RESISTANCE / 3600)
+    voltage, pwr = heater_energy(TIMES, VALS, [50.], [150.], resistance=10.)
+    assert np.allclose(pwr, 650. / 10. / 3600)
+    voltage, pwr = heater_energy([], [], [50., 150.], [150., 250.])
+    assert np.all(np.isnan(voltage)) and np.all(np.isnan(pwr))
@@ -0,0 +1,50 @@
+"""Checks the superposed-epoch reduction of epochs.py against curves worked
+by hand.
+
+usage:  python -m pytest test_epochs.py
+"""
+import numpy as np
+
+from epochs import epoch_pairs, superposed_epoch, cycle_epochs
+
+# Two events, and cycle start times around them:  with 1000 sec either side
+# and 500 sec bins (edges -1000, -500, 0, 500, 1000), the first event has
+# cycles in bins 0, 0, 1 and 2 and the second in bins 0 and 2; the cycles
+# at 9000 are outside both windows
+T_EVENTS = np.array([1000., 5000.])
+T_ON = np.array([0., 400., 900., 1100., 4000., 5200., 9000.])
+VALS = np.array([1., 3., 5., 7., 9., 11., 13.])
+WINDOW = {'before':1000., 'after':1000., 'width':500.}
+
+def _same(a, b):
+    return np.allclose(a, b, equal_nan=True)
+
+def test_epoch_pairs():
+    ev, sample, rel = epoch_pairs(T_EVENTS, T_ON, 1000., 1000.)
+    assert list(ev) == [0, 0, 0, 0, 1, 1]
+    assert list(sample) == [0, 1, 2, 3, 4, 5]
+    assert list(rel) == [-1000., -600., -100., 100., -1000., 200.]
+
+def test_superposed_mean():
+    out = superposed_epoch(T_EVENTS, T_ON, VALS, percentiles=[10, 50], **WINDOW)
+    assert list(out['t']) == [-750., -250., 250., 750.]
+    assert out['n_events'] == 2
+    assert _same(out['curves'], [[2., 5., 7., np.nan], [9., np.nan, 11., np.nan]])
+    assert list(out['n']) == [2, 1, 2, 0]
+    assert _same(out['mean'], [5.5, 5., 9., np.nan])
+    assert _same(out['p50'], [5.5, 5., 9., np.nan])
+    assert _same(out['p10'], [2.7, 5., 7.4, np.nan])
+
+def test_superposed_nan_and_count():
+    vals = VALS.copy()
+    vals[1] = np.nan #left out of its bin's mean
+    out = superposed_epoch(T_EVENTS, T_ON, vals, **WINDOW)
+    assert out['curves'][0, 0] == 1.
+    out = cycle_epochs({'t_on':T_ON}, T_EVENTS, 'count', **WINDOW)
+    assert _same(out['curves'], [[2., 1., 1., 0.], [1., 0., 1., 0.]])
+    assert _same(out['mean'], [1.5, 0.5, 1., 0.])
+
+def test_no_events():
+    out = superposed_epoch(np.zeros(0), T_ON, VALS, **WINDOW)
+    assert out['n_events'] == 0 and out['curves'].shape == (0, 4)
+    assert np.all(np.isnan(out['mean'])) and np.all(np.isnan(out['p50']))
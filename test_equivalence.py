@@ -0,0 +1,119 @@
+"""Checks that the faster paths through htr_dc give the same cycles as the
+straightforward one, on synthetic telemetry (see synthetic.py):  streamed vs.
+in-memory detection, an incrementally updated cycle store vs. one full run,
+fetches through a TlmCache vs. direct fetches, and prefix-sum energy vs.
+integrating each cycle on its own.
+
+usage:  python -m pytest test_equivalence.py
+"""
+import numpy as np
+
+import htr_dc
+import coarse
+from synthetic import SyntheticSource, HeaterModel
+from tlm_cache import TlmCache, FileBackend
+from energy import heater_energy, RESISTANCE
+
+T_START = '2020:001'
+T_STOP = '2020:061'
+
+# Detection settings matching HeaterModel's default set points
+SETTINGS = {'on_range':[55, 64], 'off_range':[66, 75], 'dur_lim':4*3600.}
+
+COLUMNS = ['t_on', 't_off', 'dur', 'voltage', 'pwr', 'per', 'dc']
+
+def _source(t_stop=T_STOP):
+    src = SyntheticSource(T_START, t_stop, seed=7)
+    src.add_heater('S1', HeaterModel())
+    return src
+
+def _assert_same(a, b, columns=COLUMNS):
+    assert len(a) == len(b)
+    for col in columns:
+        assert np.allclose(np.asarray(a[col], dtype=float), np.asarray(b[col], dtype=float),
+                           rtol=1e-12, atol=0, equal_nan=True), col
+
+def test_stream_matches_memory():
+    src = _source()
+    memory = htr_dc.htr_dc_stats('S1', T_START, T_STOP, source=src, **SETTINGS)
+    for chunk_days in [1, 7, 30]:
+        stream = htr_dc.htr_dc_stats('S1', T_START, T_STOP, source=src, chunk_days=chunk_days,
+                                     **SETTINGS)
+        _assert_same(stream.cycles, memory.cycles)
+        _assert_same(stream.daily, memory.daily, stream.daily.colnames)
+
+def test_store_matches_full_run(tmp_path):
+    #the store is only used up to the current time, so the source is grown
+    #one run at a time instead
+    src = _source()
+    full = htr_dc.htr_dc_stats('S1', T_START, source=src, **SETTINGS)
+    for stop in ['2020:010', '2020:011', '2020:030', T_STOP]:
+        src.t_stop = stop
+        stored = htr_dc.htr_dc_stats('S1', T_START, source=src, store_dir=str(tmp_path),
+                                     **SETTINGS)
+    _assert_same(stored.cycles, full.cycles)
+
+def test_minmax_matches_full_with_dropouts():
+    #long off-times keep the refinement windows sparse (no fallback); with
+    #seed 0 a dropout lands in the bin of the "on" at 2020:036:05:10
+    src = SyntheticSource(T_START, '2020:200', seed=0)
+    src.add_heater('S1', HeaterModel(on_time=3*3600., off_time=2*86400., noise=0, quant=0))
+    settings = {'on_range':[58, 61], 'off_range':[69, 72]}
+    full = htr_dc.htr_dc_stats('S1', T_START, '2020:200', source=src, **settings)
+    minmax = htr_dc.htr_dc_stats('S1', T_START, '2020:200', source=src, resolution=coarse.STAT,
+                                 **settings)
+    assert minmax.refinement['fallback'] == False
+    diff = coarse.compare_cycles(full.cycles, minmax.cycles)
+    assert diff['n_ref'] == 93
+    assert diff['n_missing'] == 0 and diff['n_extra'] == 0
+    assert diff['max_on_diff'] == 0 and diff['max_off_diff'] == 0
+
+def test_store_resumes_long_on(tmp_path):
+    #each run stops partway through an on-phase longer than OVERLAP, so its
+    #"on" must be picked up again by the next run
+    src = SyntheticSource(T_START, '2020:011', seed=3)
+    truth = src.add_heater('S1', HeaterModel(on_time=2*3600., off_time=3*3600., noise=0, quant=0,
+                                             dropout_rate=0, gap_rate=0))
+    full = htr_dc.htr_dc_stats('S1', T_START, source=src, **SETTINGS)
+    late_on = truth['t_on'] + 0.9 * (truth['t_off'] - truth['t_on'])
+    for stop in list(late_on[5::5][:9]) + ['2020:011']:
+        src.t_stop = stop
+        stored = htr_dc.htr_dc_stats('S1', T_START, source=src, store_dir=str(tmp_path),
+                                     **SETTINGS)
+    assert len(full.cycles) > 0.9 * len(truth['t_on'])
+    _assert_same(stored.cycles, full.cycles)
+
+def test_cache_matches_direct(tmp_path):
+    src = _source()
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    for msid, stat in [('S1', None), ('ELBV', '5min')]:
+        x = src.get(msid, T_START, T_STOP, stat=stat)
+        name = msid if stat == None else msid + '_' + stat
+        np.savez(str(archive / (name + '.npz')), times=x.times, vals=x.vals)
+    cache = TlmCache(str(tmp_path / 'cache'), FileBackend(str(archive)))
+    direct = htr_dc.htr_dc_stats('S1', T_START, T_STOP, source=src, **SETTINGS)
+    #overlapping and repeated requests exercise filling and reading segments
+    for t_start in ['2020:031', '2020:011', T_START, T_START]:
+        cached = htr_dc.htr_dc_stats('S1', t_start, T_STOP, source=cache, **SETTINGS)
+    _assert_same(cached.cycles, direct.cycles)
+    streamed = htr_dc.htr_dc_stats('S1', T_START, T_STOP, source=cache, chunk_days=7,
+                                   **SETTINGS)
+    _assert_same(streamed.cycles, direct.cycles)
+
+def test_energy_matches_per_cycle():
+    src = _source()
+    v = src.get('ELBV', T_START, T_STOP, stat='5min')
+    result = htr_dc.htr_dc_stats('S1', T_START, T_STOP, source=src, **SETTINGS)
+    t_on = np.asarray(result.cycles['t_on'])
+    t_off = np.asarray(result.cycles['t_off'])
+    voltage, pwr = heater_energy(v.times, v.vals, t_on, t_off)
+    #each sample held until the next, integrated over each cycle on its own
+    for j in range(len(t_on)):
+        edges = np.concatenate([[t_on[j]], v.times[(v.times > t_on[j]) & (v.times < t_off[j])],
+                                [t_off[j]]])
+        held = v.vals[np.maximum(np.searchsorted(v.times, edges[:-1], side='right') - 1, 0)]
+        v2 = np.sum(held**2 * np.diff(edges))
+        assert np.isclose(pwr[j], v2 / RESISTANCE / 3600, rtol=1e-9)
+        assert np.isclose(voltage[j], np.sqrt(v2 / (t_off[j] - t_on[j])), rtol=1e-9)
+    assert np.allclose(np.asarray(result.cycles['pwr']), pwr, rtol=1e-12)
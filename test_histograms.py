@@ -0,0 +1,71 @@
+"""Checks the fixed-bin histogram accumulators against hand-counted bins,
+and the heater on-time histogram built on them.
+
+usage:  python -m pytest test_histograms.py
+"""
+import numpy as np
+import pytest
+
+from histograms import Hist1D, Hist2D, merge_all
+from htr_dc import ON_TIME_EDGES, on_time_hist
+
+def test_hist1d():
+    h = Hist1D([0., 1., 2., 3.])
+    #the last bin includes its right edge; NaN is ignored
+    h.update([-1., 0., 0.5, 1., 2.9, 3., 3.5, np.nan])
+    assert list(h.counts) == [2., 1., 2.]
+    assert h.under == 1. and h.over == 1. and h.total() == 7.
+    h.update([1.5], weights=[2.5])
+    assert list(h.counts) == [2., 3.5, 2.]
+    edges, counts = Hist1D(np.arange(0, 11.)).update([2.5, 3.5, 6.5, 7.5]).occupied(n_bins=2)
+    assert list(edges) == [2., 5., 8.] and list(counts) == [2., 2.]
+
+def test_hist1d_merge_and_save(tmp_path):
+    a = Hist1D([0., 1., 2.]).update([0.5, 5.])
+    b = Hist1D([0., 1., 2.]).update([1.5, -5.])
+    total = merge_all([a, b])
+    assert list(total.counts) == [1., 1.] and total.under == 1. and total.over == 1.
+    #the inputs are left unchanged
+    assert list(a.counts) == [1., 0.]
+    filename = str(tmp_path / 'h.npz')
+    total.save(filename, t_counted=123.)
+    loaded, meta = Hist1D.load(filename)
+    assert list(loaded.counts) == [1., 1.] and loaded.total() == 4.
+    assert meta == {'t_counted':123.}
+    with pytest.raises(ValueError):
+        a.merge(Hist1D([0., 2.]))
+
+def test_hist2d(tmp_path):
+    h = Hist2D([0., 1., 2.], [0., 10., 20.])
+    h.update([0.5, 1.5, 2., 1.5, 3., np.nan], [5., 15., 20., 5., 5., 5.])
+    assert h.counts.tolist() == [[1., 0.], [1., 2.]]
+    assert h.outside == 1. and h.total() == 5.
+    other = Hist2D([0., 1., 2.], [0., 10., 20.]).update([0.5], [15.], weights=[3.])
+    h.merge(other)
+    assert h.counts.tolist() == [[1., 3.], [1., 2.]]
+    filename = str(tmp_path / 'h2.npz')
+    h.save(filename)
+    loaded, meta = Hist2D.load(filename)
+    assert loaded.counts.tolist() == h.counts.tolist() and loaded.outside == 1. and meta == {}
+
+def test_on_time_edges():
+    #0.1 minute (6 sec) bins over a day
+    assert len(ON_TIME_EDGES) == 14401 and ON_TIME_EDGES[-1] == 1440.
+    h = Hist1D(ON_TIME_EDGES).update(np.array([17., 18., 20., 24., 30., 1440*60., 1441*60.]) / 60)
+    assert list(np.flatnonzero(h.counts)) == [2, 3, 4, 5, 14399]
+    assert list(h.counts[[2, 3, 4, 5]]) == [1., 2., 1., 1.]
+    assert h.over == 1.
+
+def test_on_time_hist_store(tmp_path):
+    t_on = np.arange(10) * 1000.
+    dur = np.array([60., 66., 90., 600., 60., 6000., 12., 60., 90., 7.])
+    store = str(tmp_path)
+    on_time_hist('S1', t_on[:6], dur[:6], store, 'abc')
+    #only the four new cycles are added to the stored histogram
+    h = on_time_hist('S1', t_on, dur, store, 'abc')
+    assert np.array_equal(h.counts, Hist1D(ON_TIME_EDGES).update(dur / 60).counts)
+    assert h.counts[10] == 3. and h.counts[11] == 1. and h.counts[1] == 1.
+    #cycles that don't match the stored count are recounted from scratch
+    h = on_time_hist('S1', t_on[::2], dur[::2], store, 'abc')
+    assert h.total() == 5.
+    assert len(list(tmp_path.glob('on_time_hist_S1_*.npz'))) == 1
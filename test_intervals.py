@@ -0,0 +1,45 @@
+"""Checks IntervalIndex overlap queries against hand-worked intervals, and
+that htr_dc accepts the excluded time ranges as an array.
+
+usage:  python -m pytest test_intervals.py
+"""
+import numpy as np
+
+import htr_dc
+from intervals import IntervalIndex
+from synthetic import SyntheticSource, HeaterModel
+
+# Indexed intervals, unsorted, one long one spanning several of the queries
+INTERVALS = np.array([[50., 60.], [0., 100.], [10., 20.], [200., 210.]])
+
+# Query ranges:  inside the long interval, touching an end, between
+# intervals, and after all of them
+QUERIES = np.array([[15., 16.], [100., 150.], [150., 199.], [205., 300.], [300., 400.]])
+
+def test_overlaps():
+    idx = IntervalIndex(INTERVALS)
+    assert len(idx) == 4
+    assert list(idx.overlaps(QUERIES)) == [True, True, False, True, False]
+    assert list(IntervalIndex(np.zeros((0, 2))).overlaps(QUERIES)) == [False] * 5
+
+def test_query_pairs():
+    mask, q, i = IntervalIndex(INTERVALS).query(QUERIES)
+    assert list(mask) == [True, True, False, True, False]
+    #by query row, then interval start
+    assert list(q) == [0, 0, 1, 3]
+    assert list(i) == [1, 2, 1, 3]
+
+def test_exclude_array():
+    src = SyntheticSource('2020:001', '2020:011', seed=7)
+    src.add_heater('S1', HeaterModel())
+    settings = {'on_range':[55, 64], 'off_range':[66, 75], 'dur_lim':4*3600.}
+    full = htr_dc.htr_dc_stats('S1', '2020:001', '2020:011', source=src, **settings)
+    t_on = np.asarray(full.cycles['t_on'])
+    t_off = np.asarray(full.cycles['t_off'])
+    #one range inside the third cycle, one covering the fifth and sixth
+    exclude = np.array([[t_on[2] + 1, t_on[2] + 2], [t_on[4], t_off[5]]])
+    result = htr_dc.htr_dc_stats('S1', '2020:001', '2020:011', source=src, exclude=exclude,
+                                 **settings)
+    keep = np.ones(len(t_on), dtype='bool')
+    keep[[2, 4, 5]] = False
+    assert np.array_equal(np.asarray(result.cycles['t_on']), t_on[keep])
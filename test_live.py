@@ -0,0 +1,103 @@
+"""Checks the rolling-window state of htr_dc_live (RingBuffer and
+LiveHeater) against a hand-built sawtooth heater.
+
+usage:  python -m pytest test_live.py
+"""
+import os
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from htr_dc_live import RingBuffer, LiveHeater, write_updated_thru
+from time_bins import day_number, day_start
+from synthetic import SyntheticSource
+from energy import RESISTANCE
+
+# Sawtooth heater:  off (falling 70 -> 60 degF) for OFF sec, then on (rising
+# back to 70) for ON sec, sampled every DT sec, so the first "on" is at OFF
+# and every PERIOD after that, 16 cycles per day
+ON = 1800.
+OFF = 3600.
+PERIOD = ON + OFF
+DT = 60.
+
+# Bus voltage [V]
+VOLTS = 28.
+
+SETTINGS = {'on_range':[55, 64], 'off_range':[66, 75]}
+
+def _day0():
+    return day_start(day_number(DateTime('2020:001').secs))
+
+def _source():
+    t0 = _day0()
+    times = t0 + np.arange(0, 6*86400, DT)
+    phase = (times - t0) % PERIOD
+    vals = np.where(phase < OFF, 70 - 10 * phase / OFF, 60 + 10 * (phase - OFF) / ON)
+    src = SyntheticSource(t0, t0 + 6*86400)
+    src.add('S1', times, vals)
+    v_times = t0 + np.arange(-86400, 6*86400, 300.)
+    src.add('ELBV', v_times, VOLTS + np.zeros(len(v_times)), stat='5min')
+    return src
+
+def test_ring_buffer():
+    ring = RingBuffer(['t', 'n'], capacity=4, dtypes={'n':int})
+    ring.append(t=np.array([1., 2., 3.]), n=np.array([10, 20, 30]))
+    assert ring.drop_before('t', 2.5) == 2
+    #wraps around the end of the buffer
+    ring.append(t=np.array([4., 5., 6.]), n=np.array([40, 50, 60]))
+    assert len(ring) == 4 and ring.capacity() == 4
+    assert list(ring.column('t')) == [3., 4., 5., 6.]
+    assert list(ring.column('n', 2)) == [50, 60]
+    assert ring.count_before('t', 5.5) == 3
+    #grows (keeping the order) when full
+    ring.append(t=np.array([7.]), n=np.array([70]))
+    assert ring.capacity() == 8
+    assert list(ring.column('t')) == [3., 4., 5., 6., 7.]
+    assert ring.column('n').dtype.kind == 'i'
+    assert ring.drop_before('t', 6.) == 3 and ring.dropped == 5
+    assert list(ring.column('t')) == [6., 7.]
+
+def test_live_heater():
+    t0 = _day0()
+    heater = LiveHeater('S1', SETTINGS, days=2, source=_source())
+    #day 3 at noon:  the window is days 1 to 3, and the "on" at 214200 has no
+    #"off" yet (that sample isn't until 216000)
+    assert heater.update(t0 + 2.5*86400)
+    daily = heater.result().daily
+    assert list(daily['on_freq']) == [16, 16, 7]
+    assert np.allclose(daily['on_time'], np.array([16, 16, 7]) * ON)
+    assert np.allclose(daily['dc'][:2], 16 * ON / 864.)
+    assert np.allclose(daily['per'][:2], PERIOD)
+    cycles = heater.result().cycles
+    assert np.allclose(cycles['t_on'] - t0, OFF + PERIOD * np.arange(39))
+    assert np.allclose(cycles['voltage'], VOLTS)
+    assert np.allclose(cycles['pwr'], VOLTS**2 / RESISTANCE * ON / 3600)
+    #day 4 at 06:00:  day 1 ages out, the pending "on" pairs with its "off"
+    assert heater.update(t0 + 3.25*86400)
+    result = heater.result()
+    assert list(result.daily['on_freq']) == [16, 16, 3]
+    assert np.allclose(result.cycles['t_on'] - t0, OFF + PERIOD * np.arange(16, 51))
+    assert np.allclose(result.times[[0, -1]] - t0, [86400, 3.25*86400 - DT])
+    #nothing new
+    assert not heater.update(t0 + 3.25*86400)
+
+def test_live_heater_exclude():
+    t0 = _day0()
+    exclude = np.array([[t0 + OFF + PERIOD - 10, t0 + OFF + PERIOD + 10]])
+    heater = LiveHeater('S1', dict(SETTINGS, exclude=exclude), days=2, source=_source())
+    heater.update(t0 + 2.5*86400)
+    assert list(heater.result().daily['on_freq']) == [15, 16, 7]
+
+def test_updated_thru(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    t0 = _day0()
+    heaters = [LiveHeater('S1', SETTINGS, days=2, source=_source()) for j in range(2)]
+    #no heater has telemetry yet
+    write_updated_thru(heaters)
+    assert not os.path.exists('updated_thru.html')
+    heaters[0].update(t0 + 2.5*86400)
+    write_updated_thru(heaters)
+    f = open('updated_thru.html')
+    assert f.read().endswith(DateTime(t0 + 2.5*86400 - DT).date)
+    f.close()
@@ -0,0 +1,54 @@
+"""Checks that the columnar product tables are appended, replaced and read
+back as expected.
+
+usage:  python -m pytest test_products.py
+"""
+import numpy as np
+
+from astropy.table import Table
+
+import htr_dc
+from products import append_table, load_column, load_table, table_dir, write_products
+from synthetic import SyntheticSource, HeaterModel
+
+META = {'msid':'S1'}
+
+def test_append_replaces_overlap(tmp_path):
+    path = table_dir(str(tmp_path), 'S1', 'daily')
+    append_table(path, Table([[0., 1., 2.], [5., 6., 7.]], names=['t', 'on_freq']), 't', META)
+    #rows from t=1 on are replaced, and the new column is NaN before them
+    append_table(path, Table([[1., 3.], [16., 17.], [50., 51.]], names=['t', 'on_freq', 'dc']),
+                 't', META)
+    daily = load_table(str(tmp_path), 'S1', 'daily')
+    assert daily.colnames == ['t', 'on_freq', 'dc']
+    assert list(daily['t']) == [0., 1., 3.]
+    assert list(daily['on_freq']) == [5., 16., 17.]
+    assert np.isnan(daily['dc'][0]) and list(daily['dc'][1:]) == [50., 51.]
+    assert str(daily['dc'].unit) == '%'
+    assert daily.meta['rows'] == 3 and daily.meta['msid'] == 'S1'
+    #an empty table keeps what's stored
+    append_table(path, Table([[], []], names=['t', 'on_freq']), 't', META)
+    assert list(load_column(str(tmp_path), 'S1', 'daily', 't')) == [0., 1., 3.]
+
+def test_load_column_is_mapped(tmp_path):
+    path = table_dir(str(tmp_path), 'S1', 'cycles')
+    append_table(path, Table([[10., 20.], [30., 45.]], names=['t_on', 't_off']), 't_on', META)
+    t_off = load_column(str(tmp_path), 'S1', 'cycles', 't_off')
+    assert isinstance(t_off, np.memmap)
+    assert list(t_off) == [30., 45.]
+    assert load_table(str(tmp_path), 'S1', 'cycles', ['t_off']).colnames == ['t_off']
+
+def test_write_products(tmp_path):
+    src = SyntheticSource('2020:001', '2020:011', seed=7)
+    src.add_heater('S1', HeaterModel())
+    settings = {'on_range':[55, 64], 'off_range':[66, 75], 'dur_lim':4*3600.}
+    result = htr_dc.htr_dc_stats('S1', '2020:001', '2020:011', source=src, **settings)
+    write_products(result, str(tmp_path))
+    for table in ['cycles', 'daily', 'monthly']:
+        expected = getattr(result, table)
+        stored = load_table(str(tmp_path), 'S1', table)
+        assert len(stored) == len(expected)
+        for col in stored.colnames:
+            assert np.array_equal(np.asarray(stored[col]), np.asarray(expected[col]),
+                                  equal_nan=True), (table, col)
+    assert len(load_table(str(tmp_path), 'S1', 'daily')) == 10
@@ -0,0 +1,67 @@
+"""Checks that publish copies only new or changed files and keeps its
+manifest current.
+
+usage:  python -m pytest test_publish.py
+"""
+import os
+import json
+import hashlib
+
+from publish import publish, read_manifest, file_hash, MANIFEST
+
+def _write(path, text):
+    f = open(str(path), 'w')
+    f.write(text)
+    f.close()
+    return str(path)
+
+def _read(path):
+    f = open(str(path))
+    out = f.read()
+    f.close()
+    return out
+
+def test_publish_changed_only(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    dest = str(tmp_path / 'web')
+    files = [_write(src / 'a.png', 'aaa'), _write(src / 'b.png', 'bbb'),
+             _write(src / 'c.html', 'ccc')]
+    copied, unchanged = publish(files, dest, workers=4)
+    assert sorted(copied) == sorted(files) and unchanged == []
+    assert _read(os.path.join(dest, 'b.png')) == 'bbb'
+    manifest = read_manifest(dest)
+    assert manifest['a.png'] == {'sha1':hashlib.sha1(b'aaa').hexdigest(), 'size':3}
+    assert file_hash(files[0]) == manifest['a.png']['sha1']
+    #nothing changed
+    assert publish(files, dest) == ([], files)
+    #one file edited, one deleted from the destination
+    _write(src / 'b.png', 'bbbb')
+    os.remove(os.path.join(dest, 'c.html'))
+    copied, unchanged = publish(files, dest, workers=1)
+    assert copied == files[1:] and unchanged == files[:1]
+    assert _read(os.path.join(dest, 'b.png')) == 'bbbb'
+    assert read_manifest(dest)['b.png']['size'] == 4
+    #no temporary files left behind
+    assert sorted(os.listdir(dest)) == sorted(['a.png', 'b.png', 'c.html', MANIFEST])
+
+def test_publish_keeps_other_entries(tmp_path):
+    dest = str(tmp_path / 'web')
+    first = _write(tmp_path / 'a.png', 'aaa')
+    second = _write(tmp_path / 'b.png', 'bbb')
+    publish([first], dest)
+    publish([second], dest)
+    assert sorted(read_manifest(dest)) == ['a.png', 'b.png']
+
+def test_unreadable_manifest(tmp_path):
+    dest = tmp_path / 'web'
+    dest.mkdir()
+    _write(dest / MANIFEST, '{not json')
+    name = _write(tmp_path / 'a.png', 'aaa')
+    _write(dest / 'a.png', 'aaa')
+    assert read_manifest(str(dest)) == {}
+    #everything is republished, and the manifest rewritten
+    assert publish([name], str(dest)) == ([name], [])
+    f = open(str(dest / MANIFEST))
+    assert sorted(json.load(f)) == ['a.png']
+    f.close()
@@ -0,0 +1,66 @@
+"""Checks stats_index range queries against statistics worked by hand from a
+small set of product tables.
+
+usage:  python -m pytest test_stats_index.py
+"""
+import numpy as np
+
+from astropy.table import Table
+from Chandra.Time import DateTime
+
+from stats_index import sparse_table, range_query, build_index, HeaterIndex
+from products import append_table, table_dir
+from time_bins import day_number, day_start
+
+def test_sparse_table():
+    vals = [5., 3., 8., 1., 9., 2.]
+    mins = sparse_table(vals, np.minimum)
+    maxes = sparse_table(vals, np.maximum)
+    for i0, i1 in [(0, 1), (1, 4), (4, 6), (0, 6), (2, 5)]:
+        assert range_query(mins, np.minimum, i0, i1) == min(vals[i0:i1])
+        assert range_query(maxes, np.maximum, i0, i1) == max(vals[i0:i1])
+
+def _products(products_dir):
+    #two cycles on 2020:001 and one on 2020:003, with the products updated
+    #through 2020:006, so the index covers 2020:001 - 2020:006
+    day0 = day_number(DateTime('2020:001').secs)
+    t0 = day_start(day0)
+    cycles = Table([[t0 + 3600, t0 + 10800, t0 + 2*86400 + 3600], [600., 1200., 900.],
+                    [1., 2., 3.], [7200., 2*86400 - 7200, np.nan]],
+                   names=['t_on', 'dur', 'pwr', 'per'])
+    daily = Table([day_start(day0 + np.arange(3))], names=['t'])
+    meta = {'msid':'S1', 'updated_thru':'2020:006:12:00:00'}
+    append_table(table_dir(products_dir, 'S1', 'cycles'), cycles, 't_on', meta)
+    append_table(table_dir(products_dir, 'S1', 'daily'), daily, 't', meta)
+    build_index(products_dir, 'S1')
+    return HeaterIndex(products_dir, 'S1')
+
+def test_query(tmp_path):
+    idx = _products(str(tmp_path))
+    assert idx.n_days == 6
+    s = idx.query('2020:001', '2020:004')
+    assert s['days'] == 3 and s['count'] == 3
+    assert s['on_time'] == 2700. and s['energy'] == 6.
+    assert np.isclose(s['duty_cycle'], 2700. / (3*86400) * 100)
+    assert np.isclose(s['mean_dur'], 900.)
+    assert np.isclose(s['std_dur'], np.sqrt(60000.))
+    assert s['min_dur'] == 600. and s['max_dur'] == 1200.
+    assert np.isclose(s['mean_period'], 86400.)
+    #a start partway through a day counts the whole day
+    s = idx.query('2020:001:12:00:00', '2020:002')
+    assert s['days'] == 1 and s['count'] == 2 and s['max_dur'] == 1200.
+    s = idx.query('2020:002', '2020:006')
+    assert s['days'] == 4 and s['count'] == 1
+    assert s['min_dur'] == 900. and s['max_dur'] == 900. and np.isnan(s['mean_period'])
+
+def test_query_outside_cycles(tmp_path):
+    idx = _products(str(tmp_path))
+    #after the last cycle, but within the products' timeframe
+    s = idx.query('2020:004', '2020:010')
+    assert s['days'] == 3 and s['count'] == 0
+    assert s['duty_cycle'] == 0. and np.isnan(s['mean_dur']) and np.isnan(s['min_dur'])
+    #only the days within the timeframe are counted
+    s = idx.query('2019:360', '2020:002')
+    assert s['days'] == 1 and s['count'] == 2
+    s = idx.query('2021:001', '2021:010')
+    assert s['days'] == 0 and s['count'] == 0 and np.isnan(s['duty_cycle'])
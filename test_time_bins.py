@@ -0,0 +1,51 @@
+"""Checks the day and month numbering of time_bins against hand-counted
+calendar dates, and the month bucketing built on it.
+
+usage:  python -m pytest test_time_bins.py
+"""
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+from time_bins import day_number, month_number, day_start, month_start, day_month, day_range
+from utilities import count_by_month, sum_by_month
+
+# 1998-2019 hold 22 years, five of them leap years (2000 ... 2016)
+DAY_2020 = 22*365 + 5
+MONTH_2020 = 22*12
+
+def test_day_and_month_numbers():
+    assert day_number(DateTime('1998:001').secs) == 0
+    assert day_number(DateTime('2020:001').secs) == DAY_2020
+    #the leap day, then the first of March
+    assert day_number(DateTime('2020-02-29 12:00:00').secs) == DAY_2020 + 59
+    assert month_number(DateTime('2020-02-29 12:00:00').secs) == MONTH_2020 + 1
+    assert day_month(DAY_2020 + 59) == MONTH_2020 + 1
+    assert day_month(DAY_2020 + 60) == MONTH_2020 + 2
+    assert day_start(DAY_2020) == DateTime('2020:001').secs
+    assert month_start(MONTH_2020 + 2) == DateTime('2020-03-01 00:00:00').secs
+
+def test_boundaries():
+    start = day_start(DAY_2020 + 1)
+    #a day starts at its first second, not the one before
+    assert list(day_number(np.array([start - 1, start, start + 86399]))) == \
+        [DAY_2020, DAY_2020 + 1, DAY_2020 + 1]
+    with pytest.raises(ValueError):
+        day_number(DateTime('1997:365').secs)
+
+def test_day_range():
+    #a t_stop at the start of a day leaves that day out
+    assert list(day_range('2020:001', '2020:003')) == [DAY_2020, DAY_2020 + 1]
+    assert list(day_range('2020:001:12:00:00', '2020:003:00:00:01')) == \
+        [DAY_2020, DAY_2020 + 1, DAY_2020 + 2]
+
+def test_by_month():
+    times = ['2020-01-31 23:59:59', '2020-02-01 00:00:00', '2020-02-15 00:00:00',
+             '2020-04-01 00:00:00']
+    month_times, counts = count_by_month(times)
+    assert list(counts) == [1, 2, 0, 1]
+    assert list(month_number(month_times)) == [MONTH_2020, MONTH_2020 + 1, MONTH_2020 + 2,
+                                               MONTH_2020 + 3]
+    month_times, sums = sum_by_month(times, [1., 2., 3., 4.])
+    assert list(sums) == [1., 5., 0., 4.]
@@ -0,0 +1,34 @@
+"""Checks the .npy sidecar cache of the text table readers in utilities.
+
+usage:  python -m pytest test_utilities.py
+"""
+import numpy as np
+
+from utilities import read_torque_table, write_torque_table
+
+# A small torque table, one row per line
+TABLE = np.array([[1., 2., 3.], [4.5, -5., 6.], [7., 8., 9.25]])
+
+def test_torque_table_sidecar(tmp_path):
+    filename = str(tmp_path / 'torque.csv')
+    write_torque_table(TABLE, filename)
+    parsed = read_torque_table(filename)
+    assert not isinstance(parsed, np.memmap)
+    assert np.array_equal(parsed, TABLE)
+    assert len(list(tmp_path.glob('torque.csv.*.npy'))) == 1
+    #the second read maps the sidecar instead of reparsing
+    cached = read_torque_table(filename)
+    assert isinstance(cached, np.memmap)
+    assert np.array_equal(cached, TABLE)
+    #writes stay in memory (copy-on-write)
+    cached[0, 0] = -1.
+    assert np.array_equal(read_torque_table(filename), TABLE)
+    assert np.array_equal(read_torque_table(filename, cache=False), TABLE)
+
+def test_edited_table_reparsed(tmp_path):
+    filename = str(tmp_path / 'torque.csv')
+    write_torque_table(TABLE, filename)
+    read_torque_table(filename)
+    write_torque_table(TABLE[:2] * 2, filename)
+    assert np.array_equal(read_torque_table(filename), TABLE[:2] * 2)
+    assert len(list(tmp_path.glob('torque.csv.*.npy'))) == 1
@@ -0,0 +1,74 @@
+import numpy as np
+
+from Chandra.Time import DateTime
+
+# Span of the cached calendar tables
+FIRST_YEAR = 1998
+LAST_YEAR = 2050
+
+# Day and month boundary tables in DateTime seconds (built on first use)
+_TABLES = {}
+
+def _tables():
+    """Returns the cached day and month boundary tables, building them on the
+    first call.  'day_secs' holds the start of each day from 1998-01-01
+    through LAST_YEAR, 'month_secs' the start of each month, and 'day_month'
+    the month number that each day falls in.
+    """
+    if len(_TABLES) == 0:
+        months = ['%04d-%02d-01 00:00:00.000' % (year, month)
+                  for year in range(FIRST_YEAR, LAST_YEAR + 2) for month in range(1, 13)]
+        month_mjd = DateTime(months).mjd
+        day_mjd = np.arange(month_mjd[0], month_mjd[-1] + 1)
+        _TABLES['month_secs'] = DateTime(months).secs
+        _TABLES['day_secs'] = DateTime(day_mjd, format='mjd').secs
+        _TABLES['day_month'] = np.searchsorted(month_mjd, day_mjd, side='right') - 1
+    return _TABLES
+
+def _lookup(edges, secs):
+    secs = np.asarray(secs, dtype=float)
+    idx = np.searchsorted(edges, secs, side='right') - 1
+    if np.any((idx < 0) | (idx >= len(edges) - 1)):
+        raise ValueError('Times outside of ' + str(FIRST_YEAR) + '-' + str(LAST_YEAR))
+    return idx
+
+def day_number(secs):
+    """This function returns the day number (days since 1998-01-01) that each
+    of an array of DateTime seconds falls in, without any string formatting.
+    """
+    return _lookup(_tables()['day_secs'], secs)
+
+def month_number(secs):
+    """This function returns the month number (months since 1998-01) that
+    each of an array of DateTime seconds falls in.
+    """
+    return _lookup(_tables()['month_secs'], secs)
+
+def day_start(days):
+    """This function returns the start of each day number in DateTime seconds."""
+    return _tables()['day_secs'][np.asarray(days)]
+
+def month_start(months):
+    """This function returns the start of each month number in DateTime seconds."""
+    return _tables()['month_secs'][np.asarray(months)]
+
+def day_month(days):
+    """This function returns the month number that each day number falls in."""
+    return _tables()['day_month'][np.asarray(days)]
+
+def day_range(t_start, t_stop=None):
+    """This function returns the day numbers of every day that begins before
+    t_stop (default is current time), starting with the day containing t_start.
+    """
+    start = DateTime(t_start).secs
+    stop = DateTime(t_stop).secs
+    last = day_number(stop)
+    if day_start(last) == stop:
+        last = last - 1
+    return np.arange(day_number(start), last + 1)
+
+def strs_to_secs(dates):
+    """This function converts an array of date strings (in any DateTime
+    format) to DateTime seconds in one call.
+    """
+    return DateTime(np.asarray(dates)).secs
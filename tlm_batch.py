@@ -0,0 +1,129 @@
+import os
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from tlm_cache import CachedMsid, split_stat
+
+class TlmBundle(object):
+    """Telemetry acquired up front for a whole run, handed out to each heater
+    as zero-copy slices.  Has the same get(msid, t_start, t_stop, stat) method
+    as tlm_cache.TlmCache so it can be passed to htr_dc as its source.
+
+    Requests for an msid or timeframe that was not acquired are passed on to
+    the fallback source (or fetched directly from the engineering archive if
+    there is no fallback).
+
+    Once spilled to a directory (see spill), the bundle pickles as the paths
+    of its memory-mapped files, so worker processes started by spawn or
+    forkserver map the same files instead of receiving copies.
+    """
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+        self.data = {}
+        self.files = {}
+
+    def spill(self, directory):
+        """Saves every acquired series to .npy files in directory and
+        replaces it with read-only memory maps of them.
+        """
+        for i, key in enumerate(sorted(self.data, key=repr)):
+            b_start, b_stop, times, vals = self.data[key]
+            paths = (os.path.join(directory, 'tlm%d_times.npy' % i),
+                     os.path.join(directory, 'tlm%d_vals.npy' % i))
+            np.save(paths[0], times)
+            np.save(paths[1], vals)
+            self.files[key] = paths
+            self.data[key] = (b_start, b_stop, np.load(paths[0], mmap_mode='r'),
+                              np.load(paths[1], mmap_mode='r'))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['data'] = dict((key, val if key not in self.files else val[:2] + (None, None))
+                             for key, val in self.data.items())
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for key, paths in self.files.items():
+            self.data[key] = self.data[key][:2] + (np.load(paths[0], mmap_mode='r'),
+                                                   np.load(paths[1], mmap_mode='r'))
+
+    def add(self, msid, stat, t_start, t_stop, times, vals):
+        """Adds telemetry for one msid/stat covering t_start to t_stop (None
+        meaning through the end of available telemetry).
+        """
+        self.data[(msid, stat)] = (t_start, t_stop, times, vals)
+
+    def covers(self, msid, t_start, t_stop=None, stat=None):
+        """Returns True if the requested timeframe was acquired."""
+        if (msid, stat) not in self.data:
+            return False
+        b_start, b_stop, times, vals = self.data[(msid, stat)]
+        if DateTime(t_start).secs < b_start:
+            return False
+        if b_stop == None:
+            return True
+        return t_stop != None and DateTime(t_stop).secs <= b_stop
+
+    def get(self, msid, t_start, t_stop=None, stat=None):
+        if not self.covers(msid, t_start, t_stop, stat):
+            if self.fallback != None:
+                return self.fallback.get(msid, t_start, t_stop, stat=stat)
+            import Ska.engarchive.fetch_eng as fetch
+            archive_stat, attr = split_stat(stat)
+            x = fetch.Msid(msid, t_start, t_stop, stat=archive_stat)
+            return CachedMsid(msid, stat, x.times, getattr(x, attr))
+        b_start, b_stop, times, vals = self.data[(msid, stat)]
+        i0 = np.searchsorted(times, DateTime(t_start).secs)
+        i1 = len(times) if t_stop == None else np.searchsorted(times, DateTime(t_stop).secs)
+        return CachedMsid(msid, stat, times[i0:i1], vals[i0:i1])
+
+def union_ranges(needs):
+    """This function collapses a list of (msid, t_start, t_stop, stat) needs
+    into one (t_start, t_stop) range in seconds per (msid, stat), spanning
+    every request for that msid/stat.  A t_stop of None (open-ended) wins.
+    """
+    out = {}
+    for msid, t_start, t_stop, stat in needs:
+        start = DateTime(t_start).secs
+        stop = None if t_stop == None else DateTime(t_stop).secs
+        if (msid, stat) in out:
+            o_start, o_stop = out[(msid, stat)]
+            start = min(start, o_start)
+            stop = None if (stop == None or o_stop == None) else max(stop, o_stop)
+        out[(msid, stat)] = (start, stop)
+    return out
+
+def acquire(needs, source=None):
+    """This function fetches all the telemetry needed for a run in as few
+    requests as possible and returns a TlmBundle.
+
+    Inputs:
+       needs    List of (msid, t_start, t_stop, stat) for every fetch the run
+                will make (duplicates and overlapping ranges are fine)
+       source   Telemetry source (e.g. a tlm_cache.TlmCache) to acquire through
+                and fall back on.  If None, msids sharing a stat are fetched
+                together with fetch.Msidset over the union of their ranges.
+    """
+    ranges = union_ranges(needs)
+    bundle = TlmBundle(fallback=source)
+    if source != None:
+        for (msid, stat), (start, stop) in ranges.items():
+            x = source.get(msid, start, stop, stat=stat)
+            bundle.add(msid, stat, start, stop, x.times, x.vals)
+        return bundle
+
+    import Ska.engarchive.fetch_eng as fetch
+    #e.g. the mins and maxes of a 5-minute stat come from the same fetch
+    for archive_stat in set(split_stat(stat)[0] for msid, stat in ranges):
+        group = [(msid, s, ranges[(msid, s)]) for msid, s in ranges 
+                 if split_stat(s)[0] == archive_stat]
+        msids = sorted(set(msid for msid, s, r in group))
+        start = min(r[0] for msid, s, r in group)
+        stops = [r[1] for msid, s, r in group]
+        stop = None if None in stops else max(stops)
+        tlm = fetch.Msidset(msids, start, stop, stat=archive_stat)
+        for msid, s, r in group:
+            bundle.add(msid, s, start, stop, tlm[msid].times, getattr(tlm[msid], split_stat(s)[1]))
+    return bundle
@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import contextlib
+import numpy as np
+
+from Chandra.Time import DateTime
+
+# Segments an entry may have before they are compacted into one
+MAX_SEGMENTS = 64
+
+# Telemetry this recent may still be arriving, so an empty fetch at the end
+# of a request isn't recorded as covered [sec]
+ARRIVAL = 7 * 86400.
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+def _unique_times(times, vals):
+    """Drops samples repeated where segments meet, keeping the first."""
+    times, keep = np.unique(times, return_index=True)
+    return times, vals[keep]
+
+def split_stat(stat):
+    """This function splits a stat name into the engineering archive stat and
+    the attribute of the fetched telemetry holding its values, so that the 
+    mins or maxes of a statistic can be requested as their own series.
+
+    e.g. split_stat('5min.mins') returns ('5min', 'mins')
+         split_stat('5min') returns ('5min', 'vals')
+    """
+    if stat == None or '.' not in stat:
+        return stat, 'vals'
+    return tuple(stat.split('.', 1))
+
+class EngArchiveBackend(object):
+    """Fetches telemetry from the Ska engineering archive."""
+    def fetch(self, msid, t_start, t_stop, stat=None):
+        import Ska.engarchive.fetch_eng as fetch
+        archive_stat, attr = split_stat(stat)
+        x = fetch.Msid(msid, t_start, t_stop, stat=archive_stat)
+        return x.times, getattr(x, attr)
+
+class FileBackend(object):
+    """Reads telemetry from local files, standing in for the engineering
+    archive in tests and offline runs.  Each msid/stat is read from
+    <directory>/<msid>.npz (or <msid>_<stat>.npz) with 'times' and 'vals'
+    arrays, times in DateTime seconds.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, msid, t_start, t_stop, stat=None):
+        name = msid if stat == None else msid + '_' + stat
+        f = np.load(os.path.join(self.directory, name + '.npz'))
+        times = f['times']
+        vals = f['vals']
+        f.close()
+        i0, i1 = np.searchsorted(times, [t_start, t_stop])
+        return times[i0:i1], vals[i0:i1]
+
+class CachedMsid(object):
+    """Telemetry for one msid returned by TlmCache.get, with the same .times
+    and .vals attributes as fetch.Msid.  The arrays are read-only views into
+    the memory-mapped cache files when the request falls within one cached
+    segment.
+    """
+    def __init__(self, msid, stat, times, vals):
+        self.msid = msid
+        self.stat = stat
+        self.times = times
+        self.vals = vals
+
+def missing_ranges(coverage, t_start, t_stop):
+    """This function returns an nx2 array of the sub-ranges of t_start to
+    t_stop that are not covered by the (sorted, non-overlapping) nx2 array of
+    coverage intervals.
+    """
+    out = []
+    t = t_start
+    for c_start, c_stop in coverage:
+        if c_stop <= t:
+            continue
+        if c_start >= t_stop:
+            break
+        if c_start > t:
+            out.append([t, c_start])
+        t = max(t, c_stop)
+    if t < t_stop:
+        out.append([t, t_stop])
+    return np.array(out).reshape(-1, 2)
+
+def merge_ranges(ranges):
+    """This function merges an nx2 array of (possibly overlapping) ranges into
+    a sorted array of non-overlapping ranges.
+    """
+    ranges = np.asarray(ranges, dtype=float).reshape(-1, 2)
+    if len(ranges) == 0:
+        return ranges
+    ranges = ranges[np.argsort(ranges[:, 0])]
+    stops = np.maximum.accumulate(ranges[:, 1])
+    new = np.concatenate([[True], ranges[1:, 0] > stops[:-1]])
+    starts = ranges[new, 0]
+    ends = stops[np.concatenate([np.nonzero(new)[0][1:] - 1, [len(ranges) - 1]])]
+    return np.column_stack([starts, ends])
+
+class TlmCache(object):
+    """On-disk telemetry cache in front of the engineering archive.
+
+    Times and values for each msid/stat are stored as segments of .npy files
+    that are memory-mapped on read.  Each fill appends new segments rather
+    than rewriting what's cached, so topping up costs only the new data; 
+    once an entry has more than MAX_SEGMENTS they are compacted into one.
+    The time ranges already fetched are tracked (including ranges the
+    archive had no data for) so only the missing sub-ranges of a request are
+    fetched from the backend.  When the cache grows beyond max_bytes, the
+    least recently used msids are evicted.
+
+    Fills and the LRU index are guarded by fcntl locks, so heaters run in
+    parallel processes can share a cache.
+
+    Inputs:
+       cache_dir    Directory to hold cached telemetry
+       backend      Object with a fetch(msid, t_start, t_stop, stat) method
+                    returning (times, vals) (default is EngArchiveBackend)
+       max_bytes    Size limit for the cache (default is 2 GB)
+
+    e.g. cache = TlmCache('tlm_cache')
+         x = cache.get('PM3THV1T', '2013:001', '2013:090')
+    """
+    def __init__(self, cache_dir, backend=None, max_bytes=2e9):
+        self.cache_dir = cache_dir
+        self.backend = EngArchiveBackend() if backend == None else backend
+        self.max_bytes = max_bytes
+        _makedirs(cache_dir)
+
+    def _entry(self, msid, stat):
+        return msid if stat == None else msid + '_' + stat
+
+    def _path(self, entry, name):
+        return os.path.join(self.cache_dir, entry, name + '.npy')
+
+    def _load(self, entry, name, mmap_mode='r'):
+        path = self._path(entry, name)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode=mmap_mode)
+
+    def _save(self, entry, name, a):
+        path = self._path(entry, name)
+        tmp = path + '.' + str(os.getpid()) + '.tmp.npy'
+        np.save(tmp, a)
+        os.rename(tmp, path)
+
+    @contextlib.contextmanager
+    def _lock(self, entry, shared=False):
+        """Holds an fcntl lock on an entry (exclusive for fills, shared for
+        reads).  The lock file lives in the entry's directory, so if the
+        entry was evicted while waiting for it, the lock is taken again.
+        """
+        path = os.path.join(self.cache_dir, entry, '.lock')
+        while True:
+            _makedirs(os.path.dirname(path))
+            f = open(path, 'a')
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            if os.path.exists(path) and os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                break
+            f.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def _segments(self, entry):
+        """Returns the nx3 array of an entry's segments:  the first and last
+        sample time and the id of each, sorted by time.
+        """
+        segs = self._load(entry, 'segments', mmap_mode=None)
+        return np.zeros((0, 3)) if segs is None else segs
+
+    def coverage(self, msid, stat=None):
+        """Returns an nx2 array of the time ranges cached for an msid/stat."""
+        entry = self._entry(msid, stat)
+        if not os.path.exists(self._path(entry, 'segments')):
+            return np.zeros((0, 2)) #nothing cached (or a cache from before segments)
+        cov = self._load(entry, 'coverage', mmap_mode=None)
+        return np.zeros((0, 2)) if cov is None else cov
+
+    def get(self, msid, t_start, t_stop=None, stat=None):
+        """Returns the telemetry for an msid between t_start and t_stop
+        (default is current time), fetching only the parts of that timeframe
+        that have not already been cached.
+        """
+        entry = self._entry(msid, stat)
+        start = DateTime(t_start).secs
+        stop = DateTime(t_stop).secs
+        if len(missing_ranges(self.coverage(msid, stat), start, stop)) > 0:
+            with self._lock(entry):
+                #another process may have filled it while we waited
+                cov = self.coverage(msid, stat)
+                gaps = missing_ranges(cov, start, stop)
+                if len(gaps) > 0:
+                    self._fill(entry, msid, stat, cov, gaps, stop)
+        with self._lock(entry, shared=True):
+            times, vals = self._read(entry, start, stop)
+        self._touch(entry)
+        return CachedMsid(msid, stat, times, vals)
+
+    def _read(self, entry, start, stop):
+        """Returns the cached samples from start to stop:  read-only views
+        into the memory-mapped files if they fall in a single segment,
+        otherwise the concatenation of each segment's slice.
+        """
+        segs = self._segments(entry)
+        segs = segs[(segs[:, 1] >= start) & (segs[:, 0] < stop)]
+        times = []
+        vals = []
+        for first, last, seg in segs:
+            t = self._load(entry, 'seg%d_times' % seg)
+            i0, i1 = np.searchsorted(t, [start, stop])
+            if i1 > i0:
+                times.append(t[i0:i1])
+                vals.append(self._load(entry, 'seg%d_vals' % seg)[i0:i1])
+        if len(times) == 0:
+            return np.zeros(0), np.zeros(0)
+        if len(times) == 1:
+            return times[0], vals[0]
+        return _unique_times(np.concatenate(times), np.concatenate(vals))
+
+    def _fill(self, entry, msid, stat, cov, gaps, stop):
+        """Fetches the missing ranges of a request and appends them as new
+        segments.  Ranges the backend has no data for are recorded as
+        covered, except the end of a request within ARRIVAL of the current
+        time, where telemetry may still be arriving.
+        """
+        segs = self._segments(entry)
+        if len(segs) == 0:
+            self._clear(entry) #files left by an older cache layout
+        seg = int(np.max(segs[:, 2])) + 1 if len(segs) > 0 else 0
+        new_segs = [segs]
+        new_cov = [cov]
+        recent = DateTime().secs - ARRIVAL
+        for gap_start, gap_stop in gaps:
+            times, vals = self.backend.fetch(msid, gap_start, gap_stop, stat=stat)
+            times = np.asarray(times)
+            if gap_stop == stop and gap_stop > recent:
+                gap_stop = min(gap_stop, times[-1] + 0.001) if len(times) > 0 else gap_start
+            if gap_stop > gap_start:
+                new_cov.append([[gap_start, gap_stop]])
+            if len(times) == 0:
+                continue
+            self._save(entry, 'seg%d_times' % seg, times)
+            self._save(entry, 'seg%d_vals' % seg, np.asarray(vals))
+            new_segs.append([[times[0], times[-1], seg]])
+            seg = seg + 1
+        segs = np.concatenate(new_segs)
+        segs = segs[np.argsort(segs[:, 0], kind='mergesort')]
+        if len(segs) > MAX_SEGMENTS:
+            segs = self._compact(entry, segs, seg)
+        #segments are written before the table listing them, so readers
+        #never see a segment that isn't there
+        self._save(entry, 'segments', segs)
+        self._save(entry, 'coverage', merge_ranges(np.concatenate(new_cov)))
+        self._evict(keep_entry=entry)
+
+    def _compact(self, entry, segs, seg):
+        """Combines all of an entry's segments into one with the given id,
+        returning the new segment table.  Only done while holding the entry's
+        exclusive lock; readers that mapped the old segments keep their maps.
+        """
+        times = np.concatenate([self._load(entry, 'seg%d_times' % s, mmap_mode=None) 
+                                for s in segs[:, 2]])
+        vals = np.concatenate([self._load(entry, 'seg%d_vals' % s, mmap_mode=None) 
+                               for s in segs[:, 2]])
+        times, vals = _unique_times(times, vals)
+        self._save(entry, 'seg%d_times' % seg, times)
+        self._save(entry, 'seg%d_vals' % seg, vals)
+        for s in segs[:, 2]:
+            os.remove(self._path(entry, 'seg%d_times' % s))
+            os.remove(self._path(entry, 'seg%d_vals' % s))
+        return np.array([[times[0], times[-1], seg]])
+
+    def _clear(self, entry):
+        d = os.path.join(self.cache_dir, entry)
+        for name in os.listdir(d):
+            if name.endswith('.npy'):
+                os.remove(os.path.join(d, name))
+
+    @contextlib.contextmanager
+    def _index_lock(self):
+        f = open(os.path.join(self.cache_dir, 'index.lock'), 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def _read_index(self):
+        path = os.path.join(self.cache_dir, 'index.json')
+        if not os.path.exists(path):
+            return {}
+        f = open(path)
+        index = json.load(f)
+        f.close()
+        return index
+
+    def _write_index(self, index):
+        path = os.path.join(self.cache_dir, 'index.json')
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        f = open(tmp, 'w')
+        json.dump(index, f)
+        f.close()
+        os.rename(tmp, path)
+
+    def _touch(self, entry):
+        with self._index_lock():
+            index = self._read_index()
+            index[entry] = time.time()
+            self._write_index(index)
+
+    def _size(self, entry):
+        d = os.path.join(self.cache_dir, entry)
+        if not os.path.isdir(d):
+            return 0
+        return sum(os.path.getsize(os.path.join(d, f)) for f in os.listdir(d))
+
+    def _evict(self, keep_entry=None):
+        """Removes least recently used entries until the cache fits within
+        max_bytes.  The entry currently being written, and entries another
+        process holds a lock on, are never evicted.
+        """
+        with self._index_lock():
+            index = self._read_index()
+            index[keep_entry] = time.time()
+            sizes = dict((entry, self._size(entry)) for entry in index)
+            total = sum(sizes.values())
+            for entry in sorted(index, key=lambda e: index[e]):
+                if total <= self.max_bytes:
+                    break
+                if entry == keep_entry:
+                    continue
+                path = os.path.join(self.cache_dir, entry)
+                if os.path.isdir(path):
+                    f = open(os.path.join(path, '.lock'), 'a')
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except (IOError, OSError):
+                        f.close()
+                        continue #in use
+                    shutil.rmtree(path, ignore_errors=True)
+                    f.close()
+                total = total - sizes[entry]
+                del index[entry]
+            self._write_index(index)
@@ -1,8 +1,21 @@
+import os
+import glob
 import numpy as np 
 from matplotlib import pyplot as pp
 
 from Chandra import Time
 
+from bucket_stats import bucket_count, bucket_sum
+from time_bins import month_number, month_start, strs_to_secs
+from intervals import IntervalIndex
+from dropouts import dropout_masks, TOL
+from histograms import Hist2D
+
+# Redundant MUPS thermistor comparisons used by remove_therm_dropouts
+MUPS_PAIRS = [('PM1THV1T', 'PM1THV2T', 10), 
+              ('PM2THV1T', 'PM2THV2T', 10), 
+              ('PM1THV2T', 'PM2THV2T', 30)]
+
 #from bad_times import nsm, ssm
 
 def overlap(table1, table2):
@@ -15,76 +28,117 @@ def overlap(table1, table2):
     The output will be True if the corresponding range in table1
     overlaps with any range in table2.  The output will be
     otherwise False.
+
+    For the matching rows of table2 as well, use intervals.IntervalIndex.query.
     """
-    out = np.zeros(np.size(table1, axis=0), dtype='bool')
-    for i in range(np.size(table1, axis=0)):
-        s1_s2 = table1[i, 0] < table2[:, 0] 
-        s1_e2 = table1[i, 0] <= table2[:, 1]
-        e1_s2 = table1[i, 1] < table2[:, 0]
-        e1_e2 = table1[i, 1] < table2[:, 1]
-        # no overlap occurs when all four parameters above either == 0 or 1
-        sum_params = np.sum(np.array([s1_s2, s1_e2, e1_s2, e1_e2]), axis=0)
-        olap = (sum_params == 1) | (sum_params == 2) | (sum_params == 3)
-        out[i] = np.any(olap)
-    return out
+    return IntervalIndex(table2).overlaps(table1)
 
 def str_to_secs(table):
     """This function will take a table of time ranges formatted as strings 
     (compatible with bad_times) and convert it to an nx2 array in DateTime 
     seconds
     """
-    out = np.zeros([len(table), 2])
-    for i in range(len(table)):
-        t1, t2 = table[i].split()
-        out[i, 0] = Time.DateTime(t1).secs
-        out[i, 1] = Time.DateTime(t2).secs
-    return out    
+    if len(table) == 0:
+        return np.zeros([0, 2])
+    fields = np.array([row.split() for row in table]).reshape(-1, 2)
+    return strs_to_secs(fields.ravel()).reshape(-1, 2)
+
+def _sidecar_name(filename):
+    """Returns the name of the binary sidecar cache for a text file, keyed by
+    the file's modification time (in nanoseconds) and size so that an edited
+    file is reparsed, even within the same second.
+    """
+    st = os.stat(filename)
+    mtime = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+    return filename + '.' + str(mtime) + '_' + str(st.st_size) + '.npy'
+
+def _is_sidecar(filename, path):
+    """Returns True if path is named like a sidecar of filename (see 
+    _sidecar_name), so that no other file sharing its prefix is removed.
+    """
+    name = os.path.basename(path)
+    base = os.path.basename(filename)
+    if not name.startswith(base + '.') or not name.endswith('.npy'):
+        return False
+    key = name[len(base) + 1:-4].split('_')
+    return len(key) == 2 and key[0].isdigit() and key[1].isdigit()
 
-def read_torque_table(table):
-    """This function reads a comma-delimited text file of 31x136 solar torque  
-    values and outputs the values as an array
+def _load_sidecar(filename):
+    """Returns the sidecar array for a text file, or None if there is no 
+    up-to-date sidecar.  It is memory mapped copy-on-write, so only the rows
+    used are read, and like a freshly parsed file it can be written to
+    (without changing the sidecar).
     """
+    sidecar = _sidecar_name(filename)
+    if not os.path.exists(sidecar):
+        return None
+    return np.load(sidecar, mmap_mode='c')
+
+def _save_sidecar(filename, A):
+    """Writes the sidecar array for a text file, removing the file's stale
+    sidecars.  Failure to write (e.g. a read-only directory) is not an error.
+    """
+    sidecar = _sidecar_name(filename)
+    try:
+        for old in glob.glob(filename + '.*.npy'):
+            if old != sidecar and _is_sidecar(filename, old):
+                os.remove(old)
+        tmp = sidecar + '.' + str(os.getpid()) + '.tmp.npy'
+        np.save(tmp, A)
+        os.rename(tmp, sidecar)
+    except (IOError, OSError):
+        pass
+
+def read_torque_table(table, cache=True):
+    """This function reads a comma- or whitespace-delimited text file of solar 
+    torque values and outputs the values as an array, with one row per line.
+
+    The parsed array is saved alongside the file as a .npy sidecar, so later 
+    reads (while the file is unchanged) are a binary load instead of a 
+    reparse.  Set cache=False to skip the sidecar.
+    """
+    if cache:
+        out = _load_sidecar(table)
+        if out is not None:
+            return out
     f = open(table)
-    lines = f.readlines()
+    text = f.read()
     f.close()
-    out = np.zeros((61, 136))
-    line_num = 0
-    for line in lines:
-        fields = line.split()
-        out[line_num, :] = [float(field) for field in fields]
-        line_num = line_num + 1
+    n_rows = len([line for line in text.splitlines() if line.strip()])
+    out = np.fromstring(text.replace(',', ' '), sep=' ')
+    out = out.reshape(n_rows, -1)
+    if cache:
+        _save_sidecar(table, out)
     return out
 
 def write_torque_table(A, filename):
     """This function writes an array A to a comma-delimited text file with a 
     user-defined filename.
     """
-    f = open(filename, 'w')
-    for row in range(np.size(A, axis=0)):
-        A[row,:].tofile(f, sep=',')
-        f.write('\n')
-    f.close()    
+    np.savetxt(filename, A, fmt='%s', delimiter=',')
 
-def read_MCC_results(table):
+def read_MCC_results(table, cache=True):
     """This function reads a fixed-width text file generated by MCC's momentum
     plot using the telemetry overlay and Plot2Text functions.
     Returns time, predictions, actual values
+
+    As with read_torque_table, the parsed values are cached in a .npy sidecar
+    (set cache=False to skip it).
     """
-    f = open(table)
-    lines = f.readlines()
-    lines = lines[1:] # discard header line
-    f.close()
-    t = np.zeros(len(lines))
-    predicts = np.zeros((len(lines), 3))
-    actuals = np.zeros((len(lines), 3))
-    line_num = 0
-    for line in lines:
-        fields = line.split()
-        t[line_num] = Time.DateTime(fields[0]).secs
-        predicts[line_num, :] = [float(field) for field in fields[1:4]]
-        actuals[line_num, :] = [float(field) for field in fields[5:8]]
-        line_num = line_num + 1
-    return t, predicts, actuals
+    data = _load_sidecar(table) if cache else None
+    if data is None:
+        f = open(table)
+        lines = f.readlines()
+        lines = lines[1:] # discard header line
+        f.close()
+        fields = np.array([line.split()[:8] for line in lines if line.strip()]).reshape(-1, 8)
+        data = np.zeros((len(fields), 7))
+        data[:, 0] = strs_to_secs(fields[:, 0]) if len(fields) > 0 else []
+        data[:, 1:4] = fields[:, 1:4].astype(float)
+        data[:, 4:7] = fields[:, 5:8].astype(float)
+        if cache:
+            _save_sidecar(table, data)
+    return data[:, 0], data[:, 1:4], data[:, 4:7]
 
 def find_last_before(a, b):
     """This function returns an array of length a with the indices of 
@@ -126,31 +180,37 @@ def ceil_to_value(number, round_to):
     round_to = float(round_to)
     return (np.ceil(number / round_to) * round_to)    
     
-def heat_map(x, y, bins=(20,20), colorbar=True, **kwargs):
+def heat_map(x, y=None, bins=(20,20), colorbar=True, **kwargs):
     """Plots a "heat map", i.e. a scatter plot highlighting density
 
     Based on an exmple from 
     http://www.physics.ucdavis.edu/~dwittman/Matplotlib-examples/
 
     Inputs: 
-    x = x vals (as from a scatter plot)
+    x = x vals (as from a scatter plot), or a histograms.Hist2D already
+        accumulated (e.g. chunk by chunk over mission-length telemetry)
     y = y vals (as from a scatter plot)
     bins = int or tuple bins to feed into histogram2d
     colorbar = whether or not to display colorbar (default=True)
     x_lim = x limits of plot
     y_lim = y_limits of plot
     """
-    if kwargs.has_key('x_lim'):
-        x_lim = kwargs.pop('x_lim')
-    else:  
-        x_lim = [np.min(x), np.max(x)]
-    if kwargs.has_key('y_lim'):
-        y_lim = kwargs.pop('y_lim')
-    else:  
-        y_lim = [min(y), max(y)]
-    hist,xedges,yedges = np.histogram2d(x,y,bins=bins,range=[x_lim,y_lim])
-    extent = [xedges[0], xedges[-1], yedges[0], yedges[-1]]
-    pp.imshow(hist.T,extent=extent,interpolation='nearest',origin='lower', aspect='auto')
+    if isinstance(x, Hist2D):
+        hist = x
+    else:
+        if 'x_lim' in kwargs:
+            x_lim = kwargs.pop('x_lim')
+        else:  
+            x_lim = [np.min(x), np.max(x)]
+        if 'y_lim' in kwargs:
+            y_lim = kwargs.pop('y_lim')
+        else:  
+            y_lim = [min(y), max(y)]
+        nx, ny = (bins, bins) if np.isscalar(bins) else bins
+        hist = Hist2D(np.linspace(x_lim[0], x_lim[1], nx + 1), 
+                      np.linspace(y_lim[0], y_lim[1], ny + 1)).update(x, y)
+    extent = [hist.xedges[0], hist.xedges[-1], hist.yedges[0], hist.yedges[-1]]
+    pp.imshow(hist.counts.T,extent=extent,interpolation='nearest',origin='lower', aspect='auto')
     if colorbar==True:
         pp.colorbar()
     pp.show()    
@@ -188,17 +248,20 @@ def append_to_array(a, pos=-1, val=0):
         out = np.concatenate([a, val_a])
     return out
     
-def remove_therm_dropouts(tlm):
+def remove_therm_dropouts(tlm, pairs=MUPS_PAIRS, tol=TOL):
     """Attempts to remove MUPS-1 and MUPS-2 thermistor dropouts from a 
     telemetry data set acquired by:
         fetch.Msidset(['PM1THV1T','PM1THV2T','PM2THV1T','PM2THV2T'],
                       starttime, endtime)
 
-    The timestamps for each msid must be the same.  This can be accomplished
-    by using the '5min' or 'daily' statistics or by using the .interpolate
-    function.
+    Full-resolution telemetry can be used directly; samples are compared 
+    with the nearest sample of the other thermistor (see 
+    dropouts.dropout_masks, which handles any set of redundant thermistors).
+    If the timestamps for each msid are the same (e.g. '5min' or 'daily' 
+    statistics), an interval flagged in any comparison is removed from all 
+    four msids.
     
-    Returns the same telemetry set with intervals removed for the following 
+    Returns the same telemetry set with samples removed for the following 
     conditions:
         -MUPS-1A & MUPS-1B temps vary by > 10 deg F
         -MUPS-2A & MUPS-2B temps vary by > 10 deg F
@@ -215,47 +278,42 @@ def remove_therm_dropouts(tlm):
     Note that MUPS-1B is the only thermistor in this set that does not 
     currently experience dropouts.    
     """
-    msids = ['PM1THV1T', 'PM1THV2T', 'PM2THV1T', 'PM2THV2T']
-    mups1a = tlm['PM1THV1T'].vals
-    mups1b = tlm['PM1THV2T'].vals
-    mups2a = tlm['PM2THV1T'].vals
-    mups2b = tlm['PM2THV2T'].vals
-    t = tlm['PM1THV1T'].times
+    msids = sorted(set([a for a, b, thresh in pairs] + [b for a, b, thresh in pairs]))
+    masks = dropout_masks(tlm, pairs, tol)
+    t = tlm[msids[0]].times
+    if all(len(tlm[msid].times) == len(t) and np.all(tlm[msid].times == t) for msid in msids):
+        keep = np.all([masks[msid] for msid in msids], axis=0)
+        masks = dict((msid, keep) for msid in msids)
     for msid in msids:
-        if np.any(tlm[msid].times != t):
-            raise inputError('Time sets do not match')
-    dropout_1 = np.abs(mups1a - mups1b) > 10
-    dropout_2 = np.abs(mups2a - mups2b) > 10
-    dropout_b = np.abs(mups1b - mups2b) > 30   
-    dropouts = dropout_1 | dropout_2 | dropout_b 
-    for msid in msids:
-        tlm[msid].times = tlm[msid].times[~dropouts]
-        tlm[msid].vals = tlm[msid].vals[~dropouts]
+        tlm[msid].times = tlm[msid].times[masks[msid]]
+        tlm[msid].vals = tlm[msid].vals[masks[msid]]
     return tlm
 
+def _month_buckets(times):
+    """Returns the mid-month times spanning the timeframe of the given times,
+    along with the month bucket that each of the times falls into.
+    """
+    len_mo = 365.25/12*24*3600
+    secs = Time.DateTime(times).secs
+
+    #Create an array that spans the timeframe with one date in the middle-ish of every month
+    mo_start = month_number(np.min(secs))
+    mo_stop = month_number(np.max(secs))
+    x_start = month_start(mo_start) + 14.5*24*3600
+    x_times = x_start + np.arange(mo_stop - mo_start + 1) * len_mo
+
+    #Collect the month for each date
+    t_month_i = month_number(secs) - mo_start
+    return x_times, t_month_i
+
 def count_by_month(times):
     """Counts the number of times an event occurs each month.
     Inputs a set of DateTime times (in any format). 
     Outputs an array of DateTime times spanning the timeframe with one entry per month
     and the count of events that occur within that month
     """    
-    len_mo = 365.25/12*24*3600
-
-    #Create an array that spans the timeframe with one date in the middle-ish of every month
-    x_start = DateTime(min(DateTime(times).secs)).iso[:7] + '-15 12:00:00.00'
-    x_stop = DateTime(max(DateTime(times).secs)).iso[:7] + '-15 12:00:00.00'
-    x_times = arange(DateTime(x_start).secs, DateTime(x_stop).secs, len_mo) 
-    
-    #Collect the year and month for each date
-    t_month = [DateTime(t).iso[:7] for t in times]
-    x_month = [DateTime(x).iso[:7] for x in x_times]
-    
-    num_months = len(x_times)
-    month_sums = zeros(num_months)
-    for i in arange(num_months):
-        match = [t == x_month[i] for t in t_month]
-        month_counts[i] = sum(match)
-    month_times = x_times
+    month_times, t_month_i = _month_buckets(times)
+    month_counts = bucket_count(t_month_i, len(month_times))
     return month_times, month_counts
 
 def sum_by_month(times, vals):
@@ -264,21 +322,6 @@ def sum_by_month(times, vals):
     Outputs an array of DateTime times spanning the timeframe with one entry per month
     and the sum of events that occur within that month
     """    
-    len_mo = 365.25/12*24*3600
-
-    #Create an array that spans the timeframe with one date in the middle-ish of every month
-    x_start = DateTime(min(DateTime(times).secs)).iso[:7] + '-15 12:00:00.00'
-    x_stop = DateTime(max(DateTime(times).secs)).iso[:7] + '-15 12:00:00.00'
-    x_times = arange(DateTime(x_start).secs, DateTime(x_stop).secs, len_mo) 
-    
-    #Collect the year and month for each date
-    t_month = [DateTime(t).iso[:7] for t in times]
-    x_month = [DateTime(x).iso[:7] for x in x_times]
-    
-    num_months = len(x_times)
-    month_sums = zeros(num_months)
-    for i in arange(num_months):
-        match = [t == x_month[i] for t in t_month]
-        month_sums[i] = sum(vals[match])
-    month_times = x_times
-    return month_times, month_sums    
\ No newline at end of file
+    month_times, t_month_i = _month_buckets(times)
+    month_sums = bucket_sum(t_month_i, vals, len(month_times))
+    return month_times, month_sums